@@ -0,0 +1,71 @@
+"""
+Build-time consistency check for planilha_endo10.xlsx.
+
+Usage:
+    python analyze_spreadsheet.py [--output diagnosis_lookup.json] [--strict]
+
+Prints a summary of the canonicalized spreadsheet (conflicting duplicates,
+unreachable rows, answer combinations without a diagnosis, percussion
+wildcard rows shadowed by explicit rows, localized sheet coverage) and optionally writes the complete
+precomputed lookup table. Exits with status 1 when conflicting duplicates are
+found, or with --strict when any combination has no diagnosis.
+"""
+import argparse
+import json
+import os
+import sys
+
+# Importing main builds the compiled tables; offline mode keeps it from needing an API key.
+os.environ.setdefault("OFFLINE_MODE", "1")
+
+import main  # noqa: E402
+
+
+def print_summary(report: dict):
+    print(f"Knowledge base version: {report['knowledge_base_version']}")
+    print(f"Spreadsheet rows: {report['rows']}")
+    print(f"Combination space: {report['combination_space']} "
+          f"({report['reachable_combinations']} reachable, "
+          f"{report['combinations_with_diagnosis']} with a diagnosis)")
+    print(f"Conflicting duplicates: {len(report['conflicting_duplicates'])}")
+    for entry in report["conflicting_duplicates"]:
+        print(f"  rows {entry['rows']}: {entry['answers']}")
+    print(f"Redundant duplicates: {len(report['redundant_duplicates'])}")
+    print(f"Unreachable rows: {len(report['unreachable_rows'])}")
+    for entry in report["unreachable_rows"]:
+        print(f"  row {entry['row']}: {entry['reason']}")
+    print(f"Combinations without diagnosis: {len(report['combinations_without_diagnosis'])}")
+    fully = sum(1 for entry in report["wildcard_shadowed_rows"] if entry["fully_shadowed"])
+    print(f"Wildcard rows shadowed by explicit percussion rows: "
+          f"{len(report['wildcard_shadowed_rows'])} ({fully} fully shadowed)")
+    for language, sheet in report["localized_sheets"].items():
+        print(f"Localized sheet '{sheet['sheet']}' ({language}): {sheet['rows']} rows, "
+              f"{len(sheet['combinations_using_primary_texts'])} combinations fall back to primary texts")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the complete lookup table to this JSON file")
+    parser.add_argument("--report", help="write the full analysis report to this JSON file")
+    parser.add_argument("--strict", action="store_true", help="fail when any combination has no diagnosis")
+    args = parser.parse_args(argv)
+
+    report = main.analyze_spreadsheet()
+    print_summary(report)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(main.export_diagnosis_lookup(), fh, ensure_ascii=False, separators=(",", ":"))
+
+    if report["conflicting_duplicates"]:
+        return 1
+    if args.strict and report["combinations_without_diagnosis"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
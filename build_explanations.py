@@ -0,0 +1,92 @@
+"""
+Build the pre-generated explanation corpus served by /explicacao/.
+
+Usage:
+    python build_explanations.py [--languages English,Portuguese] [--output explanations.bin]
+                                 [--workers 4] [--force]
+
+Enumerates the unique (2009/2013, 2025, complementary) diagnosis triples of
+planilha_endo10.xlsx and writes one explanation per triple and language to a
+memory-mappable artifact (see main.ExplanationCorpus). Entries already present
+in the current artifact are reused unless --force is given, so re-running after
+a failure only generates what is missing. Explanations come from the upstream
+model only (no offline template). Exits with status 1 when any explanation
+could not be generated; those are left out and the others are still written.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--languages", default=os.getenv("EXPLANATION_LANGUAGES", "English,Portuguese"),
+                        help="comma-separated language names, as detected for sessions")
+    parser.add_argument("--output", default=main.EXPLANATIONS_FILE, help="artifact path")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent upstream requests")
+    parser.add_argument("--force", action="store_true", help="regenerate entries already in the artifact")
+    args = parser.parse_args(argv)
+
+    languages = [language.strip() for language in args.languages.split(",") if language.strip()]
+    triples = sorted(set(main.DIAGNOSIS_TEXTS["en"]))
+    keys = [(language, *triple) for language in languages for triple in triples]
+
+    previous = None if args.force else main.load_explanation_corpus(args.output)
+    entries = {}
+    missing = []
+    for key in keys:
+        text = previous.get(*key) if previous is not None else None
+        if text is None:
+            missing.append(key)
+        else:
+            entries[key] = text
+    print(f"{len(triples)} diagnoses x {len(languages)} languages: "
+          f"{len(entries)} reused, {len(missing)} to generate")
+
+    if missing and main.OFFLINE_MODE:
+        print("Offline mode: set OPENAI_API_KEY to generate the missing explanations.", file=sys.stderr)
+        return 1
+
+    # Only the upstream model may answer here, never a previous corpus.
+    main.EXPLANATION_CORPUS = None
+    failures = 0
+
+    def generate(key):
+        # Straight to the upstream: generate_explanation() would hide failures
+        # behind the offline template, which must never end up in the corpus.
+        model = main.MODEL_EXPLAIN
+        try:
+            response = main.resilient_chat_completion({
+                "model": model,
+                "messages": main.build_explanation_messages(*key),
+                "temperature": 0.2,
+                "timeout": main.LLM_TIMEOUTS.get(model, main.LLM_DEFAULT_TIMEOUT),
+            })
+            return key, (response.choices[0].message.content or "").strip()
+        except Exception as e:
+            return key, e
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        for key, result in pool.map(generate, missing):
+            if isinstance(result, Exception) or not result:
+                failures += 1
+                print(f"  failed [{key[0]}] {key[1]}: {result}", file=sys.stderr)
+            else:
+                entries[key] = result
+
+    content_sha256 = main.write_explanation_corpus(args.output, entries, {
+        "knowledge_base_version": main.KNOWLEDGE_BASE_VERSION,
+        "languages": languages,
+        "model": main.MODEL_EXPLAIN,
+    })
+    print(f"Wrote {len(entries)} explanations to {args.output} (sha256 {content_sha256[:16]})")
+    if failures:
+        print(f"{failures} explanations could not be generated; re-run to retry them.", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
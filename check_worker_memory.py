@@ -0,0 +1,136 @@
+"""
+Reproducible check that per-worker memory stays low as gunicorn workers are added.
+
+For each worker count (1, 2 and 4 by default) the app is started with
+gunicorn.conf.py (preload_app + gc.freeze), every worker is asked for /stats
+until all of them have answered, and the memory of each worker process is read
+from /proc/<pid>/smaps_rollup:
+
+    RSS  resident pages, shared ones counted in full (what /stats reports)
+    PSS  shared pages divided among the processes sharing them
+    USS  pages private to the worker (what adding one more worker costs)
+
+    python check_worker_memory.py
+    python check_worker_memory.py --workers 1 2 4 8 --max-uss-ratio 0.5
+
+Exits with status 1 when the mean USS per worker at any worker count exceeds
+--max-uss-ratio times the RSS of the single-worker run, i.e. when the data
+inherited from the master stops being shared. Linux only (needs /proc).
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def smaps_rollup_kb(pid: int) -> dict:
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_kb": values.get("Rss", 0),
+        "pss_kb": values.get("Pss", 0),
+        "uss_kb": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def child_pids(pid: int) -> list:
+    children = []
+    for task in Path(f"/proc/{pid}/task").iterdir():
+        children.extend(int(child) for child in (task / "children").read_text().split())
+    return sorted(children)
+
+
+def get_stats(url: str):
+    try:
+        with urllib.request.urlopen(f"{url}/stats", timeout=2) as response:
+            return json.load(response)
+    except OSError:
+        return None
+
+
+def measure(workers: int, timeout: float) -> list:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    tmp = tempfile.mkdtemp(prefix="endo10-memcheck-")
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(workers),
+        "PORT": str(port),
+        "SESSION_STORE": "sqlite",
+        "SESSION_DB_PATH": os.path.join(tmp, "sessions.sqlite3"),
+        "JOBS_DB_PATH": os.path.join(tmp, "jobs.sqlite3"),
+        "EVENT_LOG_DIR": "",
+        "OFFLINE_MODE": "1",
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "offline"),
+    }
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "main:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        reported = {}
+        deadline = time.time() + timeout
+        # Requests are spread over the workers by the kernel; keep asking until every worker answered.
+        while time.time() < deadline and len(reported) < workers:
+            stats = get_stats(url)
+            if stats is None:
+                time.sleep(0.2)
+                continue
+            reported[stats["pid"]] = stats["process_rss_kb"]
+        if len(reported) < workers:
+            raise RuntimeError(f"only {len(reported)} of {workers} workers answered /stats within {timeout:.0f}s")
+        return [
+            {"pid": pid, "stats_rss_kb": reported.get(pid), **smaps_rollup_kb(pid)}
+            for pid in child_pids(master.pid)
+        ]
+    finally:
+        master.terminate()
+        master.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--max-uss-ratio", type=float, default=0.5,
+                        help="max mean USS per worker, as a fraction of the single-worker RSS")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for every worker")
+    args = parser.parse_args()
+
+    runs = {count: measure(count, args.timeout) for count in sorted(set([1, *args.workers]))}
+    baseline_rss = runs[1][0]["rss_kb"]
+    failed = False
+    print(f"{'workers':>7} {'pid':>8} {'/stats rss':>11} {'rss':>9} {'pss':>9} {'uss':>9}  (MB)")
+    for count, processes in runs.items():
+        for proc in processes:
+            print(f"{count:>7} {proc['pid']:>8} {(proc['stats_rss_kb'] or 0) / 1024:>11.1f} "
+                  f"{proc['rss_kb'] / 1024:>9.1f} {proc['pss_kb'] / 1024:>9.1f} {proc['uss_kb'] / 1024:>9.1f}")
+        mean_uss = sum(proc["uss_kb"] for proc in processes) / len(processes)
+        mean_pss = sum(proc["pss_kb"] for proc in processes) / len(processes)
+        ratio = mean_uss / baseline_rss
+        status = "ok" if ratio <= args.max_uss_ratio else "FAIL"
+        failed |= status == "FAIL"
+        print(f"{count:>7} {'mean':>8} {'':>11} {'':>9} {mean_pss / 1024:>9.1f} {mean_uss / 1024:>9.1f}"
+              f"  uss/single-rss={ratio:.2f} {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Local stand-in for the OpenAI chat completions API, used to exercise the
+resilience layer and for load testing without network access or cost.
+
+Usage:
+    uvicorn fake_openai:app --port 8001
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake uvicorn main:app
+
+Fault injection (environment variables):
+    FAKE_LATENCY_MS    base latency per request (default 0)
+    FAKE_JITTER_MS     extra uniformly distributed latency (default 0)
+    FAKE_ERROR_RATE    fraction of requests that fail, 0..1 (default 0)
+    FAKE_ERROR_STATUS  HTTP status used for injected failures (default 503)
+
+The same settings can be changed at runtime with POST /_fault
+(JSON body with latency_ms, jitter_ms, error_rate, error_status).
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+
+FAULTS = {
+    "latency_ms": float(os.getenv("FAKE_LATENCY_MS", "0")),
+    "jitter_ms": float(os.getenv("FAKE_JITTER_MS", "0")),
+    "error_rate": float(os.getenv("FAKE_ERROR_RATE", "0")),
+    "error_status": int(os.getenv("FAKE_ERROR_STATUS", "503")),
+}
+COUNTERS = {"requests": 0, "errors": 0}
+
+
+def fake_content(body: dict) -> str:
+    messages = body.get("messages", [])
+    prompt = messages[-1].get("content", "") if messages else ""
+
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        if prompt.startswith("Translate each string"):
+            return json.dumps({"translations": json.loads(prompt.rsplit("\n\n", 1)[-1])}, ensure_ascii=False)
+        # Extraction prompt: answer with the first allowed code at high confidence.
+        match = re.search(r'"code":\s*"([a-z0-9_]+)"', prompt)
+        return json.dumps({"code": match.group(1) if match else None, "confidence": 0.9 if match else 0.0})
+    if prompt.startswith("Detect the language"):
+        return "English"
+    if prompt.startswith("Translate the following text"):
+        return prompt.split("\n\n", 1)[-1]
+    return "This is a simulated explanation of the diagnostic result."
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    COUNTERS["requests"] += 1
+
+    delay = FAULTS["latency_ms"] + random.uniform(0, FAULTS["jitter_ms"])
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+
+    if random.random() < FAULTS["error_rate"]:
+        COUNTERS["errors"] += 1
+        return JSONResponse(
+            status_code=FAULTS["error_status"],
+            content={"error": {"message": "Injected failure", "type": "server_error"}},
+        )
+
+    content = fake_content(body)
+    if body.get("stream"):
+        return StreamingResponse(stream_chunks(body, content), media_type="text/event-stream")
+    return {
+        "id": f"chatcmpl-fake-{COUNTERS['requests']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": fake_usage(body, content),
+    }
+
+
+def fake_usage(body: dict, content: str) -> dict:
+    # ~4 characters per token, so token budgets are exercised against the fake upstream.
+    prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in body.get("messages", []))
+    completion_tokens = len(content) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+async def stream_chunks(body: dict, content: str):
+    """Server-sent events in the chat.completion.chunk format, one word per chunk."""
+    base = {
+        "id": f"chatcmpl-fake-{COUNTERS['requests']}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+    }
+    words = re.findall(r"\S+\s*", content)
+    for i, word in enumerate(words):
+        delta = {"role": "assistant", "content": word} if i == 0 else {"content": word}
+        chunk = {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(0)
+    yield f"data: {json.dumps({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/_fault")
+async def set_faults(request: Request):
+    FAULTS.update(await request.json())
+    return FAULTS
+
+
+@app.get("/_stats")
+async def stats():
+    return {**COUNTERS, "faults": FAULTS}
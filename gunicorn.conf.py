@@ -0,0 +1,45 @@
+"""
+Multi-worker deployment for Endo10 EVO.
+
+Usage:
+    gunicorn -c gunicorn.conf.py main:app
+
+Settings (environment variables):
+    WEB_CONCURRENCY  number of worker processes (default 1)
+    PORT             listening port (default 8080)
+    SESSION_STORE    must be "sqlite" when WEB_CONCURRENCY > 1 so that every
+                     worker sees the same sessions (SESSION_DB_PATH sets the file)
+    EVENT_LOG_DIR    must be empty when WEB_CONCURRENCY > 1: the event log has a
+                     single writer and replays into the in-memory store
+    FORWARDED_ALLOW_IPS  proxies trusted to set X-Forwarded-For (default
+                     127.0.0.1); the client address behind them keys the
+                     anonymous rate limits. Use "*" only when the app is
+                     reachable exclusively through the proxy.
+
+The application is imported once in the master process (preload_app), so the
+spreadsheet, the canonicalized diagnosis table and the option catalog are built
+a single time and inherited by the workers through fork. gc.freeze() moves all
+of those objects to the permanent generation before forking, so the garbage
+collector never writes to their pages and they stay shared copy-on-write
+instead of being duplicated in every worker. check_worker_memory.py verifies
+this by comparing per-worker RSS/PSS/USS with 1, 2 and 4 workers.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Without this every request behind the proxy appears to come from the proxy,
+# and all anonymous clients would share a single rate-limit bucket.
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+if workers > 1 and os.getenv("SESSION_STORE", "memory").strip().lower() == "memory":
+    raise RuntimeError("WEB_CONCURRENCY > 1 requires SESSION_STORE=sqlite (sessions must be shared between workers).")
+if workers > 1 and os.getenv("EVENT_LOG_DIR", "").strip():
+    raise RuntimeError("WEB_CONCURRENCY > 1 cannot be used with EVENT_LOG_DIR (the event log has a single writer process).")
+
+
+def when_ready(server):
+    gc.freeze()
@@ -0,0 +1,235 @@
+"""
+Load generator simulating concurrent clinicians running full screenings.
+
+Each virtual clinician loops over realistic sessions:
+greeting -> answers until the screening completes -> /diagnostico/ ->
+/explicacao/ -> /pdf/{session_id}. Answers are random valid options, so the
+sessions cover the whole spreadsheet. While the test runs, /stats is polled
+to track the size of the session store and the server RSS.
+
+Needs the development requirements (pip install -r requirements-dev.txt).
+Typical run against a local fake upstream with realistic latency:
+
+    FAKE_LATENCY_MS=400 FAKE_JITTER_MS=600 uvicorn fake_openai:app --port 8001
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake uvicorn main:app --port 8080
+    python loadtest.py --base-url http://127.0.0.1:8080 --clinicians 50 --duration 60
+
+Reports throughput, latency percentiles per endpoint and session-store growth.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+
+import httpx
+
+# English question line -> (field, answers a clinician may type).
+QUESTIONS = {
+    "Is the patient in pain?": ("PAIN", ["Absent", "Present", "no pain", "with pain"]),
+    "How did the pain start?": ("ONSET", ["Spontaneous", "Provoked", "spontaneously"]),
+    "What was the response to the pulp vitality test?": ("PULP VITALITY", ["Altered", "Negative", "Normal"]),
+    "What was the finding on percussion?": ("PERCUSSION", ["Normal", "Sensitive", "tender"]),
+    "What was the finding on palpation?": ("PALPATION", ["Edema", "Fistula", "Normal", "Sensitive"]),
+    "What is the main radiographic finding?": ("RADIOGRAPHY", [
+        "Circumscribed radiolucency lesion", "Diffuse apical radiolucency",
+        "Thickening of the periodontal ligament", "Normal", "Diffuse radiopaque lesion",
+    ]),
+}
+GREETINGS = ["hello", "hi", "good morning"]
+MAX_TURNS = 20
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Metrics:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.sessions_completed = 0
+        self.sessions_failed = 0
+        self.samples = []
+
+    def record(self, endpoint, seconds, ok):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def question_field(text):
+    # The first turn prepends the intro, so look for the question line anywhere.
+    for line in (text or "").split("\n"):
+        if line.strip() in QUESTIONS:
+            return QUESTIONS[line.strip()]
+    return None
+
+
+async def timed(client, metrics, endpoint, method, url, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        ok = response.status_code < 400
+    except httpx.HTTPError:
+        response, ok = None, False
+    metrics.record(endpoint, time.perf_counter() - start, ok)
+    return response if ok else None
+
+
+async def run_session(client, metrics, think_time):
+    session_id = f"load-{uuid.uuid4().hex}"
+
+    async def think():
+        if think_time > 0:
+            await asyncio.sleep(random.uniform(0, think_time))
+
+    data = {"indice": 0, "resposta_usuario": random.choice(GREETINGS), "session_id": session_id}
+    response = await timed(client, metrics, "/responder/", "POST", "/responder/", data=data)
+    turns = 0
+    while response is not None and "pergunta" in (payload := response.json()) and turns < MAX_TURNS:
+        turns += 1
+        question = question_field(payload["pergunta"])
+        if question is None:
+            break
+        _, answers = question
+        await think()
+        data = {"indice": turns, "resposta_usuario": random.choice(answers), "session_id": session_id}
+        response = await timed(client, metrics, "/responder/", "POST", "/responder/", data=data)
+
+    if response is None:
+        metrics.sessions_failed += 1
+        return
+
+    response = await timed(client, metrics, "/diagnostico/", "POST", "/diagnostico/", data={"session_id": session_id})
+    if response is not None and response.json().get("status") == "ok":
+        diagnosis = response.json()
+        await timed(client, metrics, "/explicacao/", "POST", "/explicacao/", data={
+            "session_id": session_id,
+            "diagnosis_aae_2009_2013": diagnosis["diagnosis_aae_2009_2013"],
+            "diagnosis_aae_ese_2025": diagnosis["diagnosis_aae_ese_2025"],
+            "complementary_diagnosis": diagnosis["complementary_diagnosis"],
+        })
+    await timed(client, metrics, "/pdf/", "GET", f"/pdf/{session_id}")
+    metrics.sessions_completed += 1
+
+
+async def clinician(client, metrics, deadline, think_time):
+    while time.monotonic() < deadline:
+        await run_session(client, metrics, think_time)
+
+
+async def sample_stats(client, metrics, started, interval, stop):
+    while not stop.is_set():
+        try:
+            stats = (await client.get("/stats")).json()
+            metrics.samples.append({
+                "t": round(time.monotonic() - started, 1),
+                "sessions": stats.get("sessions"),
+                "rss_kb": stats.get("process_rss_kb"),
+            })
+        except (httpx.HTTPError, ValueError):
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def build_report(metrics, elapsed, clinicians):
+    endpoints = {}
+    total_requests = 0
+    for endpoint, values in sorted(metrics.latencies.items()):
+        total_requests += len(values)
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": metrics.errors.get(endpoint, 0),
+            "rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p90_ms": round(percentile(values, 90) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+            "max_ms": round(max(values) * 1000, 1),
+            "mean_ms": round(statistics.fmean(values) * 1000, 1),
+        }
+    samples = metrics.samples
+    growth = None
+    if len(samples) >= 2 and samples[0]["rss_kb"] and samples[-1]["rss_kb"]:
+        growth = {
+            "sessions_start": samples[0]["sessions"],
+            "sessions_end": samples[-1]["sessions"],
+            "rss_kb_start": samples[0]["rss_kb"],
+            "rss_kb_end": samples[-1]["rss_kb"],
+            "rss_kb_per_1000_sessions": round(
+                (samples[-1]["rss_kb"] - samples[0]["rss_kb"]) * 1000
+                / max(1, (samples[-1]["sessions"] or 0) - (samples[0]["sessions"] or 0)), 1
+            ),
+        }
+    return {
+        "clinicians": clinicians,
+        "duration_s": round(elapsed, 1),
+        "sessions_completed": metrics.sessions_completed,
+        "sessions_failed": metrics.sessions_failed,
+        "sessions_per_s": round(metrics.sessions_completed / elapsed, 2),
+        "requests_per_s": round(total_requests / elapsed, 2),
+        "endpoints": endpoints,
+        "session_store": growth,
+        "samples": samples,
+    }
+
+
+def print_report(report):
+    print(f"Clinicians: {report['clinicians']}  duration: {report['duration_s']}s")
+    print(f"Sessions: {report['sessions_completed']} completed, {report['sessions_failed']} failed "
+          f"({report['sessions_per_s']}/s), requests: {report['requests_per_s']}/s")
+    print(f"{'endpoint':<16}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for endpoint, row in report["endpoints"].items():
+        print(f"{endpoint:<16}{row['requests']:>10}{row['errors']:>8}{row['p50_ms']:>10}"
+              f"{row['p90_ms']:>10}{row['p99_ms']:>10}{row['max_ms']:>10}")
+    if report["session_store"]:
+        growth = report["session_store"]
+        print(f"Session store: {growth['sessions_start']} -> {growth['sessions_end']} sessions, "
+              f"RSS {growth['rss_kb_start']} -> {growth['rss_kb_end']} KB "
+              f"({growth['rss_kb_per_1000_sessions']} KB per 1000 sessions)")
+
+
+async def main_async(args):
+    limits = httpx.Limits(max_connections=args.clinicians + 1)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as client:
+        metrics = Metrics()
+        started = time.monotonic()
+        deadline = started + args.duration
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_stats(client, metrics, started, args.stats_interval, stop))
+        await asyncio.gather(*(clinician(client, metrics, deadline, args.think_time) for _ in range(args.clinicians)))
+        stop.set()
+        await sampler
+        return build_report(metrics, time.monotonic() - started, args.clinicians)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8080")
+    parser.add_argument("--clinicians", type=int, default=10, help="concurrent virtual clinicians")
+    parser.add_argument("--duration", type=float, default=30, help="test duration in seconds")
+    parser.add_argument("--think-time", type=float, default=0.0, help="max random pause between answers (s)")
+    parser.add_argument("--stats-interval", type=float, default=2.0, help="seconds between /stats samples")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout (s)")
+    parser.add_argument("--json", help="also write the full report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
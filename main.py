@@ -1,11 +1,13 @@
-from fastapi import FastAPI, Form, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse
+from fastapi import FastAPI, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from openai import OpenAI
+from starlette.concurrency import run_in_threadpool
+from openai import OpenAI, APIConnectionError, APIStatusError, APITimeoutError
+import numpy as np
 import pandas as pd
 import os
 import json
+import math
 import re
 from io import BytesIO
 from pathlib import Path
@@ -13,27 +15,195 @@ from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 import unicodedata
 import textwrap
+import asyncio
+import atexit
+import base64
+import gzip
+import mimetypes
+import hashlib
+import hmac
+import logging
+import itertools
+import mmap
+import queue
+import random
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from contextlib import aclosing, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import lru_cache
 from difflib import SequenceMatcher
 
-app = FastAPI()
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants are produced without it
+    brotli = None
+
+try:
+    import tiktoken
+except ImportError:  # optional: prompt sizes are estimated at ~4 characters per token without it
+    tiktoken = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional: /analytics is disabled without pyarrow
+    pa = pc = ds = pq = None
+
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Background workers start with the server so queued jobs resume and idle
+    # sessions are swept even before the first request.
+    SESSION_SWEEPER.ensure_running()
+    JOB_QUEUE.ensure_running()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # =========================
 # CONFIG
 # =========================
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise RuntimeError("OPENAI_API_KEY was not found in environment variables.")
+# Offline mode never calls the upstream model: language detection, translation,
+# extraction and explanations are served from local tiers only. It is enabled
+# with OFFLINE_MODE=1 or automatically when no API key is configured.
+OFFLINE_MODE = os.getenv("OFFLINE_MODE", "0").strip().lower() in ("1", "true", "yes") or not OPENAI_API_KEY
 
 MODEL_EXTRACT = os.getenv("MODEL_EXTRACT", "gpt-4o-mini")
 MODEL_TRANSLATE = os.getenv("MODEL_TRANSLATE", "gpt-4o-mini")
 MODEL_EXPLAIN = os.getenv("MODEL_EXPLAIN", "gpt-4o")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Extraction prompts are capped at this many tokens (system + user message); the
+# clinician's text is trimmed to fit. 0 disables the cap. Tokens are counted
+# with tiktoken only when its encoding is already in the local cache and the
+# app is online; otherwise they are estimated at ~4 characters per token.
+EXTRACTION_MAX_PROMPT_TOKENS = int(os.getenv("EXTRACTION_MAX_PROMPT_TOKENS", "800"))
+EXTRACTION_MAX_ALIASES = int(os.getenv("EXTRACTION_MAX_ALIASES", "12"))
+
+CANONICAL_CACHE_SIZE = int(os.getenv("CANONICAL_CACHE_SIZE", "4096"))
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "2048"))
+EXPLANATION_CACHE_SIZE = int(os.getenv("EXPLANATION_CACHE_SIZE", "512"))
+
+# "memory" keeps sessions in the process; "sqlite" shares them between workers
+# (required when running more than one worker, see gunicorn.conf.py).
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").strip().lower()
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "endo10_sessions.sqlite3")
+# Requests that change a session are serialized per session id: a request waits up
+# to SESSION_LOCK_WAIT seconds for the previous one (then 409). The SQLite store's
+# lock is a lease, taken over after SESSION_LOCK_LEASE seconds if its worker died.
+SESSION_LOCK_WAIT = float(os.getenv("SESSION_LOCK_WAIT", "30"))
+SESSION_LOCK_LEASE = float(os.getenv("SESSION_LOCK_LEASE", "120"))
+# Background session GC: sessions idle for SESSION_IDLE_TTL seconds are dropped
+# (0 keeps them), the least recently used beyond SESSION_MAX are evicted (0 = no
+# cap) and completed sessions idle for SESSION_COMPACT_AFTER seconds are reduced
+# to answers + diagnosis. SESSION_SWEEP_INTERVAL=0 disables the sweeper.
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "86400"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "50000"))
+SESSION_COMPACT_AFTER = float(os.getenv("SESSION_COMPACT_AFTER", "600"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+# Background jobs (/tarefas/) are persisted in a local SQLite queue shared by the
+# workers on the host and run by JOB_WORKERS threads per process (0 = submit only).
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "endo10_jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+BULK_DIAGNOSIS_MAX = int(os.getenv("BULK_DIAGNOSIS_MAX", "10000"))
+
+# When set, /triagem/ signs the returned state and only accepts prior answers
+# back as that signed token, so clients cannot forge answers.
+STATE_TOKEN_SECRET = os.getenv("STATE_TOKEN_SECRET", "")
+
+# Skip questions that can no longer change the diagnosis and finish as soon as
+# the spreadsheet determines the result. Off by default: the full six-question
+# sequence is kept unless this is enabled.
+ADAPTIVE_QUESTIONING = os.getenv("ADAPTIVE_QUESTIONING", "0").strip().lower() in {"1", "true", "yes"}
+
+# Upstream resilience. LLM_TIMEOUTS is a JSON object of per-model timeouts in seconds.
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+LLM_TIMEOUTS = {"gpt-4o-mini": 10.0, "gpt-4o": 30.0}
+LLM_TIMEOUTS.update(json.loads(os.getenv("LLM_TIMEOUTS", "{}")))
+LLM_DEFAULT_TIMEOUT = float(os.getenv("LLM_DEFAULT_TIMEOUT", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Send a duplicate request when the first one is slower than this (seconds); 0 disables hedging.
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+# Share one upstream request between concurrent identical calls.
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1").strip().lower() in {"1", "true", "yes"}
+
+# Token-bucket rate limit on endpoints that can call the model, per API key (or
+# client IP) and per session; 0 disables it. State lives in the session store.
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "0"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))
+API_KEY_HEADER = os.getenv("API_KEY_HEADER", "X-API-Key")
+# LLM tokens a tenant (API key; keyless clients share "anonymous") may spend per
+# window; 0 = unlimited. LLM_TENANT_BUDGETS overrides it per API key (JSON object).
+LLM_TOKEN_BUDGET = int(os.getenv("LLM_TOKEN_BUDGET", "0"))
+LLM_TENANT_BUDGETS = json.loads(os.getenv("LLM_TENANT_BUDGETS", "{}"))
+LLM_BUDGET_WINDOW = float(os.getenv("LLM_BUDGET_WINDOW", "86400"))
+
+# Tracing is enabled when at least one exporter is configured.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")  # e.g. http://localhost:4318/v1/traces
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "endo10-evo")
+
+# Append-only session event log; disabled when EVENT_LOG_DIR is empty.
+# Single-writer: only usable with one worker process.
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "")
+EVENT_LOG_SEGMENT_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+# A snapshot (and a new segment) is also started after this many events or once
+# this many seconds have passed since the last one with events in between (0 = off).
+EVENT_LOG_SNAPSHOT_EVENTS = int(os.getenv("EVENT_LOG_SNAPSHOT_EVENTS", "10000"))
+EVENT_LOG_SNAPSHOT_INTERVAL = float(os.getenv("EVENT_LOG_SNAPSHOT_INTERVAL", "300"))
+# Store the raw answer text next to its hash (set to 0 to keep only the hash).
+EVENT_LOG_STORE_TEXT = os.getenv("EVENT_LOG_STORE_TEXT", "1").strip().lower() in {"1", "true", "yes"}
+
+# Columnar screening outcomes (Parquet, partitioned by day); disabled when empty.
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "")
+ANALYTICS_FLUSH_ROWS = int(os.getenv("ANALYTICS_FLUSH_ROWS", "5000"))
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "60"))
+
+# Retries are handled by safe_chat_completion, not by the SDK.
+client = None if OFFLINE_MODE else OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
 
 BASE_DIR = Path(__file__).resolve().parent
 EXCEL_FILE = BASE_DIR / "planilha_endo10.xlsx"
 SHEET_NAME = "En"
 
+# Pre-generated explanations (see build_explanations.py); ignored when the file is missing.
+EXPLANATIONS_FILE = os.getenv("EXPLANATIONS_FILE", str(BASE_DIR / "explanations.bin"))
+
+# Localized copies of the diagnosis table, by catalog language. Each sheet's
+# headers are mapped onto the canonical (SHEET_NAME) column names; sheets that
+# are not in the workbook are skipped.
+LOCALIZED_SHEETS = {
+    "pt": ("Pt", {
+        "DOR": "PAIN",
+        "APARECIMENTO": "ONSET",
+        "VITALIDADE PULPAR": "PULP VITALITY",
+        "PERCUSSÃO": "PERCUSSION",
+        "PALPAÇÃO": "PALPATION",
+        "RADIOGRAFIA": "RADIOGRAPHY",
+        "DIAGNÓSTICO": "DIAGNOSIS (AAE NOMENCLATURE 2009/2013)",
+        "DIAGNÓSTICO.1": "DIAGNOSIS (AAE/ESE NOMENCLATURE 2025)",
+        "DIAGNÓSTICO COMPLEMENTAR": "COMPLEMENTARY DIAGNOSIS",
+    }),
+}
+
 if not EXCEL_FILE.exists():
     raise RuntimeError(
         f"Spreadsheet not found: {EXCEL_FILE}. "
@@ -55,8 +225,303 @@ app.add_middleware(
 # STATIC
 # =========================
 STATIC_DIR = BASE_DIR / "static"
-if STATIC_DIR.exists():
-    app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+# Re-read changed files on each request (development only).
+STATIC_RELOAD = os.getenv("STATIC_RELOAD", "0").strip().lower() in {"1", "true", "yes"}
+COMPRESSIBLE_TYPES = {"text/html", "text/css", "text/javascript", "application/javascript", "application/json", "image/svg+xml"}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+STATIC_ASSETS = {}
+
+
+def fingerprint_static_refs(html: str) -> str:
+    """Append ?v=<hash> to /static/ references so they can be cached forever."""
+    def replace(match):
+        path = match.group(1)
+        asset = STATIC_ASSETS.get(path)
+        return f"/static/{path}?v={asset['version']}" if asset else match.group(0)
+    return re.sub(r"/static/([A-Za-z0-9_./-]+)", replace, html)
+
+
+def load_static_asset(relative_path: str):
+    path = STATIC_DIR / relative_path
+    body = path.read_bytes()
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    if relative_path == "index.html":
+        body = fingerprint_static_refs(body.decode("utf-8")).encode("utf-8")
+
+    digest = hashlib.sha256(body).hexdigest()
+    asset = {
+        "mtime": path.stat().st_mtime,
+        "media_type": media_type,
+        "version": digest[:12],
+        "variants": {"identity": body},
+    }
+    if media_type in COMPRESSIBLE_TYPES:
+        asset["variants"]["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            asset["variants"]["br"] = brotli.compress(body, quality=11)
+    asset["etags"] = {encoding: f'"{digest[:32]}-{encoding}"' for encoding in asset["variants"]}
+    STATIC_ASSETS[relative_path] = asset
+    return asset
+
+
+def load_static_assets():
+    STATIC_ASSETS.clear()
+    if not STATIC_DIR.exists():
+        return
+    paths = sorted(p.relative_to(STATIC_DIR).as_posix() for p in STATIC_DIR.rglob("*") if p.is_file())
+    # index.html last: it embeds the fingerprints of the other assets.
+    for relative_path in sorted(paths, key=lambda p: p == "index.html"):
+        load_static_asset(relative_path)
+
+
+def get_static_asset(relative_path: str):
+    asset = STATIC_ASSETS.get(relative_path)
+    if asset is not None and STATIC_RELOAD:
+        path = STATIC_DIR / relative_path
+        if not path.exists():
+            STATIC_ASSETS.pop(relative_path, None)
+            return None
+        if path.stat().st_mtime != asset["mtime"]:
+            load_static_assets()
+            asset = STATIC_ASSETS.get(relative_path)
+    return asset
+
+
+def choose_encoding(asset: dict, accept_encoding: str) -> str:
+    accepted = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")}
+    for encoding in ("br", "gzip"):
+        if encoding in asset["variants"] and encoding in accepted:
+            return encoding
+    return "identity"
+
+
+def static_response(request: Request, asset: dict, cache_control: str) -> Response:
+    encoding = choose_encoding(asset, request.headers.get("accept-encoding", ""))
+    etag = asset["etags"][encoding]
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    body = asset["variants"][encoding]
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(len(body))
+        return Response(status_code=200, headers=headers, media_type=asset["media_type"])
+    return Response(content=body, headers=headers, media_type=asset["media_type"])
+
+
+@app.api_route("/static/{relative_path:path}", methods=["GET", "HEAD"])
+async def static_files(relative_path: str, request: Request):
+    asset = get_static_asset(relative_path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found.")
+    fingerprinted = request.query_params.get("v") == asset["version"]
+    return static_response(request, asset, IMMUTABLE_CACHE_CONTROL if fingerprinted else REVALIDATE_CACHE_CONTROL)
+
+
+load_static_assets()
+
+# =========================
+# TRACING
+# =========================
+class Span:
+    """OpenTelemetry-style span: ids, parent, timing, attributes and status."""
+
+    def __init__(self, name: str, trace_id: str, parent_id, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = "OK"
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+class NoopSpan:
+    def set_attribute(self, key: str, value):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+CURRENT_SPAN = ContextVar("current_span", default=None)
+
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans) -> dict:
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": "endo10"},
+                "spans": [{
+                    "traceId": span["trace_id"],
+                    "spanId": span["span_id"],
+                    "parentSpanId": span["parent_span_id"] or "",
+                    "name": span["name"],
+                    "kind": 1,
+                    "startTimeUnixNano": str(span["start_time_unix_nano"]),
+                    "endTimeUnixNano": str(span["end_time_unix_nano"]),
+                    "attributes": [{"key": key, "value": otlp_value(value)} for key, value in span["attributes"].items()],
+                    "status": {"code": 2, "message": span["error"] or ""} if span["status"] == "ERROR" else {"code": 1},
+                } for span in spans],
+            }],
+        }],
+    }
+
+
+class SpanExporter:
+    """
+    Batches finished spans on a background thread and writes them as JSON
+    lines to TRACE_FILE and/or posts them as OTLP/HTTP JSON to
+    TRACE_OTLP_ENDPOINT. Export never runs on the request thread.
+    """
+
+    def __init__(self, file_path: str, otlp_endpoint: str, flush_interval: float = 1.0, max_queue: int = 10000):
+        self.file_path = file_path
+        self.otlp_endpoint = otlp_endpoint
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._pid = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # Started lazily so that each forked worker gets its own thread.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._run, name="span-exporter", daemon=True).start()
+
+    def export(self, span: Span):
+        self._ensure_worker()
+        try:
+            self.queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._write_lock:
+            batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        if self.file_path:
+            try:
+                with open(self.file_path, "a", encoding="utf-8") as fh:
+                    for span in batch:
+                        fh.write(json.dumps(span, ensure_ascii=False, separators=(",", ":")) + "\n")
+            except OSError:
+                self.dropped += len(batch)
+        if self.otlp_endpoint:
+            try:
+                request = urllib.request.Request(
+                    self.otlp_endpoint,
+                    data=json.dumps(to_otlp(batch)).encode("utf-8"),
+                    headers={"Content-Type": "application/json"},
+                    method="POST",
+                )
+                urllib.request.urlopen(request, timeout=5).close()
+            except Exception:
+                self.dropped += len(batch)
+
+
+SPAN_EXPORTER = SpanExporter(TRACE_FILE, TRACE_OTLP_ENDPOINT) if (TRACE_FILE or TRACE_OTLP_ENDPOINT) else None
+if SPAN_EXPORTER is not None:
+    atexit.register(SPAN_EXPORTER.flush)
+
+
+@contextmanager
+def trace_span(name: str, **attributes):
+    """
+    Record a child span of the current span (or a new trace). Yields an object
+    with set_attribute(); a no-op when tracing is disabled.
+    """
+    if SPAN_EXPORTER is None:
+        yield NOOP_SPAN
+        return
+
+    parent = CURRENT_SPAN.get()
+    span = Span(
+        name,
+        parent.trace_id if parent else os.urandom(16).hex(),
+        parent.span_id if parent else None,
+        {key: value for key, value in attributes.items() if value is not None},
+    )
+    token = CURRENT_SPAN.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.status = "ERROR"
+        span.error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        CURRENT_SPAN.reset(token)
+        span.end_ns = time.time_ns()
+        SPAN_EXPORTER.export(span)
+
+
+def current_span():
+    return CURRENT_SPAN.get() or NOOP_SPAN
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    if SPAN_EXPORTER is None:
+        return await call_next(request)
+    with trace_span(f"{request.method} {request.url.path}", **{
+        "http.method": request.method,
+        "http.target": request.url.path,
+    }) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        return response
 
 # =========================
 # HELPERS
@@ -87,15 +552,449 @@ def safe_json_loads(text: str):
         return None
 
 
+class UpstreamUnavailable(RuntimeError):
+    """Raised without calling OpenAI while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed -> open after `threshold` consecutive failures; while open, calls
+    fail immediately so callers use their deterministic fallback. After
+    `cooldown` seconds one trial call is let through (half-open); its result
+    closes or re-opens the breaker.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+LLM_BREAKERS = {}
+LLM_HEDGE_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge") if LLM_HEDGE_AFTER > 0 else None
+
+
+def breaker_for(model: str) -> CircuitBreaker:
+    if model not in LLM_BREAKERS:
+        LLM_BREAKERS[model] = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+    return LLM_BREAKERS[model]
+
+
+def is_retryable_error(exc: Exception) -> bool:
+    if isinstance(exc, (APITimeoutError, APIConnectionError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def hedged_call(fn, hedge_after: float):
+    """
+    Run fn(); if it has not finished after `hedge_after` seconds, start a
+    duplicate and return whichever succeeds first.
+    """
+    pending = {LLM_HEDGE_POOL.submit(fn)}
+    done, pending = wait(pending, timeout=hedge_after)
+    if not done:
+        pending.add(LLM_HEDGE_POOL.submit(fn))
+    error = None
+    while True:
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        if not pending:
+            raise error
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+
+class SingleFlight:
+    """
+    In-flight request deduplication. The first caller for a key runs the
+    call; callers arriving while it is still running wait for and share the
+    same result (or exception). Nothing is cached after the call completes.
+    do() returns (result, leader) so each caller knows whether it made the call.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result(), False
+
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result, True
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"upstream_calls": self.leaders, "coalesced_calls": self.coalesced, "in_flight": len(self._inflight)}
+
+
+LLM_SINGLE_FLIGHT = SingleFlight()
+
+
 def safe_chat_completion(messages, model, temperature=0, response_format=None):
+    """
+    Chat completion with a per-model timeout, jittered exponential retries on
+    transient errors, optional request hedging and a per-model circuit breaker.
+    Raises UpstreamUnavailable immediately while the breaker is open, and
+    LLMBudgetExceeded once the current tenant's token budget is spent.
+    Concurrent identical calls are coalesced into one upstream request; its
+    tokens are charged once per tenant (the caller that made it, plus any
+    follower from another tenant).
+    """
+    check_llm_budget()
     kwargs = {
         "model": model,
         "messages": messages,
         "temperature": temperature,
+        "timeout": LLM_TIMEOUTS.get(model, LLM_DEFAULT_TIMEOUT),
     }
     if response_format is not None:
         kwargs["response_format"] = response_format
-    return client.chat.completions.create(**kwargs)
+
+    with trace_span("llm.chat_completion", model=model) as span:
+        coalesced, charged = False, True
+        if not LLM_COALESCE:
+            response = resilient_chat_completion(kwargs)
+        else:
+            key = json.dumps([model, messages, temperature, response_format], sort_keys=True, ensure_ascii=False)
+            (response, leader_tenant), leader = LLM_SINGLE_FLIGHT.do(
+                key, lambda: (resilient_chat_completion(kwargs), CURRENT_TENANT.get())
+            )
+            coalesced = not leader
+            span.set_attribute("coalesced", coalesced)
+            # A follower from another tenant got the answer from someone else's call, but
+            # still pays for it: sharing the call must not let a tenant exceed its budget.
+            charged = leader or leader_tenant != CURRENT_TENANT.get()
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            span.set_attribute("tokens.prompt", getattr(usage, "prompt_tokens", None))
+            span.set_attribute("tokens.completion", getattr(usage, "completion_tokens", None))
+        if charged:
+            charge_llm_budget(response_tokens(messages, response))
+        return response
+
+
+def response_tokens(messages, response) -> int:
+    """Tokens reported by the upstream, or ~4 characters per token when it reports no usage."""
+    total = getattr(getattr(response, "usage", None), "total_tokens", None)
+    if total:
+        return total
+    chars = sum(len(str(message.get("content") or "")) for message in messages)
+    for choice in getattr(response, "choices", None) or []:
+        chars += len(getattr(choice.message, "content", None) or "")
+    return chars // 4
+
+
+def resilient_chat_completion(kwargs: dict):
+    model = kwargs["model"]
+    if OFFLINE_MODE:
+        raise UpstreamUnavailable("Offline mode: the upstream model is disabled.")
+    breaker = breaker_for(model)
+    if not breaker.allow():
+        raise UpstreamUnavailable(f"Upstream model '{model}' is temporarily unavailable.")
+
+    def call():
+        return client.chat.completions.create(**kwargs)
+
+    attempt = 0
+    while True:
+        try:
+            if LLM_HEDGE_POOL is not None:
+                response = hedged_call(call, LLM_HEDGE_AFTER)
+            else:
+                response = call()
+            breaker.record_success()
+            return response
+        except Exception as exc:
+            if not is_retryable_error(exc):
+                # The upstream answered; a bad request is not an availability problem.
+                breaker.record_success()
+                raise
+            if attempt >= LLM_MAX_RETRIES or breaker.state != "closed":
+                breaker.record_failure()
+                raise
+            attempt += 1
+            # Full jitter: sleep a random fraction of the exponential backoff window.
+            time.sleep(random.uniform(0, LLM_RETRY_BASE_DELAY * (2 ** (attempt - 1))))
+
+
+def stream_chat_completion(messages, model, temperature=0):
+    """
+    Yield content deltas of a streamed chat completion.
+
+    Honors the per-model timeout, circuit breaker and tenant budget but is
+    never retried, hedged or coalesced: tokens may already have reached the
+    client. Streams carry no usage, so the budget is charged ~4 chars/token.
+    """
+    if OFFLINE_MODE:
+        raise UpstreamUnavailable("Offline mode: the upstream model is disabled.")
+    check_llm_budget()
+    breaker = breaker_for(model)
+    if not breaker.allow():
+        raise UpstreamUnavailable(f"Upstream model '{model}' is temporarily unavailable.")
+
+    with trace_span("llm.chat_completion", model=model, stream=True) as span:
+        chunks = 0
+        chars = sum(len(message["content"]) for message in messages)
+        settled = False
+        try:
+            stream = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                timeout=LLM_TIMEOUTS.get(model, LLM_DEFAULT_TIMEOUT),
+                stream=True,
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks += 1
+                    chars += len(delta)
+                    yield delta
+        except Exception as exc:
+            settled = True
+            if is_retryable_error(exc):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        finally:
+            # Also reached through GeneratorExit when the consumer stops early: the
+            # upstream was answering, so a half-open trial must still close the breaker.
+            if not settled:
+                breaker.record_success()
+            charge_llm_budget(chars // 4)
+        span.set_attribute("stream.chunks", chunks)
+
+
+CACHE_MISS = object()
+
+
+class LRUCache:
+    """
+    Small bounded LRU memo with hit/miss counters.
+
+    Entries are tagged with a version; when the version passed to get()/set()
+    changes, the whole cache is dropped. Callers pass KNOWLEDGE_BASE_VERSION,
+    which is fixed for the life of the process (see compute_knowledge_base_version).
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = max(0, maxsize)
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._data.clear()
+            self.version = version
+
+    def get(self, key, version=None, default=CACHE_MISS):
+        with self._lock:
+            self._check_version(version)
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, version=None):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._check_version(version)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+TRANSLATION_CACHE = LRUCache(TRANSLATION_CACHE_SIZE)
+EXPLANATION_CACHE = LRUCache(EXPLANATION_CACHE_SIZE)
+
+
+def explanation_digest(language: str, diag_2009: str, diag_2025: str, comp_diag: str) -> bytes:
+    key = json.dumps([normalize_text(language), diag_2009, diag_2025, comp_diag], ensure_ascii=False)
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+
+
+class ExplanationCorpus:
+    """
+    Read-only, memory-mapped explanation artifact.
+
+    Layout: MAGIC, uint32 header length, JSON header, then `count` fixed-size
+    records (8-byte key digest, uint32 offset, uint32 length) sorted by digest,
+    then the UTF-8 texts. Lookups binary-search the mapped records, so workers
+    forked from a preloaded master share the pages.
+    """
+
+    MAGIC = b"ENDOEXP1"
+    RECORD = struct.Struct("<8sII")
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        with open(self.path, "rb") as fh:
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(self.MAGIC)] != self.MAGIC:
+            raise RuntimeError(f"Not an explanation corpus: {self.path}")
+        (header_len,) = struct.unpack_from("<I", self._map, len(self.MAGIC))
+        header_start = len(self.MAGIC) + 4
+        self.header = json.loads(self._map[header_start:header_start + header_len].decode("utf-8"))
+        self.count = self.header["count"]
+        self._records = header_start + header_len
+        self._texts = self._records + self.count * self.RECORD.size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, language: str, diag_2009: str, diag_2025: str, comp_diag: str):
+        digest = explanation_digest(language, diag_2009, diag_2025, comp_diag)
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            key, offset, length = self.RECORD.unpack_from(self._map, self._records + mid * self.RECORD.size)
+            if key == digest:
+                self.hits += 1
+                start = self._texts + offset
+                return self._map[start:start + length].decode("utf-8")
+            if key < digest:
+                low = mid + 1
+            else:
+                high = mid
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "entries": self.count,
+            "languages": self.header.get("languages", []),
+            "content_sha256": self.header.get("content_sha256"),
+            "knowledge_base_version": self.header.get("knowledge_base_version"),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def write_explanation_corpus(path: str, entries: dict, header: dict) -> str:
+    """
+    Write {(language, diag_2009, diag_2025, comp_diag): text} as a corpus
+    artifact (atomically). Returns the SHA-256 of the records and texts.
+    """
+    records = []
+    blob = bytearray()
+    for key, text in sorted(entries.items(), key=lambda item: explanation_digest(*item[0])):
+        encoded = text.encode("utf-8")
+        records.append(ExplanationCorpus.RECORD.pack(explanation_digest(*key), len(blob), len(encoded)))
+        blob += encoded
+    if len({record[:8] for record in records}) != len(records):
+        raise RuntimeError("Explanation key digest collision; the corpus cannot be written.")
+    body = b"".join(records) + bytes(blob)
+    content_sha256 = hashlib.sha256(body).hexdigest()
+    header_bytes = json.dumps(
+        {**header, "count": len(records), "content_sha256": content_sha256},
+        ensure_ascii=False, sort_keys=True,
+    ).encode("utf-8")
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(ExplanationCorpus.MAGIC)
+        fh.write(struct.pack("<I", len(header_bytes)))
+        fh.write(header_bytes)
+        fh.write(body)
+    os.replace(tmp_path, path)
+    return content_sha256
+
+
+def load_explanation_corpus(path: str):
+    if not path or not os.path.exists(path):
+        return None
+    return ExplanationCorpus(path)
+
+
+EXPLANATION_CORPUS = load_explanation_corpus(EXPLANATIONS_FILE)
 
 
 def wrap_pdf_lines(text: str, width: int = 90):
@@ -109,6 +1008,13 @@ def wrap_pdf_lines(text: str, width: int = 90):
 
 
 def detect_language(text: str) -> str:
+    with trace_span("detect_language") as span:
+        language = detect_language_uncached(text, span)
+        span.set_attribute("language", language)
+        return language
+
+
+def detect_language_uncached(text: str, span=NOOP_SPAN) -> str:
     if not text or not str(text).strip():
         return "English"
 
@@ -119,8 +1025,14 @@ def detect_language(text: str) -> str:
         "percussão", "palpação", "fístula", "fistula"
     ]
     if any(marker in norm for marker in pt_markers):
+        span.set_attribute("method", "markers")
         return "Portuguese"
 
+    if OFFLINE_MODE:
+        span.set_attribute("method", "offline")
+        return "English"
+
+    span.set_attribute("method", "llm")
     try:
         prompt = (
             "Detect the language of the following text. "
@@ -144,6 +1056,23 @@ def translate_text(text: str, target_language: str) -> str:
     if normalize_text(target_language) == "english":
         return text
 
+    builtin = BUILTIN_TRANSLATIONS.get(normalize_text(target_language), {}).get(text)
+    if builtin is not None:
+        return builtin
+
+    with trace_span("translate_text", target_language=target_language, chars=len(text)) as span:
+        cache_key = (normalize_text(target_language), text)
+        cached = TRANSLATION_CACHE.get(cache_key)
+        span.set_attribute("cache_hit", cached is not CACHE_MISS)
+        if cached is not CACHE_MISS:
+            return cached
+        if OFFLINE_MODE:
+            return text
+        return translate_text_upstream(text, target_language, cache_key)
+
+
+def translate_text_upstream(text: str, target_language: str, cache_key) -> str:
+
     try:
         prompt = (
             f"Translate the following text into {target_language}. "
@@ -158,11 +1087,94 @@ def translate_text(text: str, target_language: str) -> str:
             temperature=0,
         )
         translated = (response.choices[0].message.content or "").strip()
-        return translated if translated else text
+        if not translated:
+            return text
+        TRANSLATION_CACHE.set(cache_key, translated)
+        return translated
     except Exception:
         return text
 
 
+def translate_batch(texts, target_language: str):
+    """
+    Translate several strings with a single JSON-mode request and fill the
+    translation cache for all of them. Falls back to translate_text() per
+    string if the batched answer cannot be validated.
+    """
+    texts = list(texts)
+    if normalize_text(target_language) == "english":
+        return texts
+
+    with trace_span("translate_batch", target_language=target_language, strings=len(texts)) as span:
+        return translate_batch_traced(texts, target_language, span)
+
+
+def translate_batch_traced(texts, target_language: str, span):
+    language_key = normalize_text(target_language)
+    builtins = BUILTIN_TRANSLATIONS.get(language_key, {})
+    results = {}
+    missing = []
+    for text in texts:
+        if not text:
+            results[text] = text
+            continue
+        if text in builtins:
+            results[text] = builtins[text]
+            continue
+        cached = TRANSLATION_CACHE.get((language_key, text))
+        if cached is not CACHE_MISS:
+            results[text] = cached
+        elif text not in missing:
+            missing.append(text)
+
+    span.set_attribute("cache_misses", len(missing))
+    if OFFLINE_MODE:
+        results.update((text, text) for text in missing)
+    elif len(missing) == 1:
+        results[missing[0]] = translate_text(missing[0], target_language)
+    elif missing:
+        prompt = (
+            f"Translate each string in the JSON array below into {target_language}. "
+            "Keep the meaning clear, professional, natural, and concise. "
+            "Preserve line breaks and list structure. "
+            "Do not add commentary.\n"
+            f'Return ONLY a JSON object of the form {{"translations": [...]}} containing exactly '
+            f"{len(missing)} strings, in the same order as the input.\n\n"
+            f"{json.dumps(missing, ensure_ascii=False)}"
+        )
+        translations = None
+        try:
+            response = safe_chat_completion(
+                messages=[
+                    {"role": "system", "content": "You translate interface texts and return only JSON."},
+                    {"role": "user", "content": prompt},
+                ],
+                model=MODEL_TRANSLATE,
+                temperature=0,
+                response_format={"type": "json_object"},
+            )
+            data = safe_json_loads(response.choices[0].message.content or "{}") or {}
+            translations = data.get("translations")
+        except Exception:
+            translations = None
+
+        valid = (
+            isinstance(translations, list)
+            and len(translations) == len(missing)
+            and all(isinstance(item, str) and item.strip() for item in translations)
+        )
+        if valid:
+            for text, translated in zip(missing, translations):
+                translated = translated.strip()
+                TRANSLATION_CACHE.set((language_key, text), translated)
+                results[text] = translated
+        else:
+            for text in missing:
+                results[text] = translate_text(text, target_language)
+
+    return [results[text] for text in texts]
+
+
 def is_greeting(text: str) -> bool:
     norm = normalize_text(text)
     greetings = {
@@ -427,22 +1439,114 @@ QUESTION_DEFS = [
 FIELD_TO_CODES = {q["field"]: q["codes"] for q in QUESTION_DEFS}
 FIELD_ORDER = [q["field"] for q in QUESTION_DEFS]
 
-# =========================
-# LOAD DATA
-# =========================
-try:
-    df = pd.read_excel(EXCEL_FILE, sheet_name=SHEET_NAME)
-except Exception as e:
-    raise RuntimeError(f"Error loading spreadsheet '{EXCEL_FILE}' / sheet '{SHEET_NAME}': {e}")
+# Integer-coded catalog. Inside the process an answer is a small per-field
+# option id (1..n in QUESTION_DEFS order, 0 = unanswered) and a full answer set
+# is one int with FIELD_BITS bits per field. String codes are only used at the
+# API boundary (request/response payloads, event log, analytics).
+FIELD_BITS = 3
+FIELD_MASK = (1 << FIELD_BITS) - 1
+FIELD_POS = {field: pos for pos, field in enumerate(FIELD_ORDER)}
+FIELD_CODES = tuple(tuple(FIELD_TO_CODES[field]) for field in FIELD_ORDER)
+FIELD_CODE_IDS = tuple({code: i + 1 for i, code in enumerate(codes)} for codes in FIELD_CODES)
+CODE_POSITIONS = {code: (pos, option_id) for pos, ids in enumerate(FIELD_CODE_IDS) for code, option_id in ids.items()}
+
+if max(len(codes) for codes in FIELD_CODES) > FIELD_MASK:
+    raise RuntimeError(f"A field has more than {FIELD_MASK} options; increase FIELD_BITS.")
+
+
+def option_table(key: str, fallback_key: str = None):
+    # [field position][option id] -> text; id 0 (unanswered) maps to "".
+    return tuple(
+        ("",) + tuple(OPTION_CATALOG[code].get(key, OPTION_CATALOG[code].get(fallback_key)) for code in codes)
+        for codes in FIELD_CODES
+    )
+
+
+OPTION_LABELS = {"en": option_table("label"), "pt": option_table("label_pt", "label")}
+OPTION_DESCRIPTIONS = {"en": option_table("description"), "pt": option_table("description_pt", "description")}
+
+
+def catalog_language(language: str) -> str:
+    return "pt" if normalize_text(language) == "portuguese" else "en"
+
+
+def answer_id(key: int, field: str) -> int:
+    return (key >> (FIELD_POS[field] * FIELD_BITS)) & FIELD_MASK
+
+
+def answer_ids(key: int):
+    return tuple((key >> (pos * FIELD_BITS)) & FIELD_MASK for pos in range(len(FIELD_ORDER)))
+
+
+def pack_ids(ids) -> int:
+    key = 0
+    for pos, option_id in enumerate(ids):
+        key |= option_id << (pos * FIELD_BITS)
+    return key
+
+
+def is_answered(key: int, field: str) -> bool:
+    return answer_id(key, field) != 0
+
+
+def answer_code(key: int, field: str):
+    option_id = answer_id(key, field)
+    return FIELD_CODES[FIELD_POS[field]][option_id - 1] if option_id else None
+
+
+def set_answer(key: int, field: str, code: str) -> int:
+    pos = FIELD_POS[field]
+    shift = pos * FIELD_BITS
+    return (key & ~(FIELD_MASK << shift)) | (FIELD_CODE_IDS[pos][code] << shift)
+
+
+def clear_answer(key: int, field: str) -> int:
+    return key & ~(FIELD_MASK << (FIELD_POS[field] * FIELD_BITS))
+
 
-df.columns = [str(col).strip() for col in df.columns]
-for col in df.columns:
-    if df[col].dtype == "object":
-        df[col] = df[col].fillna("").astype(str).str.strip()
+def pack_answers(answers: dict) -> int:
+    """Codes -> packed key. Unknown fields or codes raise KeyError."""
+    key = 0
+    for field, code in answers.items():
+        key = set_answer(key, field, code)
+    return key
 
-if "PULPT VITALITY" in df.columns and "PULP VITALITY" not in df.columns:
-    df = df.rename(columns={"PULPT VITALITY": "PULP VITALITY"})
 
+def unpack_answers(key: int) -> dict:
+    """Packed key -> {field: code} for the answered fields, in FIELD_ORDER."""
+    return {
+        field: FIELD_CODES[pos][option_id - 1]
+        for pos, (field, option_id) in enumerate(zip(FIELD_ORDER, answer_ids(key)))
+        if option_id
+    }
+
+
+def compute_knowledge_base_version() -> str:
+    """
+    Fingerprint of everything canonicalization depends on: the option catalog,
+    the question definitions and the spreadsheet bytes.
+
+    Computed once at import, like the tables built from the spreadsheet: editing
+    planilha_endo10.xlsx takes effect after a restart (the in-process caches
+    start empty then). The version is reported by /stats, analyze_spreadsheet.py
+    and the explanation corpus header to tell which knowledge base they reflect.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(OPTION_CATALOG, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    digest.update(json.dumps(QUESTION_DEFS, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    digest.update(EXCEL_FILE.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+KNOWLEDGE_BASE_VERSION = compute_knowledge_base_version()
+
+# Memoized answers keyed by (field, normalized text).
+CANONICAL_CACHE = LRUCache(CANONICAL_CACHE_SIZE)
+LLM_EXTRACTION_CACHE = LRUCache(CANONICAL_CACHE_SIZE)
+
+# =========================
+# LOAD DATA
+# =========================
 REQUIRED_SPREADSHEET_COLS = [
     "PAIN",
     "ONSET",
@@ -455,9 +1559,37 @@ REQUIRED_SPREADSHEET_COLS = [
     "COMPLEMENTARY DIAGNOSIS",
 ]
 
-for required_col in REQUIRED_SPREADSHEET_COLS:
-    if required_col not in df.columns:
-        raise RuntimeError(f"Required column '{required_col}' not found in spreadsheet.")
+
+
+def load_sheet(workbook, sheet_name: str, columns: dict = None):
+    try:
+        frame = pd.read_excel(workbook, sheet_name=sheet_name)
+    except Exception as e:
+        raise RuntimeError(f"Error loading spreadsheet '{EXCEL_FILE}' / sheet '{sheet_name}': {e}")
+
+    frame.columns = [str(col).strip() for col in frame.columns]
+    for col in frame.columns:
+        if frame[col].dtype == "object":
+            frame[col] = frame[col].fillna("").astype(str).str.strip()
+
+    if columns:
+        frame = frame.rename(columns=columns)
+    if "PULPT VITALITY" in frame.columns and "PULP VITALITY" not in frame.columns:
+        frame = frame.rename(columns={"PULPT VITALITY": "PULP VITALITY"})
+
+    for required_col in REQUIRED_SPREADSHEET_COLS:
+        if required_col not in frame.columns:
+            raise RuntimeError(f"Required column '{required_col}' not found in spreadsheet sheet '{sheet_name}'.")
+    return frame
+
+
+with pd.ExcelFile(EXCEL_FILE) as workbook:
+    df = load_sheet(workbook, SHEET_NAME)
+    # Catalog language -> normalized frame; "en" is the primary sheet.
+    DIAGNOSIS_FRAMES = {"en": df}
+    for sheet_language, (localized_sheet, sheet_columns) in LOCALIZED_SHEETS.items():
+        if localized_sheet in workbook.sheet_names:
+            DIAGNOSIS_FRAMES[sheet_language] = load_sheet(workbook, localized_sheet, sheet_columns)
 
 # =========================
 # CANONICALIZATION
@@ -574,22 +1706,41 @@ def local_semantic_shortcuts(field: str, norm: str):
 
 
 def canonicalize_value(field: str, value: str):
+    return canonicalize_value_with_stage(field, value)[0]
+
+
+def canonicalize_value_with_stage(field: str, value: str):
+    """
+    Return (code, stage), where stage names the matcher that produced the
+    code: "exact", "shortcut", "containment", "fuzzy", or None when nothing matched.
+    """
     norm = normalize_text(value)
     if not norm or field not in FIELD_TO_CODES:
-        return None
+        return None, None
 
+    cache_key = (field, norm)
+    cached = CANONICAL_CACHE.get(cache_key, KNOWLEDGE_BASE_VERSION)
+    if cached is not CACHE_MISS:
+        return cached
+
+    result = canonicalize_normalized_value(field, norm)
+    CANONICAL_CACHE.set(cache_key, result, KNOWLEDGE_BASE_VERSION)
+    return result
+
+
+def canonicalize_normalized_value(field: str, norm: str):
     field_codes = FIELD_TO_CODES[field]
 
     # 1) Exact match against official labels, Portuguese labels, aliases, and spreadsheet values.
     for code in field_codes:
         for term in build_terms_for_code(code):
             if term == norm:
-                return code
+                return code, "exact"
 
     # 2) Deterministic clinical shortcuts for common natural-language answers.
     shortcut = local_semantic_shortcuts(field, norm)
     if shortcut in field_codes:
-        return shortcut
+        return shortcut, "shortcut"
 
     # 3) Longest-term containment. This lets phrases like
     #    "espessamento do ligamento periodontal" match the correct radiographic option.
@@ -602,7 +1753,7 @@ def canonicalize_value(field: str, value: str):
     candidates.sort(reverse=True)
     for _, term, code in candidates:
         if term in norm or norm in term:
-            return code
+            return code, "containment"
 
     # 4) Conservative fuzzy matching for short/typed answers.
     #    This accepts minor typos but avoids forcing very ambiguous answers.
@@ -616,157 +1767,1168 @@ def canonicalize_value(field: str, value: str):
                 best_code = code
 
     if best_score >= 0.88:
-        return best_code
+        return best_code, "fuzzy"
 
-    return None
+    return None, None
 
 def label_for_code(code: str, language: str = "English"):
     if not code:
         return ""
-    meta = OPTION_CATALOG.get(code, {})
-    if normalize_text(language) == "portuguese":
-        return meta.get("label_pt", meta.get("label", code))
-    return meta.get("label", code)
+    if code not in CODE_POSITIONS:
+        return code
+    pos, option_id = CODE_POSITIONS[code]
+    return OPTION_LABELS[catalog_language(language)][pos][option_id]
+
 
+def label_for_answer(key: int, field: str, language: str = "English"):
+    return OPTION_LABELS[catalog_language(language)][FIELD_POS[field]][answer_id(key, field)]
 
-for field in FIELD_ORDER:
-    df[f"__code_{field}"] = df[field].apply(lambda x: canonicalize_value(field, x))
 
-unmapped_rows = df[[f"__code_{field}" for field in FIELD_ORDER]].isna().any(axis=1)
-if unmapped_rows.any():
-    bad_indices = df[unmapped_rows].index.tolist()
-    raise RuntimeError(f"Some spreadsheet rows could not be canonicalized. Row indices: {bad_indices}")
+for sheet_frame in DIAGNOSIS_FRAMES.values():
+    for field in FIELD_ORDER:
+        sheet_frame[f"__code_{field}"] = sheet_frame[field].apply(lambda x: canonicalize_value(field, x))
+
+    unmapped_rows = sheet_frame[[f"__code_{field}" for field in FIELD_ORDER]].isna().any(axis=1)
+    if unmapped_rows.any():
+        bad_indices = sheet_frame[unmapped_rows].index.tolist()
+        raise RuntimeError(f"Some spreadsheet rows could not be canonicalized. Row indices: {bad_indices}")
 
 # =========================
-# SESSIONS
+# COMPILED DIAGNOSIS TABLE
 # =========================
-sessions = {}
+DIAGNOSIS_COLUMNS = [
+    "DIAGNOSIS (AAE NOMENCLATURE 2009/2013)",
+    "DIAGNOSIS (AAE/ESE NOMENCLATURE 2025)",
+    "COMPLEMENTARY DIAGNOSIS",
+]
+# API names of the diagnosis triple, and the nomenclatures selectable as the primary diagnosis.
+DIAGNOSIS_FIELDS = ("diagnosis_aae_2009_2013", "diagnosis_aae_ese_2025", "complementary_diagnosis")
+NOMENCLATURES = {"aae_2009_2013": 0, "aae_ese_2025": 1}
 
 
-def empty_session():
-    return {
-        "language": None,
-        "stage": "greeting",
-        "current_question": 0,
-        "answers": {},
-        "diagnosis_result": {},
-        "history": [],
-        "last_bot_payload": None,
-    }
+def is_reachable_combination(key: int) -> bool:
+    # Mirrors apply_business_rules: when pain is absent, onset is always "not applicable".
+    return answer_code(key, "PAIN") != "pain_absent" or answer_code(key, "ONSET") == "onset_na"
 
 
-def create_session_if_needed(session_id: str):
-    if session_id not in sessions:
-        sessions[session_id] = empty_session()
+def build_row_index(frame=df):
+    """Map each packed answer key to the spreadsheet row labels registered for it."""
+    index = {}
+    code_cols = [f"__code_{field}" for field in FIELD_ORDER]
+    for label, codes in zip(frame.index, frame[code_cols].itertuples(index=False)):
+        index.setdefault(pack_answers(dict(zip(FIELD_ORDER, codes))), []).append(label)
+    return index
 
 
-def cache_payload(session: dict, payload: dict):
-    session["last_bot_payload"] = payload
-    return payload
+def diagnosis_triple(label, frame=df):
+    row = frame.loc[label]
+    return tuple(str(row[col]).strip() for col in DIAGNOSIS_COLUMNS)
 
 
-def get_question_by_index(index: int):
-    if index < 0 or index >= len(QUESTION_DEFS):
-        raise HTTPException(status_code=400, detail="Invalid question index.")
-    return QUESTION_DEFS[index]
+class DecisionMatrix:
+    """
+    One canonicalized diagnosis sheet as an int8 matrix (rows x FIELD_ORDER)
+    of option ids, with aligned arrays of row labels and diagnosis ids
+    (indexes into `triples`, the distinct stripped DIAGNOSIS_COLUMNS triples).
+
+    match() applies the lookup rules to many complete answer vectors at once:
+    an exact row wins; rows registered more than once are only used when they
+    all give the same diagnosis; failing that, a Normal/Sensitive percussion
+    answer falls back to the row registered with percussion "Not applicable".
+    """
 
+    def __init__(self, frame):
+        code_cols = [f"__code_{field}" for field in FIELD_ORDER]
+        self.labels = list(frame.index)
+        self.answers = np.array(
+            [[FIELD_CODE_IDS[pos][code] for pos, code in enumerate(codes)]
+             for codes in frame[code_cols].itertuples(index=False)],
+            dtype=np.int8,
+        ).reshape(-1, len(FIELD_ORDER))
+        ids = {}
+        self.diagnosis = np.array(
+            [ids.setdefault(diagnosis_triple(label, frame), len(ids)) for label in self.labels], dtype=np.int16
+        )
+        self.triples = tuple(ids)
+
+    def _select(self, vectors):
+        """Row position per vector: the first matching row when all matches agree, else -1."""
+        hits = (self.answers[None, :, :] == vectors[:, None, :]).all(axis=2)
+        matched = hits.any(axis=1)
+        highest = np.where(hits, self.diagnosis, -1).max(axis=1)
+        lowest = np.where(hits, self.diagnosis, np.iinfo(np.int16).max).min(axis=1)
+        return np.where(matched & (highest == lowest), hits.argmax(axis=1), -1)
+
+    def match(self, vectors, chunk_size: int = 4096):
+        """
+        Row positions (-1 = no usable row) for an (n, len(FIELD_ORDER)) array
+        of complete option-id vectors. Evaluated in chunks to bound the
+        (vectors x rows) comparison.
+        """
+        vectors = np.asarray(vectors, dtype=np.int8).reshape(-1, len(FIELD_ORDER))
+        positions = np.empty(len(vectors), dtype=np.int64)
+        pos = FIELD_POS["PERCUSSION"]
+        ids = FIELD_CODE_IDS[pos]
+        for start in range(0, len(vectors), chunk_size):
+            block = vectors[start:start + chunk_size]
+            selected = self._select(block)
+            fallback = (selected < 0) & np.isin(block[:, pos], [ids["percussion_normal"], ids["percussion_sensitive"]])
+            if fallback.any():
+                wildcard = block[fallback].copy()
+                wildcard[:, pos] = ids["percussion_na"]
+                selected[fallback] = self._select(wildcard)
+            positions[start:start + chunk_size] = selected
+        return positions
+
+
+def iter_all_combinations():
+    """Packed keys of every complete answer combination."""
+    for ids in itertools.product(*(range(1, len(codes) + 1) for codes in FIELD_CODES)):
+        yield pack_ids(ids)
+
+
+def build_diagnosis_lookup(matrix):
+    """
+    Complete lookup table: every reachable answer combination mapped to the
+    spreadsheet row that answers it (or None). Conflicts and the percussion
+    wildcard are resolved here, once and in one batch, instead of on every request.
+    """
+    keys = [key for key in iter_all_combinations() if is_reachable_combination(key)]
+    positions = matrix.match([answer_ids(key) for key in keys])
+    return {key: matrix.labels[position] if position >= 0 else None for key, position in zip(keys, positions)}
 
-def apply_business_rules(session: dict):
-    # If pain is absent, pain onset is not applicable and should not be asked.
-    if session["answers"].get("PAIN") == "pain_absent":
-        session["answers"]["ONSET"] = "onset_na"
 
+def build_outcome_tables(lookup, matrices):
+    """
+    Number the distinct diagnoses and project them per language.
 
-def get_next_unanswered_index(session: dict):
-    for idx, q in enumerate(QUESTION_DEFS):
-        if q["field"] not in session["answers"]:
-            return idx
-    return len(QUESTION_DEFS)
+    Returns (outcome_ids, texts): outcome_ids maps every reachable key to an
+    outcome id (-1 = no diagnosis) and texts[language][outcome_id] is the
+    stripped DIAGNOSIS_COLUMNS triple from that language's sheet. A localized
+    sheet without a usable row for a combination falls back to the primary one.
+    """
+    languages = list(DIAGNOSIS_FRAMES)
+    ids_by_projection = {}
+    texts = {language: [] for language in languages}
+    outcome_ids = {}
+    diagnosed = [key for key, label in lookup.items() if label is not None]
+    vectors = [answer_ids(key) for key in diagnosed]
+    positions = {language: dict(zip(diagnosed, matrices[language].match(vectors))) for language in languages}
+    for key, label in lookup.items():
+        if label is None:
+            outcome_ids[key] = -1
+            continue
+        primary_matrix = matrices[languages[0]]
+        primary = primary_matrix.triples[primary_matrix.diagnosis[positions[languages[0]][key]]]
+        projection = [primary]
+        for language in languages[1:]:
+            matrix = matrices[language]
+            position = positions[language][key]
+            projection.append(matrix.triples[matrix.diagnosis[position]] if position >= 0 else primary)
+        projection = tuple(projection)
+        if projection not in ids_by_projection:
+            ids_by_projection[projection] = len(ids_by_projection)
+            for language, triple in zip(languages, projection):
+                texts[language].append(triple)
+        outcome_ids[key] = ids_by_projection[projection]
+    return outcome_ids, {language: tuple(triples) for language, triples in texts.items()}
+
+
+def build_combination_matrix(outcome_ids):
+    """
+    Resolved outcome table as aligned arrays, in packed-key order: option ids
+    of every reachable complete combination (int8, combinations x FIELD_ORDER),
+    its packed key and its outcome id (-1 = no diagnosis). Partial-answer
+    queries filter these rows; batch lookups binary-search the keys.
+    """
+    keys = sorted(outcome_ids)
+    answers = np.array([answer_ids(key) for key in keys], dtype=np.int8).reshape(-1, len(FIELD_ORDER))
+    outcomes = np.array([outcome_ids[key] for key in keys], dtype=np.int16)
+    return answers, np.array(keys, dtype=np.int64), outcomes
 
 
-def sync_current_question(session: dict):
-    apply_business_rules(session)
-    session["current_question"] = get_next_unanswered_index(session)
-    if session["current_question"] >= len(QUESTION_DEFS):
-        session["stage"] = "completed"
-    elif session["stage"] != "greeting":
-        session["stage"] = "triage"
+# Weights that pack a row of option ids into one integer, as pack_ids() does.
+FIELD_WEIGHTS = np.array([1 << (pos * FIELD_BITS) for pos in range(len(FIELD_ORDER))], dtype=np.int64)
 
 
-def build_question_text(index: int, language: str) -> str:
-    q = get_question_by_index(index)
-    is_pt = normalize_text(language) == "portuguese"
-    question_line = q.get("question_pt", q["question"]) if is_pt else q["question"]
+def consistent_combinations(ids):
+    """Mask of the combinations agreeing with the answered (non-zero) option ids."""
+    ids = np.asarray(ids, dtype=np.int8)
+    return ((COMBINATION_ANSWERS == ids) | (ids == 0)).all(axis=1)
 
-    base_text = f"{question_line}\n\n"
-    for code in q["codes"]:
-        # Hide "Not applicable" only in the percussion question.
-        # The diagnostic logic remains unchanged: PERCUSSION is still collected
-        # and still used in the spreadsheet matching.
-        if q["field"] == "PERCUSSION" and code == "percussion_na":
-            continue
 
-        meta = OPTION_CATALOG[code]
-        label = meta.get("label_pt", meta["label"]) if is_pt else meta["label"]
-        desc = meta.get("description_pt", meta["description"]) if is_pt else meta["description"]
-        base_text += f"{label} - {desc}\n"
-    return base_text.strip()
+def lookup_outcomes(keys):
+    """Outcome ids of many complete packed keys at once; -1 = no diagnosis or unreachable."""
+    keys = np.asarray(keys, dtype=np.int64)
+    index = np.minimum(np.searchsorted(COMBINATION_KEYS, keys), len(COMBINATION_KEYS) - 1)
+    return np.where(COMBINATION_KEYS[index] == keys, COMBINATION_OUTCOMES[index], -1)
 
 
-def build_intro(language: str) -> str:
-    intro_text = """
-Hello! I am Endo10 EVO, a virtual assistant developed to support diagnostic reasoning in Endodontics.
-This system conducts a structured clinical screening based on signs, symptoms, and complementary examination findings. At the end of the process, a diagnostic suggestion will be presented according to the reference nomenclature adopted by the system.
-Please answer one item at a time, according to the option currently requested.
-""".strip()
-    return translate_text(intro_text, language)
+@lru_cache(maxsize=8192)
+def analyze_partial_answers(key: int):
+    """
+    For a packed partial answer key, return the reachable outcome ids and the
+    unanswered fields that can still change the outcome: a field is relevant
+    when two combinations differing only in that field lead to different outcomes.
+    """
+    ids = answer_ids(key)
+    mask = consistent_combinations(ids)
+    answers, outcomes = COMBINATION_ANSWERS[mask], COMBINATION_OUTCOMES[mask]
+    outcome_set = frozenset(np.unique(outcomes).tolist())
+    relevant = []
+    if len(outcome_set) > 1:
+        packed = answers.astype(np.int64) @ FIELD_WEIGHTS
+        for pos, field in enumerate(FIELD_ORDER):
+            if ids[pos]:
+                continue
+            others = packed - answers[:, pos].astype(np.int64) * FIELD_WEIGHTS[pos]
+            pairs = np.unique(np.stack([others, outcomes.astype(np.int64)], axis=1), axis=0)
+            if len(np.unique(pairs[:, 0])) < len(pairs):
+                relevant.append(field)
+    return outcome_set, tuple(relevant)
 
 
-def build_intro_and_first_question(language: str) -> str:
-    return f"{build_intro(language)}\n\n{build_question_text(0, language)}"
+def relevant_remaining_fields(key: int):
+    return analyze_partial_answers(key)[1]
 
 
-def build_inconsistent_message(language: str) -> str:
-    return translate_text(
-        "I could not find a diagnosis for this exact combination of findings. Please review the selected clinical information.",
-        language,
-    )
+def is_outcome_determined(key: int) -> bool:
+    outcome_set, relevant = analyze_partial_answers(key)
+    return len(outcome_set) == 1 and not relevant
 
 
-def build_incomplete_message(language: str) -> str:
-    return translate_text(
-        "The screening is incomplete. Please answer all required items before requesting the diagnosis.",
-        language,
-    )
+def determined_outcome(key: int):
+    """
+    Return the outcome id if the answers already fix it. None means either
+    "not determined yet" or "determined to have no diagnosis"; use
+    is_outcome_determined() to tell them apart.
+    """
+    if not is_outcome_determined(key):
+        return None
+    (leaf_id,) = analyze_partial_answers(key)[0]
+    return leaf_id if leaf_id >= 0 else None
 
 
-def build_invalid_answer_message(index: int, language: str) -> str:
-    if normalize_text(language) == "portuguese":
-        text = "Não consegui identificar essa resposta com segurança. Responda usando uma das opções mostradas."
-    else:
-        text = "I could not identify that response safely. Please answer using one of the listed options."
-    return f"{text}\n\n{build_question_text(index, language)}"
+def describe_candidates(key: int, language: str = "en"):
+    outcome_set, relevant = analyze_partial_answers(key)
+    candidates = [
+        dict(zip(DIAGNOSIS_FIELDS, DIAGNOSIS_TEXTS[language][i]))
+        for i in sorted(outcome_set)
+        if i >= 0
+    ]
+    return {
+        "candidates": candidates,
+        "may_have_no_diagnosis": -1 in outcome_set,
+        "relevant_remaining_fields": list(relevant),
+        "determined": is_outcome_determined(key),
+    }
 
 
-def format_captured_fields(extracted: dict, language: str):
-    return {field: label_for_code(code, language) for field, code in extracted.items()}
+def spreadsheet_row_number(label) -> int:
+    # 1-based Excel row, counting the header line.
+    return int(label) + 2
 
-# =========================
-# EXTRACTION - STRICT SEQUENTIAL FLOW
-# =========================
-def extract_answers_fallback(user_text: str, session: dict):
+
+def analyze_spreadsheet():
     """
-    Rule-based extraction limited to the current question only.
-    This prevents generic answers such as 'normal' or 'sem dor' from filling multiple fields.
+    Offline consistency report over the canonicalized spreadsheet. Used by
+    analyze_spreadsheet.py at build time; the request path only reads
+    DIAGNOSIS_LOOKUP.
     """
-    extracted = {}
-    sync_current_question(session)
-
-    if session["stage"] == "completed":
-        return extracted
+    conflicting_duplicates = []
+    redundant_duplicates = []
+    for key, labels in ROW_INDEX.items():
+        if len(labels) < 2:
+            continue
+        triples = {diagnosis_triple(label) for label in labels}
+        entry = {
+            "answers": unpack_answers(key),
+            "rows": [spreadsheet_row_number(label) for label in labels],
+        }
+        if len(triples) > 1:
+            entry["diagnoses"] = [list(triple) for triple in sorted(triples)]
+            conflicting_duplicates.append(entry)
+        else:
+            redundant_duplicates.append(entry)
+
+    used_labels = {label for label in DIAGNOSIS_LOOKUP.values() if label is not None}
+    unreachable_rows = []
+    for key, labels in ROW_INDEX.items():
+        for label in labels:
+            if label in used_labels:
+                continue
+            if not is_reachable_combination(key):
+                reason = "business_rule"
+            elif len({diagnosis_triple(other) for other in labels}) > 1:
+                reason = "conflicting_duplicate"
+            else:
+                reason = "redundant_duplicate"
+            unreachable_rows.append({"row": spreadsheet_row_number(label), "reason": reason})
+
+    no_diagnosis = [unpack_answers(key) for key, label in DIAGNOSIS_LOOKUP.items() if label is None]
+
+    wildcard_shadowed = []
+    for key, labels in ROW_INDEX.items():
+        if answer_code(key, "PERCUSSION") != "percussion_na":
+            continue
+        shadowed_by = {}
+        for code in ("percussion_normal", "percussion_sensitive"):
+            exact = set_answer(key, "PERCUSSION", code)
+            if exact in ROW_INDEX:
+                shadowed_by[code] = [spreadsheet_row_number(label) for label in ROW_INDEX[exact]]
+        if shadowed_by:
+            wildcard_shadowed.append({
+                "rows": [spreadsheet_row_number(label) for label in labels],
+                "fully_shadowed": len(shadowed_by) == 2,
+                "shadowed_by": shadowed_by,
+            })
+
+    total_combinations = 1
+    for codes in FIELD_CODES:
+        total_combinations *= len(codes)
+
+    localized_sheets = {}
+    for language, frame in DIAGNOSIS_FRAMES.items():
+        if language == "en":
+            continue
+        diagnosed = [key for key, label in DIAGNOSIS_LOOKUP.items() if label is not None]
+        positions = DECISION_MATRICES[language].match([answer_ids(key) for key in diagnosed])
+        fallbacks = [unpack_answers(key) for key, position in zip(diagnosed, positions) if position < 0]
+        localized_sheets[language] = {
+            "sheet": LOCALIZED_SHEETS[language][0],
+            "rows": len(frame),
+            "combinations_using_primary_texts": fallbacks,
+        }
+
+    return {
+        "knowledge_base_version": KNOWLEDGE_BASE_VERSION,
+        "rows": len(df),
+        "combination_space": total_combinations,
+        "reachable_combinations": len(DIAGNOSIS_LOOKUP),
+        "combinations_with_diagnosis": len(DIAGNOSIS_LOOKUP) - len(no_diagnosis),
+        "conflicting_duplicates": conflicting_duplicates,
+        "redundant_duplicates": redundant_duplicates,
+        "unreachable_rows": unreachable_rows,
+        "combinations_without_diagnosis": no_diagnosis,
+        "wildcard_shadowed_rows": wildcard_shadowed,
+        "localized_sheets": localized_sheets,
+    }
+
+
+def export_diagnosis_lookup():
+    """Serializable form of DIAGNOSIS_LOOKUP, one entry per reachable combination."""
+    entries = []
+    for key, label in DIAGNOSIS_LOOKUP.items():
+        entry = {"answers": unpack_answers(key), "row": None, "diagnosis": None}
+        if label is not None:
+            entry["row"] = spreadsheet_row_number(label)
+            entry["diagnosis"] = dict(zip(DIAGNOSIS_COLUMNS, diagnosis_triple(label)))
+            entry["localized"] = {
+                language: dict(zip(DIAGNOSIS_COLUMNS, texts[OUTCOME_IDS[key]]))
+                for language, texts in DIAGNOSIS_TEXTS.items()
+                if language != "en"
+            }
+        entries.append(entry)
+    return {"knowledge_base_version": KNOWLEDGE_BASE_VERSION, "fields": FIELD_ORDER, "entries": entries}
+
+
+ROW_INDEX = build_row_index(df)
+DECISION_MATRICES = {language: DecisionMatrix(frame) for language, frame in DIAGNOSIS_FRAMES.items()}
+DIAGNOSIS_LOOKUP = build_diagnosis_lookup(DECISION_MATRICES["en"])
+OUTCOME_IDS, DIAGNOSIS_TEXTS = build_outcome_tables(DIAGNOSIS_LOOKUP, DECISION_MATRICES)
+COMBINATION_ANSWERS, COMBINATION_KEYS, COMBINATION_OUTCOMES = build_combination_matrix(OUTCOME_IDS)
+
+# =========================
+# SESSIONS
+# =========================
+class KeyedLocks:
+    """One lock per key, created on demand and dropped once nobody holds or waits for it."""
+
+    def __init__(self):
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def acquire(self, key, timeout: float) -> bool:
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        if entry[0].acquire(timeout=timeout):
+            return True
+        self._forget(key, entry)
+        return False
+
+    def release(self, key):
+        with self._guard:
+            entry = self._locks[key]
+        entry[0].release()
+        self._forget(key, entry)
+
+    def _forget(self, key, entry):
+        with self._guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+class MemorySessionStore:
+    """
+    Process-local session store. Only suitable for a single worker.
+
+    Sessions are kept in access order (least recently used first) so the
+    sweeper finds idle and excess sessions at the front without a scan.
+    """
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._touched = {}
+        self._counters = {}
+        self._counter_times = {}
+        self._lock = threading.Lock()
+        self._session_locks = KeyedLocks()
+
+    def acquire(self, session_id, timeout: float) -> bool:
+        """Take the session's update lock (see locked_session); False after `timeout` seconds."""
+        return self._session_locks.acquire(session_id, timeout)
+
+    def release(self, session_id):
+        self._session_locks.release(session_id)
+
+    def get_counter(self, key, default=None):
+        return self._counters.get(key, default)
+
+    def update_counter(self, key, update):
+        """Atomically replace counter `key` with update(current value or None) and return it."""
+        return self.update_counters([key], lambda values: [update(values[0])])[0]
+
+    def update_counters(self, keys, update):
+        """update_counter for several counters at once: update(list of values) returns the new list."""
+        with self._lock:
+            values = update([self._counters.get(key) for key in keys])
+            now = time.time()
+            for key, value in zip(keys, values):
+                self._counters[key] = value
+                self._counter_times[key] = now
+            return values
+
+    def _touch(self, session_id):
+        self._data.move_to_end(session_id)
+        self._touched[session_id] = time.time()
+
+    def __contains__(self, session_id):
+        return session_id in self._data
+
+    def __getitem__(self, session_id):
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        with self._lock:
+            self._data[session_id] = session
+            self._touch(session_id)
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            self._data.pop(session_id, None)
+            self._touched.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, session_id, default=None):
+        with self._lock:
+            session = self._data.get(session_id)
+            if session is None:
+                return default
+            self._touch(session_id)
+            return session
+
+    def _pop_oldest(self):
+        session_id, session = self._data.popitem(last=False)
+        self._touched.pop(session_id, None)
+        return session_id, session
+
+    def expire(self, idle_before: float):
+        """Remove and return (id, session) pairs not accessed since `idle_before`."""
+        removed = []
+        with self._lock:
+            while self._data and self._touched[next(iter(self._data))] < idle_before:
+                removed.append(self._pop_oldest())
+        return removed
+
+    def evict(self, max_sessions: int):
+        """Remove and return the least recently used sessions beyond `max_sessions`."""
+        removed = []
+        with self._lock:
+            while len(self._data) > max_sessions:
+                removed.append(self._pop_oldest())
+        return removed
+
+    def compact(self, idle_before: float, compact) -> int:
+        """Apply compact(session) to sessions idle since `idle_before`; returns how many changed."""
+        with self._lock:
+            idle = list(itertools.takewhile(lambda item: self._touched[item[0]] < idle_before, self._data.items()))
+        return sum(1 for _, session in idle if compact(session))
+
+    def expire_counters(self, before: float) -> int:
+        with self._lock:
+            stale = [key for key, updated_at in self._counter_times.items() if updated_at < before]
+            for key in stale:
+                self._counters.pop(key, None)
+                self._counter_times.pop(key, None)
+        return len(stale)
+
+
+class SQLiteSessionStore:
+    """
+    Session store shared by every worker on the host.
+
+    Sessions are stored as JSON documents. Connections are opened lazily per
+    process so that a store created before gunicorn forks is still safe to use
+    in the workers. Session update locks are rows in `session_locks` leased by
+    one process, so they also serialize requests handled by different workers.
+    """
+
+    def __init__(self, path: str, lock_lease: float = 120.0):
+        self.path = str(path)
+        self.lock_lease = lock_lease
+        self._pid = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._session_locks = KeyedLocks()
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_locks (id TEXT PRIMARY KEY, owner INTEGER NOT NULL, until REAL NOT NULL)"
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __getitem__(self, session_id):
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        data = json.dumps(session, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO sessions (id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (session_id, data, time.time()),
+            )
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            self._connection().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def get(self, session_id, default=None):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT data FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return default
+        return safe_json_loads(row[0]) or default
+
+    def acquire(self, session_id, timeout: float) -> bool:
+        """
+        Take the session's update lock (see locked_session); False after
+        `timeout` seconds. Threads of this process queue on an in-process lock,
+        other workers on the lease row.
+        """
+        deadline = time.monotonic() + timeout
+        if not self._session_locks.acquire(session_id, timeout):
+            return False
+        while True:
+            now = time.time()
+            with self._lock:
+                taken = self._connection().execute(
+                    "INSERT INTO session_locks (id, owner, until) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET owner = excluded.owner, until = excluded.until "
+                    "WHERE session_locks.until < ?",
+                    (session_id, os.getpid(), now + self.lock_lease, now),
+                ).rowcount
+            if taken:
+                return True
+            if time.monotonic() >= deadline:
+                self._session_locks.release(session_id)
+                return False
+            time.sleep(0.02)
+
+    def release(self, session_id):
+        try:
+            with self._lock:
+                self._connection().execute(
+                    "DELETE FROM session_locks WHERE id = ? AND owner = ?", (session_id, os.getpid())
+                )
+        finally:
+            self._session_locks.release(session_id)
+
+    def get_counter(self, key, default=None):
+        with self._lock:
+            row = self._connection().execute("SELECT data FROM counters WHERE id = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def update_counter(self, key, update):
+        """
+        Atomically replace counter `key` with update(current value or None) and
+        return it. BEGIN IMMEDIATE serializes the read-modify-write across workers.
+        """
+        return self.update_counters([key], lambda values: [update(values[0])])[0]
+
+    def update_counters(self, keys, update):
+        """update_counter for several counters in one transaction: update(list of values) returns the new list."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = []
+                for key in keys:
+                    row = conn.execute("SELECT data FROM counters WHERE id = ?", (key,)).fetchone()
+                    current.append(None if row is None else json.loads(row[0]))
+                values = update(current)
+                now = time.time()
+                conn.executemany(
+                    "INSERT INTO counters (id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    [(key, json.dumps(value), now) for key, value in zip(keys, values)],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return values
+
+    def _delete_returning(self, sql, params):
+        with self._lock:
+            rows = self._connection().execute(sql, params).fetchall()
+        return [(session_id, safe_json_loads(data)) for session_id, data in rows]
+
+    def expire(self, idle_before: float):
+        """Remove and return (id, session) pairs not written since `idle_before`."""
+        return self._delete_returning("DELETE FROM sessions WHERE updated_at < ? RETURNING id, data", (idle_before,))
+
+    def evict(self, max_sessions: int):
+        """Remove and return the least recently written sessions beyond `max_sessions`."""
+        excess = len(self) - max_sessions
+        if excess <= 0:
+            return []
+        return self._delete_returning(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY updated_at LIMIT ?) RETURNING id, data",
+            (excess,),
+        )
+
+    def compact(self, idle_before: float, compact) -> int:
+        """
+        Apply compact(session) to completed sessions idle since `idle_before` that
+        still carry a transcript or cached payload. updated_at is preserved, and a
+        row written again in the meantime is left alone.
+        """
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT id, data, updated_at FROM sessions WHERE updated_at < ? "
+                "AND json_extract(data, '$.stage') = 'completed' "
+                "AND (json_extract(data, '$.last_bot_payload') IS NOT NULL OR json_array_length(data, '$.history') > 0)",
+                (idle_before,),
+            ).fetchall()
+        compacted = 0
+        for session_id, data, updated_at in rows:
+            session = safe_json_loads(data)
+            if not session or not compact(session):
+                continue
+            with self._lock:
+                cursor = self._connection().execute(
+                    "UPDATE sessions SET data = ? WHERE id = ? AND updated_at = ?",
+                    (json.dumps(session, ensure_ascii=False, separators=(",", ":")), session_id, updated_at),
+                )
+            compacted += cursor.rowcount
+        return compacted
+
+    def expire_counters(self, before: float) -> int:
+        with self._lock:
+            return self._connection().execute("DELETE FROM counters WHERE updated_at < ?", (before,)).rowcount
+
+
+def build_session_store():
+    if SESSION_STORE == "sqlite":
+        return SQLiteSessionStore(SESSION_DB_PATH, SESSION_LOCK_LEASE)
+    if SESSION_STORE != "memory":
+        raise RuntimeError(f"Unknown SESSION_STORE '{SESSION_STORE}'. Use 'memory' or 'sqlite'.")
+    return MemorySessionStore()
+
+
+sessions = build_session_store()
+
+
+def empty_session():
+    return {
+        "language": None,
+        "stage": "greeting",
+        "current_question": 0,
+        "answer_key": 0,
+        "diagnosis_result": {},
+        "history": [],
+        "last_bot_payload": None,
+        "stats": {"turns": 0, "llm_turns": 0, "reasks": 0},
+        "recorded": False,
+    }
+
+
+def upgrade_session(session: dict):
+    # Sessions stored before answers were packed into an int carry a code dict.
+    if session is not None and "answers" in session:
+        session["answer_key"] = pack_answers(session.pop("answers"))
+    return session
+
+
+def create_session_if_needed(session_id: str):
+    SESSION_SWEEPER.ensure_running()
+    session = find_session(session_id)
+    if session is None:
+        session = empty_session()
+        sessions[session_id] = session
+        current_span().set_attribute("session.stage_before", session["stage"])
+    return session
+
+
+def find_session(session_id: str):
+    """Stored session or None. Read-only endpoints use this so unknown ids do not create sessions."""
+    session = upgrade_session(sessions.get(session_id))
+    span = current_span()
+    span.set_attribute("session.id", session_id)
+    if session is not None:
+        span.set_attribute("session.stage_before", session["stage"])
+    return session
+
+
+@contextmanager
+def session_lock(session_id: str):
+    """Hold the session's update lock; 409 when it stays busy for SESSION_LOCK_WAIT seconds."""
+    if not sessions.acquire(session_id, SESSION_LOCK_WAIT):
+        raise HTTPException(status_code=409, detail="Another request for this session is still in progress.")
+    try:
+        yield
+    finally:
+        sessions.release(session_id)
+
+
+@contextmanager
+def locked_session(session_id: str, create: bool = True):
+    """
+    Load -> mutate -> save one session under its update lock, so concurrent
+    requests for the same id (threadpool handlers, other workers) run one
+    after the other instead of overwriting each other's answers. Yields None
+    for an unknown id when `create` is False; nothing is saved then.
+    """
+    with session_lock(session_id):
+        session = create_session_if_needed(session_id) if create else find_session(session_id)
+        try:
+            yield session
+        finally:
+            if session is not None:
+                save_session(session_id, session)
+
+
+def save_session(session_id: str, session: dict):
+    # No-op for the in-memory store (the dict is mutated in place); required for shared stores.
+    sessions[session_id] = session
+    span = current_span()
+    span.set_attribute("session.stage", session["stage"])
+    span.set_attribute("session.current_question", session["current_question"])
+
+
+def compact_session(session: dict) -> bool:
+    """Reduce a completed session to answers + diagnosis; the transcript and cached payload are dropped."""
+    if session.get("stage") != "completed" or (not session.get("history") and session.get("last_bot_payload") is None):
+        return False
+    session["history"] = []
+    session["last_bot_payload"] = None
+    return True
+
+
+def retire_session(session_id: str, session: dict):
+    """Bookkeeping for a session removed by the sweeper, as /reset/ does for a replaced one."""
+    if session is not None and session.get("stage") == "triage":
+        record_screening(session_id, session, "abandoned")
+    log_event("expire", session_id)
+
+
+class SessionSweeper:
+    """
+    Background session GC. Every `interval` seconds it expires idle sessions,
+    evicts the least recently used ones beyond SESSION_MAX, compacts idle
+    completed sessions and drops rate-limit/budget counters from past windows.
+    Each worker runs its own sweeper; with the SQLite store a removed row is
+    returned to only one of them, so an abandoned screening is recorded once.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.totals = {"sweeps": 0, "expired": 0, "evicted": 0, "compacted": 0, "counters_expired": 0}
+        self.last_sweep_ms = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self):
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="session-sweeper", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception:
+                pass  # e.g. a locked database; the next sweep retries
+
+    def sweep(self) -> dict:
+        started = time.perf_counter()
+        now = time.time()
+        expired = sessions.expire(now - SESSION_IDLE_TTL) if SESSION_IDLE_TTL > 0 else []
+        evicted = sessions.evict(SESSION_MAX) if SESSION_MAX > 0 else []
+        for session_id, session in expired + evicted:
+            retire_session(session_id, session)
+        result = {
+            "expired": len(expired),
+            "evicted": len(evicted),
+            "compacted": sessions.compact(now - SESSION_COMPACT_AFTER, compact_session) if SESSION_COMPACT_AFTER >= 0 else 0,
+            # Budget counters belong to one window and idle rate buckets are full again.
+            "counters_expired": sessions.expire_counters(now - max(LLM_BUDGET_WINDOW, 3600)),
+        }
+        with self._lock:
+            self.totals["sweeps"] += 1
+            for key, value in result.items():
+                self.totals[key] += value
+            self.last_sweep_ms = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    def stats(self) -> dict:
+        return {"interval_seconds": self.interval, "last_sweep_ms": self.last_sweep_ms, **self.totals}
+
+
+SESSION_SWEEPER = SessionSweeper(SESSION_SWEEP_INTERVAL)
+
+
+def cache_payload(session: dict, payload: dict):
+    session["last_bot_payload"] = payload
+    return payload
+
+
+def get_question_by_index(index: int):
+    if index < 0 or index >= len(QUESTION_DEFS):
+        raise HTTPException(status_code=400, detail="Invalid question index.")
+    return QUESTION_DEFS[index]
+
+
+def apply_business_rules(session: dict):
+    # If pain is absent, pain onset is not applicable and should not be asked.
+    if answer_code(session["answer_key"], "PAIN") == "pain_absent":
+        session["answer_key"] = set_answer(session["answer_key"], "ONSET", "onset_na")
+
+
+def get_next_unanswered_index(session: dict):
+    relevant = None
+    if ADAPTIVE_QUESTIONING:
+        # Only skip when the remaining fields provably cannot change the result.
+        relevant = set(relevant_remaining_fields(session["answer_key"]))
+    for idx, q in enumerate(QUESTION_DEFS):
+        if not is_answered(session["answer_key"], q["field"]) and (relevant is None or q["field"] in relevant):
+            return idx
+    return len(QUESTION_DEFS)
+
+
+def sync_current_question(session: dict):
+    apply_business_rules(session)
+    session["current_question"] = get_next_unanswered_index(session)
+    if session["current_question"] >= len(QUESTION_DEFS):
+        session["stage"] = "completed"
+    elif session["stage"] != "greeting":
+        session["stage"] = "triage"
+
+
+def build_question_text(index: int, language: str) -> str:
+    q = get_question_by_index(index)
+    lang = catalog_language(language)
+    question_line = q.get("question_pt", q["question"]) if lang == "pt" else q["question"]
+    labels = OPTION_LABELS[lang][index]
+    descriptions = OPTION_DESCRIPTIONS[lang][index]
+
+    base_text = f"{question_line}\n\n"
+    for option_id, code in enumerate(q["codes"], start=1):
+        # Hide "Not applicable" only in the percussion question.
+        # The diagnostic logic remains unchanged: PERCUSSION is still collected
+        # and still used in the spreadsheet matching.
+        if q["field"] == "PERCUSSION" and code == "percussion_na":
+            continue
+
+        base_text += f"{labels[option_id]} - {descriptions[option_id]}\n"
+    return base_text.strip()
+
+
+INTRO_TEXT = """
+Hello! I am Endo10 EVO, a virtual assistant developed to support diagnostic reasoning in Endodontics.
+This system conducts a structured clinical screening based on signs, symptoms, and complementary examination findings. At the end of the process, a diagnostic suggestion will be presented according to the reference nomenclature adopted by the system.
+Please answer one item at a time, according to the option currently requested.
+""".strip()
+INCONSISTENT_TEXT = "I could not find a diagnosis for this exact combination of findings. Please review the selected clinical information."
+INCOMPLETE_TEXT = "The screening is incomplete. Please answer all required items before requesting the diagnosis."
+SCREENING_COMPLETED_TEXT = "Screening completed. We can now calculate the diagnosis."
+
+# Fixed texts a session may need; translated together when a new language is first seen.
+SESSION_TEXTS = [INTRO_TEXT, INCONSISTENT_TEXT, INCOMPLETE_TEXT, SCREENING_COMPLETED_TEXT]
+
+# Curated translations served before the cache or the upstream model (and the only ones offline).
+BUILTIN_TRANSLATIONS = {
+    "portuguese": {
+        INTRO_TEXT: """
+Olá! Eu sou o Endo10 EVO, um assistente virtual desenvolvido para apoiar o raciocínio diagnóstico em Endodontia.
+Este sistema conduz uma triagem clínica estruturada com base em sinais, sintomas e achados de exames complementares. Ao final do processo, será apresentada uma sugestão diagnóstica de acordo com a nomenclatura de referência adotada pelo sistema.
+Por favor, responda um item de cada vez, de acordo com a opção solicitada no momento.
+""".strip(),
+        INCONSISTENT_TEXT: "Não encontrei um diagnóstico para esta combinação exata de achados. Por favor, revise as informações clínicas selecionadas.",
+        INCOMPLETE_TEXT: "A triagem está incompleta. Por favor, responda a todos os itens obrigatórios antes de solicitar o diagnóstico.",
+        SCREENING_COMPLETED_TEXT: "Triagem concluída. Agora podemos calcular o diagnóstico.",
+    },
+}
+
+# Final screening message, filled locally in offline mode instead of translated.
+FINAL_MESSAGE_TEMPLATES = {
+    "en": """
+Screening completed.
+
+Diagnostic result:
+- Diagnosis (AAE nomenclature 2009/2013): {diagnosis_aae_2009_2013}
+- Diagnosis (AAE/ESE nomenclature 2025): {diagnosis_aae_ese_2025}
+- Complementary diagnosis: {complementary_diagnosis}
+""".strip(),
+    "pt": """
+Triagem concluída.
+
+Resultado diagnóstico:
+- Diagnóstico (nomenclatura AAE 2009/2013): {diagnosis_aae_2009_2013}
+- Diagnóstico (nomenclatura AAE/ESE 2025): {diagnosis_aae_ese_2025}
+- Diagnóstico complementar: {complementary_diagnosis}
+""".strip(),
+}
+
+# Offline stand-in for the model-written explanation.
+OFFLINE_EXPLANATION_TEMPLATES = {
+    "en": """
+Diagnostic result according to AAE nomenclature 2009/2013: {diagnosis_aae_2009_2013}.
+According to the AAE/ESE nomenclature 2025: {diagnosis_aae_ese_2025}. The two nomenclatures are different diagnostic classification systems describing the same clinical findings.
+Complementary diagnosis: {complementary_diagnosis}.
+This result comes from the rule-based screening table; a detailed written explanation is not available in offline mode.
+""".strip(),
+    "pt": """
+Resultado diagnóstico segundo a nomenclatura AAE 2009/2013: {diagnosis_aae_2009_2013}.
+Segundo a nomenclatura AAE/ESE 2025: {diagnosis_aae_ese_2025}. As duas nomenclaturas são sistemas de classificação diagnóstica diferentes que descrevem os mesmos achados clínicos.
+Diagnóstico complementar: {complementary_diagnosis}.
+Este resultado vem da tabela de triagem baseada em regras; uma explicação escrita detalhada não está disponível no modo offline.
+""".strip(),
+}
+
+
+def warm_language(language: str):
+    """Translate every fixed session text for `language` in one round-trip."""
+    translate_batch(SESSION_TEXTS, language)
+
+
+def build_intro(language: str) -> str:
+    return translate_text(INTRO_TEXT, language)
+
+
+def build_intro_and_first_question(language: str) -> str:
+    return f"{build_intro(language)}\n\n{build_question_text(0, language)}"
+
+
+def build_inconsistent_message(language: str) -> str:
+    return translate_text(INCONSISTENT_TEXT, language)
+
+
+def build_incomplete_message(language: str) -> str:
+    return translate_text(INCOMPLETE_TEXT, language)
+
+
+def build_invalid_answer_message(index: int, language: str) -> str:
+    if normalize_text(language) == "portuguese":
+        text = "Não consegui identificar essa resposta com segurança. Responda usando uma das opções mostradas."
+    else:
+        text = "I could not identify that response safely. Please answer using one of the listed options."
+    return f"{text}\n\n{build_question_text(index, language)}"
+
+
+def format_captured_fields(extracted: dict, language: str):
+    return {field: label_for_code(code, language) for field, code in extracted.items()}
+
+# =========================
+# RATE LIMITS & LLM BUDGETS
+# =========================
+# Tenant of the current request: "key:<hash>" for API-key callers, "anonymous"
+# otherwise. None (scripts, startup) means internal work that no budget applies to.
+CURRENT_TENANT = ContextVar("current_tenant", default=None)
+
+
+class LLMBudgetExceeded(UpstreamUnavailable):
+    """Raised without calling OpenAI once the tenant has spent its LLM token budget for the window."""
+
+
+def tenant_for_api_key(api_key: str) -> str:
+    if not api_key:
+        return "anonymous"
+    return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+TENANT_BUDGETS = {
+    (key if key == "anonymous" else tenant_for_api_key(key)): int(budget)
+    for key, budget in LLM_TENANT_BUDGETS.items()
+}
+LIMIT_STATS = {"rate_limited": 0, "budget_exhausted": 0, "tokens_charged": 0}
+
+
+def request_principal(api_key: str, client_host: str) -> str:
+    """Rate-limit identity: the API key's tenant when one is sent, else the client address."""
+    return tenant_for_api_key(api_key) if api_key else f"ip:{client_host or 'unknown'}"
+
+
+@app.middleware("http")
+async def bind_tenant(request: Request, call_next):
+    CURRENT_TENANT.set(tenant_for_api_key(request.headers.get(API_KEY_HEADER)))
+    return await call_next(request)
+
+
+def take_rate_tokens(bucket_keys) -> float:
+    """
+    Take one token from each bucket in the shared store (refilled at
+    RATE_LIMIT_PER_MINUTE, capped at RATE_LIMIT_BURST), or from none of them.
+    Returns 0 when the tokens were taken, else the seconds until every bucket
+    has one. All buckets are checked and charged in one counter transaction.
+    """
+    rate = RATE_LIMIT_PER_MINUTE / 60.0
+    burst = max(1, RATE_LIMIT_BURST)
+    now = time.time()
+    outcome = {}
+
+    def update(states):
+        levels = []
+        for state in states:
+            tokens, updated_at = state or (burst, now)
+            levels.append(min(burst, tokens + max(0.0, now - updated_at) * rate))
+        allowed = all(tokens >= 1 for tokens in levels)
+        outcome["wait"] = 0.0 if allowed else max((1 - tokens) / rate for tokens in levels if tokens < 1)
+        return [[tokens - 1 if allowed else tokens, now] for tokens in levels]
+
+    sessions.update_counters([f"rate:{bucket_key}" for bucket_key in bucket_keys], update)
+    return outcome["wait"]
+
+
+def rate_limit_wait(principal: str, session_id: str = None) -> float:
+    """Charge one call to the principal's and the session's buckets; seconds to wait if either is empty."""
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return 0.0
+    wait_seconds = take_rate_tokens([principal] + ([f"session:{session_id}"] if session_id else []))
+    if wait_seconds:
+        LIMIT_STATS["rate_limited"] += 1
+    return wait_seconds
+
+
+def client_address(connection):
+    """
+    Address of the client behind the proxy. Uvicorn rewrites connection.client
+    from X-Forwarded-For only for peers in FORWARDED_ALLOW_IPS (see
+    gunicorn.conf.py), so forged headers from other peers are ignored.
+    """
+    return connection.client.host if connection.client else None
+
+
+def enforce_rate_limit(connection, session_id: str = None):
+    """Raise HTTPException(429) with Retry-After for an over-limit HTTP request or WebSocket message."""
+    principal = request_principal(connection.headers.get(API_KEY_HEADER), client_address(connection))
+    wait_seconds = rate_limit_wait(principal, session_id)
+    if wait_seconds:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please slow down.",
+            headers={"Retry-After": str(math.ceil(wait_seconds))},
+        )
+
+
+def tenant_budget(tenant: str) -> int:
+    return TENANT_BUDGETS.get(tenant, LLM_TOKEN_BUDGET)
+
+
+def budget_counter_key(tenant: str) -> str:
+    return f"budget:{tenant}:{int(time.time() // LLM_BUDGET_WINDOW)}"
+
+
+def check_llm_budget():
+    """Raise LLMBudgetExceeded when the current tenant has no LLM tokens left in this window."""
+    tenant = CURRENT_TENANT.get()
+    if tenant is None or tenant_budget(tenant) <= 0:
+        return
+    if sessions.get_counter(budget_counter_key(tenant), 0) >= tenant_budget(tenant):
+        LIMIT_STATS["budget_exhausted"] += 1
+        raise LLMBudgetExceeded(f"LLM token budget of tenant '{tenant}' is exhausted for this window.")
+
+
+def charge_llm_budget(tokens: int):
+    tenant = CURRENT_TENANT.get()
+    if tenant is None or not tokens or tenant_budget(tenant) <= 0:
+        return
+    LIMIT_STATS["tokens_charged"] += tokens
+    sessions.update_counter(budget_counter_key(tenant), lambda spent: (spent or 0) + tokens)
+
+
+def llm_budget_status(tenant: str) -> dict:
+    budget = tenant_budget(tenant)
+    spent = sessions.get_counter(budget_counter_key(tenant), 0) if budget > 0 else 0
+    return {"tenant": tenant, "budget": budget or None, "spent": spent, "window_seconds": LLM_BUDGET_WINDOW}
+
+# =========================
+# EXTRACTION - STRICT SEQUENTIAL FLOW
+# =========================
+def extract_answers_fallback(user_text: str, session: dict):
+    """
+    Rule-based extraction limited to the current question only.
+    This prevents generic answers such as 'normal' or 'sem dor' from filling multiple fields.
+    """
+    extracted = {}
+    sync_current_question(session)
+
+    if session["stage"] == "completed":
+        return extracted
 
     current_field = QUESTION_DEFS[session["current_question"]]["field"]
-    current_code = canonicalize_value(current_field, user_text)
+    with trace_span("extract.deterministic", field=current_field) as span:
+        current_code, stage = canonicalize_value_with_stage(current_field, user_text)
+        span.set_attribute("canonicalization.stage", stage or "none")
 
     if current_code:
         extracted[current_field] = current_code
@@ -777,6 +2939,119 @@ def extract_answers_fallback(user_text: str, session: dict):
     return extracted
 
 
+def tiktoken_cached(encoding_name: str) -> bool:
+    """Whether tiktoken can load the encoding from its local cache, i.e. without downloading it."""
+    cache_dir = os.getenv("TIKTOKEN_CACHE_DIR", os.getenv("DATA_GYM_CACHE_DIR"))
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir:  # an empty cache dir disables tiktoken's cache
+        return False
+    url = f"https://openaipublic.blob.core.windows.net/encodings/{encoding_name}.tiktoken"
+    return os.path.exists(os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest()))
+
+
+@lru_cache(maxsize=1)
+def token_encoder():
+    """
+    tiktoken encoding for MODEL_EXTRACT, loaded on first use. None (estimate)
+    in offline mode or when the encoding would have to be downloaded.
+    """
+    if tiktoken is None or OFFLINE_MODE:
+        return None
+    try:
+        encoding_name = tiktoken.encoding_name_for_model(MODEL_EXTRACT)
+    except KeyError:
+        encoding_name = "o200k_base"
+    if not tiktoken_cached(encoding_name):
+        return None
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception:  # e.g. a stale cache entry that could not be fetched again; estimate instead
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoder = token_encoder()
+    return len(encoder.encode(text)) if encoder is not None else -(-len(text) // 4)
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    encoder = token_encoder()
+    if encoder is None:
+        return text[:max_tokens * 4]
+    return encoder.decode(encoder.encode(text)[:max_tokens])
+
+
+EXTRACTION_SYSTEM_PROMPT = "You extract one clinical answer and return only JSON."
+
+
+def build_extraction_prefix(field: str) -> str:
+    """
+    Static part of the extraction prompt for one field, built once. The
+    options are compact JSON and the user's message is appended last, so every
+    call for a field shares the same prefix (eligible for upstream prompt caching).
+    """
+    options = [
+        {
+            "code": code,
+            "label": OPTION_CATALOG[code]["label"],
+            "label_pt": OPTION_CATALOG[code].get("label_pt", OPTION_CATALOG[code]["label"]),
+            "aliases": OPTION_CATALOG[code].get("aliases", [])[:EXTRACTION_MAX_ALIASES],
+        }
+        for code in FIELD_TO_CODES[field]
+    ]
+    return (
+        "You are extracting ONE structured answer for an endodontic triage chatbot.\n"
+        f"Current field: {field}\n"
+        f"Allowed options: {json.dumps(options, ensure_ascii=False, separators=(',', ':'))}\n"
+        'Return ONLY valid JSON: {"code": null, "confidence": 0.0}\n'
+        "Rules:\n"
+        "- Extract only the current field.\n"
+        "- Do not extract other clinical fields.\n"
+        "- Do not infer unstated findings.\n"
+        "- If the answer is ambiguous, return null.\n"
+        "- Confidence must be between 0 and 1.\n"
+        "User message:\n"
+    )
+
+
+EXTRACTION_PREFIXES = {field: build_extraction_prefix(field) for field in FIELD_ORDER}
+EXTRACTION_PROMPT_STATS = {"calls": 0, "prompt_tokens": 0, "trimmed": 0}
+
+
+@lru_cache(maxsize=None)
+def extraction_prefix_tokens(field: str) -> int:
+    return count_tokens(EXTRACTION_SYSTEM_PROMPT) + count_tokens(EXTRACTION_PREFIXES[field])
+
+
+def build_extraction_messages(field: str, user_text: str):
+    """
+    Messages for one extraction call and their estimated prompt tokens. The
+    user's text is trimmed when the prompt would exceed EXTRACTION_MAX_PROMPT_TOKENS
+    (at least 64 tokens of it are always kept).
+    """
+    text_tokens = count_tokens(user_text)
+    trimmed = False
+    if EXTRACTION_MAX_PROMPT_TOKENS > 0:
+        allowed = max(64, EXTRACTION_MAX_PROMPT_TOKENS - extraction_prefix_tokens(field))
+        if text_tokens > allowed:
+            user_text, text_tokens, trimmed = trim_to_tokens(user_text, allowed), allowed, True
+    messages = [
+        {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+        {"role": "user", "content": EXTRACTION_PREFIXES[field] + user_text},
+    ]
+    return messages, extraction_prefix_tokens(field) + text_tokens, trimmed
+
+
+def extraction_prompt_stats() -> dict:
+    return {
+        "tokenizer": "tiktoken" if token_encoder() is not None else "estimate",
+        "max_prompt_tokens": EXTRACTION_MAX_PROMPT_TOKENS or None,
+        "prefix_tokens": {field: extraction_prefix_tokens(field) for field in FIELD_ORDER},
+        **EXTRACTION_PROMPT_STATS,
+    }
+
+
 def extract_answers_with_llm(user_text: str, session: dict):
     """
     LLM extraction limited to the current question only.
@@ -789,48 +3064,31 @@ def extract_answers_with_llm(user_text: str, session: dict):
 
     current_field = QUESTION_DEFS[session["current_question"]]["field"]
 
-    options = []
-    for code in FIELD_TO_CODES[current_field]:
-        meta = OPTION_CATALOG[code]
-        options.append({
-            "code": code,
-            "label": meta["label"],
-            "label_pt": meta.get("label_pt", meta["label"]),
-            "aliases": meta.get("aliases", [])[:12],
-        })
-
-    prompt = f"""
-You are extracting ONE structured answer for an endodontic triage chatbot.
-
-Current field:
-{current_field}
+    with trace_span("extract.llm", field=current_field) as span:
+        extracted = extract_field_with_llm(user_text, current_field, span)
+        span.set_attribute("canonicalization.stage", "llm" if extracted else "none")
+        return extracted
 
-User message:
-{user_text}
 
-Allowed options:
-{json.dumps(options, ensure_ascii=False, indent=2)}
+def extract_field_with_llm(user_text: str, current_field: str, span=NOOP_SPAN):
+    cache_key = (current_field, normalize_text(user_text))
+    cached = LLM_EXTRACTION_CACHE.get(cache_key, KNOWLEDGE_BASE_VERSION)
+    span.set_attribute("cache_hit", cached is not CACHE_MISS)
+    if cached is not CACHE_MISS:
+        return dict(cached)
+    if OFFLINE_MODE:
+        return {}
 
-Return ONLY valid JSON:
-{{
-  "code": null,
-  "confidence": 0.0
-}}
-
-Rules:
-- Extract only the current field.
-- Do not extract other clinical fields.
-- Do not infer unstated findings.
-- If the answer is ambiguous, return null.
-- Confidence must be between 0 and 1.
-""".strip()
+    messages, prompt_tokens, trimmed = build_extraction_messages(current_field, user_text)
+    span.set_attribute("tokens.prompt_estimate", prompt_tokens)
+    span.set_attribute("prompt.trimmed", trimmed)
+    EXTRACTION_PROMPT_STATS["calls"] += 1
+    EXTRACTION_PROMPT_STATS["prompt_tokens"] += prompt_tokens
+    EXTRACTION_PROMPT_STATS["trimmed"] += trimmed
 
     try:
         response = safe_chat_completion(
-            messages=[
-                {"role": "system", "content": "You extract one clinical answer and return only JSON."},
-                {"role": "user", "content": prompt},
-            ],
+            messages=messages,
             model=MODEL_EXTRACT,
             temperature=0,
             response_format={"type": "json_object"},
@@ -842,13 +3100,15 @@ Rules:
         code = data.get("code")
         confidence = data.get("confidence", 0)
 
+        extracted = {}
         if code in FIELD_TO_CODES[current_field] and isinstance(confidence, (int, float)) and confidence >= 0.80:
             extracted = {current_field: code}
             if current_field == "PAIN" and code == "pain_absent":
                 extracted["ONSET"] = "onset_na"
-            return extracted
 
-        return {}
+        # Only definitive model answers are memoized; upstream errors are retried next time.
+        LLM_EXTRACTION_CACHE.set(cache_key, dict(extracted), KNOWLEDGE_BASE_VERSION)
+        return extracted
     except Exception:
         return {}
 
@@ -856,171 +3116,551 @@ Rules:
 def merge_extracted_answers(session: dict, extracted: dict):
     for field, code in extracted.items():
         if field in FIELD_ORDER and code in FIELD_TO_CODES[field]:
-            session["answers"][field] = code
+            session["answer_key"] = set_answer(session["answer_key"], field, code)
     sync_current_question(session)
 
 # =========================
 # DIAGNOSIS ENGINE
 # =========================
-def select_diagnosis_candidate(result: pd.DataFrame):
+def find_outcome(key: int):
     """
-    Select one row from a diagnostic match.
+    Return the outcome id for a complete packed answer key, or None.
 
-    Some spreadsheet combinations may be duplicated for internal testing or
-    alternative clinical routes. This function returns the first row only when
-    all matched rows point to the same diagnostic output. If different
-    diagnostic outputs are found, the match is considered unsafe.
+    Matching (exact row first, then a "Not applicable" percussion row used as
+    a wildcard for Normal/Sensitive answers, and rejection of conflicting
+    duplicates) is resolved ahead of time in OUTCOME_IDS by
+    DecisionMatrix.match(); analyze_spreadsheet.py reports the results.
     """
-    if result.empty:
-        return None
+    with trace_span("diagnosis.lookup") as span:
+        outcome = OUTCOME_IDS.get(key, -1)
+        span.set_attribute("found", outcome >= 0)
+        return outcome if outcome >= 0 else None
 
-    diagnosis_cols = [
-        "DIAGNOSIS (AAE NOMENCLATURE 2009/2013)",
-        "DIAGNOSIS (AAE/ESE NOMENCLATURE 2025)",
-        "COMPLEMENTARY DIAGNOSIS",
-    ]
 
-    available_cols = [col for col in diagnosis_cols if col in result.columns]
-    unique_outputs = result[available_cols].drop_duplicates()
+def run_diagnosis_from_session(session: dict, language: str = "en"):
+    """
+    Diagnose the session's answers. The returned texts come from `language`'s
+    sheet; session["diagnosis_result"] always keeps the primary-sheet texts.
+    """
+    key = session["answer_key"]
+    missing_fields = [field for field in FIELD_ORDER if not is_answered(key, field)]
+    if missing_fields:
+        # With adaptive questioning, skipped fields are fine once the decision tree fixes the outcome.
+        if not ADAPTIVE_QUESTIONING or not is_outcome_determined(key):
+            return {"ok": False, "type": "incomplete", "missing_fields": missing_fields}
+        outcome = determined_outcome(key)
+    else:
+        outcome = find_outcome(key)
+    if outcome is None:
+        return {"ok": False, "type": "not_found"}
 
-    if len(unique_outputs) > 1:
-        return None
+    session["diagnosis_result"] = dict(zip(DIAGNOSIS_COLUMNS, DIAGNOSIS_TEXTS["en"][outcome]))
+    return {"ok": True, **dict(zip(DIAGNOSIS_FIELDS, DIAGNOSIS_TEXTS[language][outcome]))}
 
-    return result.iloc[0]
 
+def localize_diagnosis(triple, language: str):
+    """Map a primary-sheet triple to `language`'s sheet when that mapping is unambiguous."""
+    localized = {
+        localized_triple
+        for primary_triple, localized_triple in zip(DIAGNOSIS_TEXTS["en"], DIAGNOSIS_TEXTS.get(language, ()))
+        if primary_triple == tuple(triple)
+    }
+    return localized.pop() if len(localized) == 1 else tuple(triple)
 
-def find_diagnosis_row(answers: dict):
-    temp_df = df.copy()
 
-    # First attempt: exact match, including percussion.
-    exact_conditions = (
-        (temp_df["__code_PAIN"] == answers.get("PAIN"))
-        & (temp_df["__code_ONSET"] == answers.get("ONSET"))
-        & (temp_df["__code_PULP VITALITY"] == answers.get("PULP VITALITY"))
-        & (temp_df["__code_PERCUSSION"] == answers.get("PERCUSSION"))
-        & (temp_df["__code_PALPATION"] == answers.get("PALPATION"))
-        & (temp_df["__code_RADIOGRAPHY"] == answers.get("RADIOGRAPHY"))
-    )
+def message_diagnosis_language(language: str) -> str:
+    # Offline there is no translation step, so chat messages read the localized sheet directly.
+    if OFFLINE_MODE and catalog_language(language) in DIAGNOSIS_TEXTS:
+        return catalog_language(language)
+    return "en"
 
-    exact_result = temp_df[exact_conditions]
-    exact_row = select_diagnosis_candidate(exact_result)
-    if exact_row is not None:
-        return exact_row
-
-    # Second attempt: controlled fallback for spreadsheet rows in which
-    # PERCUSSION is marked as "Not applicable".
-    #
-    # Rationale:
-    # - The chatbot still asks and stores percussion.
-    # - If the spreadsheet has an exact Normal/Sensitive row, that row is used.
-    # - If no exact row exists, but the equivalent row is registered as
-    #   "Not applicable", that row is used as a wildcard for percussion.
-    # - This avoids changing the clinical sequence and avoids changing the
-    #   spreadsheet engine, while preserving rows where percussion truly matters.
-    if answers.get("PERCUSSION") in {"percussion_normal", "percussion_sensitive"}:
-        fallback_conditions = (
-            (temp_df["__code_PAIN"] == answers.get("PAIN"))
-            & (temp_df["__code_ONSET"] == answers.get("ONSET"))
-            & (temp_df["__code_PULP VITALITY"] == answers.get("PULP VITALITY"))
-            & (temp_df["__code_PERCUSSION"] == "percussion_na")
-            & (temp_df["__code_PALPATION"] == answers.get("PALPATION"))
-            & (temp_df["__code_RADIOGRAPHY"] == answers.get("RADIOGRAPHY"))
-        )
 
-        fallback_result = temp_df[fallback_conditions]
-        fallback_row = select_diagnosis_candidate(fallback_result)
-        if fallback_row is not None:
-            return fallback_row
+def parse_projection(raw_language=None, raw_nomenclature=None):
+    """Validate the idioma/nomenclatura request parameters."""
+    language = normalize_text(raw_language or "") or "en"
+    language = {"english": "en", "portuguese": "pt"}.get(language, language)
+    if language not in DIAGNOSIS_TEXTS:
+        raise HTTPException(status_code=400, detail=f"idioma must be one of: {', '.join(DIAGNOSIS_TEXTS)}.")
+    nomenclature = (raw_nomenclature or "").strip().lower() or "aae_2009_2013"
+    if nomenclature not in NOMENCLATURES:
+        raise HTTPException(status_code=400, detail=f"nomenclatura must be one of: {', '.join(NOMENCLATURES)}.")
+    return language, nomenclature
 
-    return None
 
+def build_final_message(language: str, diagnosis_payload=None) -> str:
+    if not diagnosis_payload or not diagnosis_payload.get("ok"):
+        return translate_text(SCREENING_COMPLETED_TEXT, language)
 
-def run_diagnosis_from_session(session: dict):
-    missing_fields = [field for field in FIELD_ORDER if field not in session["answers"]]
-    if missing_fields:
-        return {"ok": False, "type": "incomplete", "missing_fields": missing_fields}
+    if OFFLINE_MODE:
+        return FINAL_MESSAGE_TEMPLATES[catalog_language(language)].format(**diagnosis_payload)
 
-    row = find_diagnosis_row(session["answers"])
-    if row is None:
-        return {"ok": False, "type": "not_found"}
+    text = f"""
+Screening completed.
 
-    col_2009 = "DIAGNOSIS (AAE NOMENCLATURE 2009/2013)"
-    col_2025 = "DIAGNOSIS (AAE/ESE NOMENCLATURE 2025)"
-    col_comp = "COMPLEMENTARY DIAGNOSIS"
+Diagnostic result:
+- Diagnosis (AAE nomenclature 2009/2013): {diagnosis_payload.get("diagnosis_aae_2009_2013", "")}
+- Diagnosis (AAE/ESE nomenclature 2025): {diagnosis_payload.get("diagnosis_aae_ese_2025", "")}
+- Complementary diagnosis: {diagnosis_payload.get("complementary_diagnosis", "")}
+""".strip()
+    return translate_text(text, language)
+
+
+def build_response_after_processing(session: dict, extracted: dict, primary_field: str, primary_code: str):
+    language = session["language"] or "English"
+
+    if session["stage"] == "completed":
+        diagnosis_payload = run_diagnosis_from_session(session, message_diagnosis_language(language))
+        final_message = build_final_message(language, diagnosis_payload if diagnosis_payload.get("ok") else None)
 
-    diagnosis_aae_2009_2013 = str(row[col_2009]).strip() if col_2009 in row.index else ""
-    diagnosis_aae_ese_2025 = str(row[col_2025]).strip() if col_2025 in row.index else ""
-    complementary_diagnosis = str(row[col_comp]).strip() if col_comp in row.index else ""
+        payload = {
+            "campo": primary_field,
+            "resposta_interpretada": label_for_code(primary_code, language),
+            "mensagem": final_message,
+            "captured_fields": format_captured_fields(extracted, language),
+        }
 
-    session["diagnosis_result"] = {
-        "DIAGNOSIS (AAE NOMENCLATURE 2009/2013)": diagnosis_aae_2009_2013,
-        "DIAGNOSIS (AAE/ESE NOMENCLATURE 2025)": diagnosis_aae_ese_2025,
-        "COMPLEMENTARY DIAGNOSIS": complementary_diagnosis,
+        if diagnosis_payload.get("ok"):
+            payload["diagnosis"] = diagnosis_payload
+        elif diagnosis_payload.get("type") == "not_found":
+            payload["mensagem"] += "\n\n" + build_inconsistent_message(language)
+
+        return cache_payload(session, payload)
+
+    next_index = session["current_question"]
+    next_question = build_question_text(next_index, language)
+    payload = {
+        "campo": primary_field,
+        "resposta_interpretada": label_for_code(primary_code, language),
+        "mensagem": next_question,
+        "pergunta": next_question,
+        "captured_fields": format_captured_fields(extracted, language),
     }
+    return cache_payload(session, payload)
 
-    return {
-        "ok": True,
-        "diagnosis_aae_2009_2013": diagnosis_aae_2009_2013,
-        "diagnosis_aae_ese_2025": diagnosis_aae_ese_2025,
-        "complementary_diagnosis": complementary_diagnosis,
+# =========================
+# EVENT LOG
+# =========================
+def apply_event(state: dict, event: dict):
+    """
+    Apply one logged event to a compact session state
+    ({session_id: {"l": language, "st": started, "a": answers, "h": history}}).
+    Used by EventLog.rebuild() for both snapshots and startup replay.
+    """
+    session_id = event["s"]
+    kind = event["k"]
+    if kind in ("reset", "expire"):
+        state.pop(session_id, None)
+        return
+    entry = state.setdefault(session_id, {"l": None, "st": False, "a": {}, "h": []})
+    if kind == "lang":
+        entry["l"] = event["l"]
+    elif kind == "start":
+        entry["st"] = True
+        if event.get("x"):
+            entry["h"].append(event["x"])
+    elif kind == "turn":
+        entry["st"] = True
+        if event.get("x") is not None:
+            entry["h"].append(event["x"])
+        if event.get("c"):
+            entry["a"][event["f"]] = event["c"]
+            if event["f"] == "PAIN" and event["c"] == "pain_absent":
+                entry["a"]["ONSET"] = "onset_na"
+    elif kind == "fix":
+        if event["f"] == "PAIN" and entry["a"].get("PAIN") == "pain_absent" and entry["a"].get("ONSET") == "onset_na":
+            entry["a"].pop("ONSET")
+        entry["a"][event["f"]] = event["c"]
+        if event["f"] == "PAIN" and event["c"] == "pain_absent":
+            entry["a"]["ONSET"] = "onset_na"
+
+
+def session_from_compact(entry: dict) -> dict:
+    session = empty_session()
+    session["language"] = entry["l"]
+    session["stage"] = "triage" if entry["st"] else "greeting"
+    session["answer_key"] = pack_answers(entry["a"])
+    session["history"] = [{"role": "user", "content": text} for text in entry["h"]]
+    sync_current_question(session)
+    if session["stage"] == "completed":
+        run_diagnosis_from_session(session)
+    return session
+
+
+class EventLog:
+    """
+    Append-only, segmented JSON-lines log of session events.
+
+    Events are queued by the request threads and written in batches by a
+    background thread. When the active segment exceeds `segment_bytes`, holds
+    `snapshot_events` events or is older than `snapshot_interval` seconds, a
+    new one is started and a snapshot is written, so a restart only replays
+    the tail after the newest snapshot. The replayed state is not kept in
+    memory (the session store holds the live sessions): a snapshot is built
+    from the previous one plus the segments since. Exactly one process may
+    write the log: segments and snapshots are not shared between writers, so
+    gunicorn.conf.py refuses EVENT_LOG_DIR with more than one worker.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int, flush_interval: float = 0.5,
+                 snapshot_events: int = 0, snapshot_interval: float = 0.0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.snapshot_events = snapshot_events
+        self.snapshot_interval = snapshot_interval
+        self.queue = queue.Queue()
+        self.segment = 0
+        self.events_written = 0
+        self.events_since_snapshot = 0
+        self.last_snapshot = time.monotonic()
+        self._pid = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def segment_path(self, number: int) -> Path:
+        return self.directory / f"events-{number:08d}.jsonl"
+
+    def snapshot_path(self, number: int) -> Path:
+        return self.directory / f"snapshot-{number:08d}.json"
+
+    def segment_numbers(self):
+        return sorted(int(p.stem.split("-")[1]) for p in self.directory.glob("events-*.jsonl"))
+
+    def rebuild(self, before: int = None) -> dict:
+        """Compact state from the newest snapshot plus the segments after it (up to, not including, `before`)."""
+        snapshots = sorted(self.directory.glob("snapshot-*.json"))
+        state = {}
+        start = 0
+        if snapshots:
+            data = safe_json_loads(snapshots[-1].read_text(encoding="utf-8")) or {}
+            state = data.get("sessions", {})
+            start = data.get("segment", 0)
+        for number in self.segment_numbers():
+            if number < start or (before is not None and number >= before):
+                continue
+            with open(self.segment_path(number), encoding="utf-8") as fh:
+                for line in fh:
+                    event = safe_json_loads(line)
+                    if event:  # a torn last line after a crash is skipped
+                        apply_event(state, event)
+        return state
+
+    def replay(self) -> dict:
+        """Rebuild the state at startup and continue writing after the newest segment."""
+        state = self.rebuild()
+        numbers = self.segment_numbers()
+        snapshots = sorted(self.directory.glob("snapshot-*.json"))
+        start = int(snapshots[-1].stem.split("-")[1]) if snapshots else 0
+        self.segment = max(numbers[-1] if numbers else 0, start)
+        return state
+
+    def append(self, event: dict):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._run, name="event-log", daemon=True).start()
+        self.queue.put(event)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._write_lock:
+            batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            path = self.segment_path(self.segment)
+            if batch:
+                with open(path, "a", encoding="utf-8") as fh:
+                    fh.write("".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in batch))
+                self.events_written += len(batch)
+                self.events_since_snapshot += len(batch)
+            if self.events_since_snapshot and self.snapshot_due(path):
+                self.rotate()
+
+    def snapshot_due(self, path: Path) -> bool:
+        return (
+            path.stat().st_size >= self.segment_bytes
+            or (self.snapshot_events > 0 and self.events_since_snapshot >= self.snapshot_events)
+            or (self.snapshot_interval > 0 and time.monotonic() - self.last_snapshot >= self.snapshot_interval)
+        )
+
+    def rotate(self):
+        """Start a new segment and snapshot the state of everything before it."""
+        self.segment += 1
+        state = self.rebuild(before=self.segment)
+        snapshot = self.snapshot_path(self.segment)
+        tmp = snapshot.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"segment": self.segment, "sessions": state}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, snapshot)
+        for old in sorted(self.directory.glob("snapshot-*.json"))[:-1]:
+            old.unlink(missing_ok=True)
+        self.events_since_snapshot = 0
+        self.last_snapshot = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "segment": self.segment,
+            "events_written": self.events_written,
+            "events_since_snapshot": self.events_since_snapshot,
+            "queued": self.queue.qsize(),
+        }
+
+
+EVENT_LOG = (
+    EventLog(
+        EVENT_LOG_DIR,
+        EVENT_LOG_SEGMENT_BYTES,
+        snapshot_events=EVENT_LOG_SNAPSHOT_EVENTS,
+        snapshot_interval=EVENT_LOG_SNAPSHOT_INTERVAL,
+    )
+    if EVENT_LOG_DIR
+    else None
+)
+if EVENT_LOG is not None:
+    atexit.register(EVENT_LOG.flush)
+
+
+def log_event(kind: str, session_id: str, **fields):
+    if EVENT_LOG is None:
+        return
+    event = {"k": kind, "s": session_id, "t": round(time.time(), 3)}
+    event.update({key: value for key, value in fields.items() if value is not None})
+    EVENT_LOG.append(event)
+
+
+def log_turn(session_id: str, field: str, text: str, code, matcher, started: float):
+    log_event(
+        "turn",
+        session_id,
+        f=field,
+        h=hashlib.sha1((text or "").encode("utf-8")).hexdigest()[:12],
+        x=text if EVENT_LOG_STORE_TEXT else None,
+        c=code,
+        m=matcher or "none",
+        ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+
+
+def restore_sessions_from_event_log():
+    if EVENT_LOG is None:
+        return 0
+    state = EVENT_LOG.replay()
+    # Shared stores already survive restarts; only the in-memory store is rebuilt.
+    if SESSION_STORE == "memory":
+        for session_id, entry in state.items():
+            sessions[session_id] = session_from_compact(entry)
+    return len(state)
+
+
+restore_sessions_from_event_log()
+
+# =========================
+# ANALYTICS
+# =========================
+def analytics_column(field: str) -> str:
+    return field.lower().replace(" ", "_")
+
+
+ANALYTICS_ANSWER_COLUMNS = [analytics_column(field) for field in FIELD_ORDER]
+# Explicit schema so that files whose columns happen to be all-null still line up.
+ANALYTICS_SCHEMA = pa.schema(
+    [
+        ("ts", pa.int64()),
+        ("session", pa.string()),
+        ("status", pa.string()),
+        ("language", pa.string()),
+        ("stopped_at", pa.string()),
+        ("diagnosis_aae_2009_2013", pa.string()),
+        ("diagnosis_aae_ese_2025", pa.string()),
+        ("complementary_diagnosis", pa.string()),
+        ("turns", pa.int32()),
+        ("llm_turns", pa.int32()),
+        ("reasks", pa.int32()),
+    ]
+    + [(column, pa.string()) for column in ANALYTICS_ANSWER_COLUMNS]
+) if pa is not None else None
+
+
+def screening_row(session_id: str, session: dict, status: str) -> dict:
+    now = time.time()
+    stats = session.get("stats", {})
+    diagnosis = session.get("diagnosis_result") or {}
+    row = {
+        "ts": int(now * 1000),
+        "day": time.strftime("%Y-%m-%d", time.gmtime(now)),
+        "session": hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:16],
+        "status": status,
+        "language": session.get("language") or "",
+        "stopped_at": None if status == "completed" else FIELD_ORDER[min(session["current_question"], len(FIELD_ORDER) - 1)],
+        "diagnosis_aae_2009_2013": diagnosis.get("DIAGNOSIS (AAE NOMENCLATURE 2009/2013)"),
+        "diagnosis_aae_ese_2025": diagnosis.get("DIAGNOSIS (AAE/ESE NOMENCLATURE 2025)"),
+        "complementary_diagnosis": diagnosis.get("COMPLEMENTARY DIAGNOSIS"),
+        "turns": stats.get("turns", 0),
+        "llm_turns": stats.get("llm_turns", 0),
+        "reasks": stats.get("reasks", 0),
     }
+    for field, column in zip(FIELD_ORDER, ANALYTICS_ANSWER_COLUMNS):
+        row[column] = answer_code(session["answer_key"], field)
+    return row
 
 
-def build_final_message(language: str, diagnosis_payload=None) -> str:
-    if not diagnosis_payload or not diagnosis_payload.get("ok"):
-        return translate_text("Screening completed. We can now calculate the diagnosis.", language)
+class ScreeningStore:
+    """
+    Buffers screening outcome rows and writes them as Parquet files under
+    ANALYTICS_DIR/day=YYYY-MM-DD/ (hive partitioning), so queries can prune
+    days and stream column batches instead of loading everything.
+    """
 
-    text = f"""
-Screening completed.
+    def __init__(self, directory: str, flush_rows: int, flush_seconds: float):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.rows_written = 0
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def add(self, row: dict):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._run, name="analytics-writer", daemon=True).start()
+        with self._lock:
+            self.buffer.append(row)
+            if len(self.buffer) >= self.flush_rows:
+                self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self.buffer = self.buffer, []
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(row["day"], []).append(row)
+        for day, day_rows in by_day.items():
+            table = pa.Table.from_pylist(day_rows, schema=ANALYTICS_SCHEMA)
+            partition = self.directory / f"day={day}"
+            partition.mkdir(parents=True, exist_ok=True)
+            name = f"part-{int(time.time() * 1000)}-{os.getpid()}-{os.urandom(3).hex()}.parquet"
+            pq.write_table(table, partition / name, compression="zstd")
+            self.rows_written += len(day_rows)
+
+
+SCREENING_STORE = (
+    ScreeningStore(ANALYTICS_DIR, ANALYTICS_FLUSH_ROWS, ANALYTICS_FLUSH_SECONDS)
+    if ANALYTICS_DIR and pa is not None else None
+)
+if SCREENING_STORE is not None:
+    atexit.register(SCREENING_STORE.flush)
 
-Diagnostic result:
-- Diagnosis (AAE nomenclature 2009/2013): {diagnosis_payload.get("diagnosis_aae_2009_2013", "")}
-- Diagnosis (AAE/ESE nomenclature 2025): {diagnosis_payload.get("diagnosis_aae_ese_2025", "")}
-- Complementary diagnosis: {diagnosis_payload.get("complementary_diagnosis", "")}
-""".strip()
-    return translate_text(text, language)
 
+def record_screening(session_id: str, session: dict, status: str):
+    """Write one outcome row per screening ("completed" or "abandoned")."""
+    if SCREENING_STORE is None or session.get("recorded"):
+        return
+    session["recorded"] = True
+    SCREENING_STORE.add(screening_row(session_id, session, status))
 
-def build_response_after_processing(session: dict, extracted: dict, primary_field: str, primary_code: str):
-    language = session["language"] or "English"
 
-    if session["stage"] == "completed":
-        diagnosis_payload = run_diagnosis_from_session(session)
-        final_message = build_final_message(language, diagnosis_payload if diagnosis_payload.get("ok") else None)
+def merge_counts(total: dict, counts):
+    for item in counts.to_pylist():
+        value = item["values"]
+        if value is not None:
+            total[value] = total.get(value, 0) + item["counts"]
 
-        payload = {
-            "campo": primary_field,
-            "resposta_interpretada": label_for_code(primary_code, language),
-            "mensagem": final_message,
-            "captured_fields": format_captured_fields(extracted, language),
-        }
 
-        if diagnosis_payload.get("ok"):
-            payload["diagnosis"] = diagnosis_payload
-        elif diagnosis_payload.get("type") == "not_found":
-            payload["mensagem"] += "\n\n" + build_inconsistent_message(language)
+def query_screenings(start: str = None, end: str = None) -> dict:
+    """
+    Aggregate screening outcomes between two days (inclusive). The dataset is
+    scanned batch by batch with only the needed columns, so memory use does
+    not grow with the number of stored screenings.
+    """
+    dataset = ds.dataset(
+        str(SCREENING_STORE.directory),
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive"),
+        schema=ANALYTICS_SCHEMA.append(pa.field("day", pa.string())),
+    )
+    condition = None
+    if start:
+        condition = ds.field("day") >= start
+    if end:
+        upper = ds.field("day") <= end
+        condition = upper if condition is None else condition & upper
+
+    columns = ["status", "stopped_at", "diagnosis_aae_2009_2013", "diagnosis_aae_ese_2025",
+               "turns", "llm_turns", "reasks"] + ANALYTICS_ANSWER_COLUMNS
+    totals = {"completed": 0, "abandoned": 0, "turns": 0, "llm_turns": 0, "reasks": 0}
+    diagnoses_2009, diagnoses_2025, abandonment = {}, {}, {}
+    answers = {column: {} for column in ANALYTICS_ANSWER_COLUMNS}
+
+    for batch in dataset.to_batches(columns=columns, filter=condition):
+        completed = pc.equal(batch.column("status"), "completed")
+        totals["completed"] += pc.sum(completed).as_py() or 0
+        totals["abandoned"] += batch.num_rows - (pc.sum(completed).as_py() or 0)
+        for name in ("turns", "llm_turns", "reasks"):
+            totals[name] += pc.sum(batch.column(name)).as_py() or 0
+        merge_counts(diagnoses_2009, pc.value_counts(pc.filter(batch.column("diagnosis_aae_2009_2013"), completed)))
+        merge_counts(diagnoses_2025, pc.value_counts(pc.filter(batch.column("diagnosis_aae_ese_2025"), completed)))
+        merge_counts(abandonment, pc.value_counts(pc.filter(batch.column("stopped_at"), pc.invert(completed))))
+        for column in ANALYTICS_ANSWER_COLUMNS:
+            merge_counts(answers[column], pc.value_counts(batch.column(column)))
+
+    screenings = totals["completed"] + totals["abandoned"]
+    return {
+        "screenings": screenings,
+        "completed": totals["completed"],
+        "abandoned": totals["abandoned"],
+        "diagnosis_distribution": {
+            "aae_2009_2013": dict(sorted(diagnoses_2009.items(), key=lambda kv: -kv[1])),
+            "aae_ese_2025": dict(sorted(diagnoses_2025.items(), key=lambda kv: -kv[1])),
+        },
+        "answer_distribution": {
+            field: answers[column] for field, column in zip(FIELD_ORDER, ANALYTICS_ANSWER_COLUMNS)
+        },
+        "llm_fallback_rate": round(totals["llm_turns"] / totals["turns"], 4) if totals["turns"] else 0.0,
+        "reask_rate": round(totals["reasks"] / totals["turns"], 4) if totals["turns"] else 0.0,
+        "abandonment_by_question": abandonment,
+    }
 
-        return cache_payload(session, payload)
 
-    next_index = session["current_question"]
-    next_question = build_question_text(next_index, language)
-    payload = {
-        "campo": primary_field,
-        "resposta_interpretada": label_for_code(primary_code, language),
-        "mensagem": next_question,
-        "pergunta": next_question,
-        "captured_fields": format_captured_fields(extracted, language),
-    }
-    return cache_payload(session, payload)
+@app.get("/analytics")
+def analytics(start: str = None, end: str = None):
+    if SCREENING_STORE is None:
+        return JSONResponse(
+            status_code=503,
+            content={"mensagem": "Analytics is disabled. Set ANALYTICS_DIR and install pyarrow."},
+        )
+    for value in (start, end):
+        if value and not re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+            raise HTTPException(status_code=400, detail="Dates must use the YYYY-MM-DD format.")
+    SCREENING_STORE.flush()
+    return query_screenings(start, end)
 
 # =========================
 # ROOT / HEALTH
 # =========================
 @app.get("/", response_class=HTMLResponse)
-async def root():
-    index_file = STATIC_DIR / "index.html"
-    if index_file.exists():
-        return index_file.read_text(encoding="utf-8")
+async def root(request: Request):
+    asset = get_static_asset("index.html")
+    if asset is not None:
+        return static_response(request, asset, REVALIDATE_CACHE_CONTROL)
     return """
     <html>
         <body>
@@ -1032,15 +3672,59 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    return {"status": "ok", "offline": OFFLINE_MODE}
+
+
+def process_rss_kb():
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@app.get("/stats")
+def stats():
+    return {
+        "knowledge_base_version": KNOWLEDGE_BASE_VERSION,
+        "offline": OFFLINE_MODE,
+        "pid": os.getpid(),
+        "process_rss_kb": process_rss_kb(),
+        "sessions": len(sessions),
+        "session_gc": SESSION_SWEEPER.stats(),
+        "jobs": JOB_QUEUE.stats(),
+        "caches": {
+            "canonicalization": CANONICAL_CACHE.stats(),
+            "llm_extraction": LLM_EXTRACTION_CACHE.stats(),
+            "translation": TRANSLATION_CACHE.stats(),
+            "explanation": EXPLANATION_CACHE.stats(),
+        },
+        "explanation_corpus": EXPLANATION_CORPUS.stats() if EXPLANATION_CORPUS else None,
+        "upstream": {model: breaker.stats() for model, breaker in LLM_BREAKERS.items()},
+        "coalescing": LLM_SINGLE_FLIGHT.stats(),
+        "extraction_prompts": extraction_prompt_stats(),
+        "limits": {
+            "rate_limit_per_minute": RATE_LIMIT_PER_MINUTE or None,
+            "rate_limit_burst": RATE_LIMIT_BURST,
+            **LIMIT_STATS,
+            "llm_budget": llm_budget_status(CURRENT_TENANT.get() or "anonymous"),
+        },
+        "event_log": EVENT_LOG.stats() if EVENT_LOG is not None else None,
+    }
 
 # =========================
 # PERGUNTAR
 # =========================
+# Endpoints that may call OpenAI are plain `def`: FastAPI runs them in its
+# threadpool, so a slow upstream call does not block the event loop and
+# identical concurrent calls can be coalesced by safe_chat_completion.
 @app.post("/perguntar/")
-async def perguntar(indice: int = Form(...), session_id: str = Form(...)):
-    create_session_if_needed(session_id)
-    session = sessions[session_id]
+def perguntar(indice: int = Form(...), session_id: str = Form(...)):
+    with locked_session(session_id) as session:
+        return current_prompt(session)
+
+
+def current_prompt(session: dict):
     language = session["language"] or "English"
 
     if session["stage"] == "greeting":
@@ -1053,7 +3737,7 @@ async def perguntar(indice: int = Form(...), session_id: str = Form(...)):
     sync_current_question(session)
 
     if session["stage"] == "completed":
-        diagnosis_payload = run_diagnosis_from_session(session)
+        diagnosis_payload = run_diagnosis_from_session(session, message_diagnosis_language(language))
         payload = {"mensagem": build_final_message(language, diagnosis_payload if diagnosis_payload.get("ok") else None)}
         if diagnosis_payload.get("ok"):
             payload["diagnosis"] = diagnosis_payload
@@ -1068,13 +3752,55 @@ async def perguntar(indice: int = Form(...), session_id: str = Form(...)):
 # RESPONDER
 # =========================
 @app.post("/responder/")
-async def responder(indice: int = Form(...), resposta_usuario: str = Form(...), session_id: str = Form(...)):
-    create_session_if_needed(session_id)
-    session = sessions[session_id]
-    user_text = (resposta_usuario or "").strip()
+def responder(
+    request: Request,
+    indice: int = Form(...),
+    resposta_usuario: str = Form(...),
+    session_id: str = Form(...),
+    incluir: str = Form(None),
+):
+    """
+    `incluir` (opt-in) extends the final turn so no follow-up calls are needed:
+    "diagnostico" adds the /diagnostico/ payload, "explicacao" also adds the
+    explanation text, "stream" adds a URL streaming the explanation instead.
+    """
+    turn_started = time.perf_counter()
+    include = parse_include(incluir)
+    enforce_rate_limit(request, session_id)
+    with locked_session(session_id) as session:
+        payload = process_answer(session_id, session, resposta_usuario, turn_started)
+        return include_final_extras(session_id, session, payload, include)
+
+
+def parse_include(raw_include):
+    include = (raw_include or "").strip().lower() or None
+    if include not in (None, "diagnostico", "explicacao", "stream"):
+        raise HTTPException(status_code=400, detail="incluir must be one of: diagnostico, explicacao, stream.")
+    return include
+
+
+def include_final_extras(session_id: str, session: dict, payload: dict, include: str = None):
+    if not include or "diagnosis" not in payload:
+        return payload
+    payload = {**payload, "resultado": format_diagnosis_response(session, payload["diagnosis"])}
+    if include == "explicacao":
+        try:
+            payload["explicacao"] = generate_explanation(session["language"] or "English", *stored_diagnosis(session))
+        except Exception as e:
+            payload["explicacao_erro"] = f"Error generating explanation: {str(e)}"
+    elif include == "stream":
+        payload["explicacao_stream"] = f"/explicacao/stream/{session_id}"
+    return payload
+
+
+def process_answer(session_id: str, session: dict, user_text: str, turn_started: float):
+    """One triage turn on a bound session; shared by /responder/ and the WebSocket channel."""
+    user_text = (user_text or "").strip()
 
     if not session["language"]:
         session["language"] = detect_language(user_text)
+        log_event("lang", session_id, l=session["language"])
+        warm_language(session["language"])
     language = session["language"]
 
     if user_text:
@@ -1083,6 +3809,7 @@ async def responder(indice: int = Form(...), resposta_usuario: str = Form(...),
     if session["stage"] == "greeting":
         session["stage"] = "triage"
         session["current_question"] = 0
+        log_event("start", session_id, x=user_text if EVENT_LOG_STORE_TEXT else None)
 
         if is_greeting(user_text):
             intro_first = build_intro_and_first_question(language)
@@ -1097,7 +3824,7 @@ async def responder(indice: int = Form(...), resposta_usuario: str = Form(...),
     sync_current_question(session)
 
     if session["stage"] == "completed":
-        diagnosis_payload = run_diagnosis_from_session(session)
+        diagnosis_payload = run_diagnosis_from_session(session, message_diagnosis_language(language))
         final_message = build_final_message(language, diagnosis_payload if diagnosis_payload.get("ok") else None)
         payload = {
             "campo": "__FLOW__",
@@ -1114,14 +3841,22 @@ async def responder(indice: int = Form(...), resposta_usuario: str = Form(...),
     current_field = QUESTION_DEFS[current_index]["field"]
 
     extracted = extract_answers_fallback(user_text, session)
+    matcher = canonicalize_value_with_stage(current_field, user_text)[1] if extracted else None
     if not extracted:
         extracted = extract_answers_with_llm(user_text, session)
+        matcher = "llm" if extracted else None
 
     # Security lock: accept only the current field, plus automatic ONSET = not applicable when PAIN is absent.
     allowed_fields = {current_field}
     if current_field == "PAIN" and extracted.get("PAIN") == "pain_absent":
         allowed_fields.add("ONSET")
     extracted = {field: code for field, code in extracted.items() if field in allowed_fields}
+    log_turn(session_id, current_field, user_text, extracted.get(current_field), matcher, turn_started)
+
+    turn_stats = session.setdefault("stats", {"turns": 0, "llm_turns": 0, "reasks": 0})
+    turn_stats["turns"] += 1
+    turn_stats["llm_turns"] += matcher == "llm"
+    turn_stats["reasks"] += current_field not in extracted
 
     if current_field not in extracted:
         invalid = build_invalid_answer_message(current_index, language)
@@ -1135,46 +3870,283 @@ async def responder(indice: int = Form(...), resposta_usuario: str = Form(...),
 
     merge_extracted_answers(session, extracted)
     primary_code = extracted[current_field]
-    return build_response_after_processing(session, extracted, current_field, primary_code)
+    payload = build_response_after_processing(session, extracted, current_field, primary_code)
+    if session["stage"] == "completed":
+        record_screening(session_id, session, "completed")
+    return payload
 
 # =========================
-# CONFIRMAR
+# TRIAGEM (STATELESS)
 # =========================
-@app.post("/confirmar/")
-async def confirmar(indice: int = Form(...), resposta_interpretada: str = Form(...), session_id: str = Form(...)):
-    create_session_if_needed(session_id)
-    session = sessions[session_id]
+def sign_state(state: dict) -> str:
+    body = json.dumps(state, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    encoded = base64.urlsafe_b64encode(body).decode("ascii").rstrip("=")
+    signature = hmac.new(STATE_TOKEN_SECRET.encode("utf-8"), encoded.encode("ascii"), hashlib.sha256).hexdigest()
+    return f"{encoded}.{signature}"
+
+
+def verify_state_token(token: str):
+    if not STATE_TOKEN_SECRET:
+        raise HTTPException(status_code=400, detail="State tokens are not enabled on this server.")
+    encoded, _, signature = (token or "").partition(".")
+    expected = hmac.new(STATE_TOKEN_SECRET.encode("utf-8"), encoded.encode("ascii"), hashlib.sha256).hexdigest()
+    if not signature or not hmac.compare_digest(signature, expected):
+        raise HTTPException(status_code=401, detail="Invalid state token.")
+    padded = encoded + "=" * (-len(encoded) % 4)
+    state = safe_json_loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    if not isinstance(state, dict):
+        raise HTTPException(status_code=401, detail="Invalid state token.")
+    return state
+
+
+def parse_client_answers(raw_answers) -> dict:
+    """
+    Validate answers sent by the client. Only known fields with one of their
+    canonical codes are accepted.
+    """
+    if not raw_answers:
+        return {}
+    answers = safe_json_loads(raw_answers) if isinstance(raw_answers, str) else raw_answers
+    if not isinstance(answers, dict):
+        raise HTTPException(status_code=400, detail="answers must be a JSON object of canonical codes.")
+    for field, code in answers.items():
+        if field not in FIELD_TO_CODES or code not in FIELD_TO_CODES[field]:
+            raise HTTPException(status_code=400, detail=f"Invalid answer for field '{field}': {code}")
+    return dict(answers)
+
+
+def stateless_session(answers: dict, language: str) -> dict:
+    session = empty_session()
+    session["language"] = language
+    session["stage"] = "triage"
+    session["answer_key"] = pack_answers(answers)
+    sync_current_question(session)
+    return session
 
-    # Compatibility with the old frontend: returns the last payload already processed.
-    if session.get("last_bot_payload"):
-        return session["last_bot_payload"]
 
-    language = session["language"] or "English"
-    sync_current_question(session)
+def with_state(session: dict, payload: dict) -> dict:
+    payload = dict(payload)
+    payload["answers"] = unpack_answers(session["answer_key"])
+    payload["language"] = session["language"]
+    payload["completed"] = session["stage"] == "completed"
+    if STATE_TOKEN_SECRET:
+        payload["state_token"] = sign_state({"answers": payload["answers"], "language": session["language"]})
+    return payload
+
+
+@app.post("/triagem/")
+def triagem(
+    request: Request,
+    resposta_usuario: str = Form(""),
+    answers: str = Form(None),
+    language: str = Form(None),
+    state_token: str = Form(None),
+):
+    """
+    Stateless variant of /responder/. The client sends the current canonical
+    answers (or the signed state_token returned by the previous turn) plus the
+    new reply; nothing is stored on the server, so any replica can serve any turn.
+    With STATE_TOKEN_SECRET set, prior answers are only accepted as a state_token.
+    """
+    enforce_rate_limit(request)
+    user_text = (resposta_usuario or "").strip()
+
+    if state_token:
+        state = verify_state_token(state_token)
+        current_answers = parse_client_answers(state.get("answers"))
+        language = language or state.get("language")
+    elif STATE_TOKEN_SECRET and answers and parse_client_answers(answers):
+        raise HTTPException(
+            status_code=401,
+            detail="Unsigned answers are not accepted; send the state_token returned by the previous turn.",
+        )
+    else:
+        current_answers = parse_client_answers(answers)
+
+    if not language:
+        language = detect_language(user_text)
+        warm_language(language)
+
+    session = stateless_session(current_answers, language)
+
+    if not current_answers and (not user_text or is_greeting(user_text)):
+        intro_first = build_intro_and_first_question(language)
+        return with_state(session, {
+            "campo": "__FLOW__",
+            "resposta_interpretada": "START_SCREENING",
+            "mensagem": intro_first,
+            "pergunta": intro_first,
+        })
 
     if session["stage"] == "completed":
-        diagnosis_payload = run_diagnosis_from_session(session)
-        payload = {"mensagem": build_final_message(language, diagnosis_payload if diagnosis_payload.get("ok") else None)}
+        diagnosis_payload = run_diagnosis_from_session(session, message_diagnosis_language(language))
+        payload = {
+            "campo": "__FLOW__",
+            "resposta_interpretada": "READY_FOR_DIAGNOSIS",
+            "mensagem": build_final_message(language, diagnosis_payload if diagnosis_payload.get("ok") else None),
+        }
         if diagnosis_payload.get("ok"):
             payload["diagnosis"] = diagnosis_payload
-        return cache_payload(session, payload)
+        elif diagnosis_payload.get("type") == "not_found":
+            payload["mensagem"] += "\n\n" + build_inconsistent_message(language)
+        return with_state(session, payload)
 
     current_index = session["current_question"]
-    texto = build_question_text(current_index, language)
-    payload = {"mensagem": texto, "pergunta": texto}
+    current_field = QUESTION_DEFS[current_index]["field"]
+
+    extracted = extract_answers_fallback(user_text, session)
+    if not extracted:
+        extracted = extract_answers_with_llm(user_text, session)
+
+    allowed_fields = {current_field}
+    if current_field == "PAIN" and extracted.get("PAIN") == "pain_absent":
+        allowed_fields.add("ONSET")
+    extracted = {field: code for field, code in extracted.items() if field in allowed_fields}
+
+    if current_field not in extracted:
+        invalid = build_invalid_answer_message(current_index, language)
+        return with_state(session, {
+            "campo": "__FLOW__",
+            "resposta_interpretada": "REASK_CURRENT",
+            "mensagem": invalid,
+            "pergunta": invalid,
+        })
+
+    merge_extracted_answers(session, extracted)
+    payload = build_response_after_processing(session, extracted, current_field, extracted[current_field])
+    return with_state(session, payload)
+
+# =========================
+# CONFIRMAR
+# =========================
+@app.post("/confirmar/")
+def confirmar(indice: int = Form(...), resposta_interpretada: str = Form(...), session_id: str = Form(...)):
+    with locked_session(session_id, create=False) as stored:
+        session = stored if stored is not None else empty_session()
+        # Compatibility with the old frontend: returns the last payload already processed.
+        if session.get("last_bot_payload"):
+            return session["last_bot_payload"]
+
+        language = session["language"] or "English"
+        sync_current_question(session)
+
+        if session["stage"] == "completed":
+            diagnosis_payload = run_diagnosis_from_session(session, message_diagnosis_language(language))
+            payload = {"mensagem": build_final_message(language, diagnosis_payload if diagnosis_payload.get("ok") else None)}
+            if diagnosis_payload.get("ok"):
+                payload["diagnosis"] = diagnosis_payload
+            return cache_payload(session, payload)
+
+        current_index = session["current_question"]
+        texto = build_question_text(current_index, language)
+        payload = {"mensagem": texto, "pergunta": texto}
+        return cache_payload(session, payload)
+
+# =========================
+# CORRIGIR
+# =========================
+@app.post("/corrigir/")
+def corrigir(
+    request: Request,
+    session_id: str = Form(...),
+    campo: str = Form(...),
+    resposta_usuario: str = Form(None),
+    codigo: str = Form(None),
+):
+    """
+    Change the answer of one field (`campo`, e.g. "PAIN") without redoing the
+    screening. The new answer is a canonical `codigo` or free text matched for
+    that field like a triage turn. Returns the updated diagnosis, or the next
+    question when the change makes another field relevant again.
+    """
+    enforce_rate_limit(request, session_id)
+    with locked_session(session_id, create=False) as session:
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found.")
+        return process_correction(session_id, session, campo, resposta_usuario, codigo)
+
+
+def process_correction(session_id: str, session: dict, field: str, user_text: str = None, code: str = None):
+    """Correct one answer on a bound session; shared by /corrigir/ and the WebSocket channel."""
+    turn_started = time.perf_counter()
+    language = session["language"] or "English"
+    if field not in FIELD_POS:
+        raise HTTPException(status_code=400, detail=f"campo must be one of {FIELD_ORDER}.")
+
+    matcher = "code"
+    if code:
+        if code not in FIELD_TO_CODES[field]:
+            raise HTTPException(status_code=400, detail=f"Invalid answer for field '{field}': {code}")
+    else:
+        code, matcher = canonicalize_value_with_stage(field, user_text or "")
+        if code is None and (user_text or "").strip():
+            code = extract_field_with_llm(user_text, field).get(field)
+            matcher = "llm" if code else None
+    if code is None:
+        raise HTTPException(status_code=400, detail=build_invalid_answer_message(FIELD_POS[field], language))
+    if field == "ONSET" and code != "onset_na" and answer_code(session["answer_key"], "PAIN") == "pain_absent":
+        raise HTTPException(status_code=400, detail="Pain is absent, so its onset does not apply. Correct PAIN first.")
+
+    turn_stats = session.setdefault("stats", {"turns": 0, "llm_turns": 0, "reasks": 0})
+    turn_stats["turns"] += 1
+    turn_stats["llm_turns"] += matcher == "llm"
+
+    previous_key = session["answer_key"]
+    apply_correction(session, field, code)
+    log_event("fix", session_id, f=field, c=code, m=matcher, ms=round((time.perf_counter() - turn_started) * 1000, 1))
+    changed = {
+        name: answer_code(session["answer_key"], name)
+        for name in FIELD_ORDER
+        if answer_id(session["answer_key"], name) != answer_id(previous_key, name) or name == field
+    }
+    payload = build_response_after_processing(session, {name: c for name, c in changed.items() if c}, field, code)
+    payload = {**payload, "answers": unpack_answers(session["answer_key"])}
+    if session["stage"] == "completed":
+        record_screening(session_id, session, "completed")
     return cache_payload(session, payload)
 
+
+def apply_correction(session: dict, field: str, code: str):
+    """
+    Replace one answer and re-derive only what depends on it. ONSET follows
+    PAIN: it is set to "not applicable" when pain becomes absent and cleared
+    again (to be asked) when pain becomes present. The outcome is then looked
+    up again from the packed key; a stale diagnosis is dropped while the
+    screening is incomplete.
+    """
+    key = session["answer_key"]
+    if field == "PAIN" and answer_code(key, "PAIN") == "pain_absent" and code != "pain_absent":
+        if answer_code(key, "ONSET") == "onset_na":
+            key = clear_answer(key, "ONSET")
+    session["answer_key"] = set_answer(key, field, code)
+    if session["stage"] == "greeting":
+        session["stage"] = "triage"
+    sync_current_question(session)
+    if session["stage"] != "completed":
+        session["diagnosis_result"] = {}
+
 # =========================
 # DIAGNOSTICO
 # =========================
 @app.post("/diagnostico/")
-async def diagnostico(session_id: str = Form(...)):
-    create_session_if_needed(session_id)
-    session = sessions[session_id]
-    language = session["language"] or "English"
+def diagnostico(session_id: str = Form(...), idioma: str = Form(None), nomenclatura: str = Form(None)):
+    """
+    `idioma` selects the diagnosis sheet the texts come from (en, pt) and
+    `nomenclatura` the one reported as "diagnostico" (aae_2009_2013, aae_ese_2025).
+    """
+    diagnosis_language, nomenclature = parse_projection(idioma, nomenclatura)
+    with locked_session(session_id, create=False) as stored:
+        session = stored if stored is not None else empty_session()
+        return diagnosis_response(session, diagnosis_language, nomenclature)
+
 
+def diagnosis_response(session: dict, diagnosis_language: str = "en", nomenclature: str = "aae_2009_2013"):
     sync_current_question(session)
-    diagnosis_payload = run_diagnosis_from_session(session)
+    return format_diagnosis_response(session, run_diagnosis_from_session(session, diagnosis_language), nomenclature)
+
+
+def format_diagnosis_response(session: dict, diagnosis_payload: dict, nomenclature: str = "aae_2009_2013"):
+    language = session["language"] or "English"
 
     if not diagnosis_payload.get("ok"):
         if diagnosis_payload.get("type") == "incomplete":
@@ -1190,19 +4162,40 @@ async def diagnostico(session_id: str = Form(...)):
         "diagnosis_aae_2009_2013": diagnosis_payload["diagnosis_aae_2009_2013"],
         "diagnosis_aae_ese_2025": diagnosis_payload["diagnosis_aae_ese_2025"],
         "complementary_diagnosis": diagnosis_payload["complementary_diagnosis"],
-        "diagnostico": diagnosis_payload["diagnosis_aae_2009_2013"],
+        "diagnostico": diagnosis_payload[DIAGNOSIS_FIELDS[NOMENCLATURES[nomenclature]]],
         "diagnostico_complementar": diagnosis_payload["complementary_diagnosis"],
         "answers_interpreted": {
-            field: label_for_code(session["answers"].get(field), language)
+            field: label_for_answer(session["answer_key"], field, language)
             for field in FIELD_ORDER
         },
     }
 
+# =========================
+# CANDIDATOS
+# =========================
+@app.post("/candidatos/")
+def candidatos(session_id: str = Form(None), answers: str = Form(None), idioma: str = Form(None)):
+    """
+    Diagnoses still possible for the current answers, and which unanswered
+    fields can still change the result. Accepts a session or explicit answers.
+    """
+    diagnosis_language, _ = parse_projection(idioma)
+    if session_id:
+        session = find_session(session_id)
+        key = session["answer_key"] if session else 0
+    else:
+        key = pack_answers(parse_client_answers(answers))
+    probe = {"answer_key": key}
+    apply_business_rules(probe)
+    key = probe["answer_key"]
+    return {"answers": unpack_answers(key), **describe_candidates(key, diagnosis_language)}
+
 # =========================
 # EXPLICACAO
 # =========================
 @app.post("/explicacao/")
-async def explicacao(
+def explicacao(
+    request: Request,
     session_id: str = Form(...),
     diagnosis_aae_2009_2013: str = Form(None),
     diagnosis_aae_ese_2025: str = Form(None),
@@ -1210,8 +4203,8 @@ async def explicacao(
     diagnostico: str = Form(None),
     diagnostico_complementar: str = Form(None),
 ):
-    create_session_if_needed(session_id)
-    session = sessions[session_id]
+    enforce_rate_limit(request, session_id)
+    session = find_session(session_id) or empty_session()
     language = session["language"] or "English"
     stored = session.get("diagnosis_result", {})
 
@@ -1225,6 +4218,168 @@ async def explicacao(
             content={"mensagem": "No diagnosis is available yet. Run /diagnostico/ first."},
         )
 
+    try:
+        explanation_text = generate_explanation(language, diag_2009, diag_2025, comp_diag)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"mensagem": f"Error generating explanation: {str(e)}"})
+
+    return JSONResponse(content={"explicacao": explanation_text})
+
+
+def stored_diagnosis(session: dict):
+    stored = session.get("diagnosis_result", {})
+    return (
+        stored.get("DIAGNOSIS (AAE NOMENCLATURE 2009/2013)") or "",
+        stored.get("DIAGNOSIS (AAE/ESE NOMENCLATURE 2025)") or "",
+        stored.get("COMPLEMENTARY DIAGNOSIS") or "",
+    )
+
+
+def generate_explanation(language: str, diag_2009: str, diag_2025: str, comp_diag: str) -> str:
+    """
+    Explanation text for a diagnosis: the pre-generated corpus first, then the
+    per-language cache, then the upstream model. Falls back to the offline
+    template once the tenant's LLM budget is spent or the upstream is
+    unavailable (breaker open, retries exhausted).
+    """
+    if EXPLANATION_CORPUS is not None:
+        pregenerated = EXPLANATION_CORPUS.get(language, diag_2009, diag_2025, comp_diag)
+        if pregenerated is not None:
+            return pregenerated
+    if OFFLINE_MODE:
+        return offline_explanation(language, diag_2009, diag_2025, comp_diag)
+
+    cache_key = (language, diag_2009, diag_2025, comp_diag)
+    cached = EXPLANATION_CACHE.get(cache_key, KNOWLEDGE_BASE_VERSION)
+    if cached is not CACHE_MISS:
+        return cached
+
+    try:
+        response = safe_chat_completion(
+            messages=build_explanation_messages(language, diag_2009, diag_2025, comp_diag),
+            model=MODEL_EXPLAIN,
+            temperature=0.2,
+        )
+    except Exception as exc:
+        if isinstance(exc, UpstreamUnavailable) or is_retryable_error(exc):
+            return offline_explanation(language, diag_2009, diag_2025, comp_diag)
+        raise
+    explanation_text = (response.choices[0].message.content or "").strip()
+    if explanation_text:
+        EXPLANATION_CACHE.set(cache_key, explanation_text, KNOWLEDGE_BASE_VERSION)
+    return explanation_text
+
+
+def offline_explanation(language: str, diag_2009: str, diag_2025: str, comp_diag: str) -> str:
+    lang = catalog_language(language)
+    diag_2009, diag_2025, comp_diag = localize_diagnosis((diag_2009, diag_2025, comp_diag), lang)
+    return OFFLINE_EXPLANATION_TEMPLATES[lang].format(
+        diagnosis_aae_2009_2013=diag_2009 or "-",
+        diagnosis_aae_ese_2025=diag_2025 or "-",
+        complementary_diagnosis=comp_diag or "-",
+    )
+
+
+async def iter_explanation(language: str, diag_2009: str, diag_2025: str, comp_diag: str):
+    """
+    Async iterator over explanation tokens. A cached explanation is yielded in
+    one piece; otherwise tokens are relayed from a worker thread as the
+    upstream streams them, and the full text is cached at the end. If the
+    upstream fails before the first token, the offline template is yielded.
+    """
+    if EXPLANATION_CORPUS is not None:
+        pregenerated = EXPLANATION_CORPUS.get(language, diag_2009, diag_2025, comp_diag)
+        if pregenerated is not None:
+            yield pregenerated
+            return
+    if OFFLINE_MODE:
+        yield offline_explanation(language, diag_2009, diag_2025, comp_diag)
+        return
+
+    cache_key = (language, diag_2009, diag_2025, comp_diag)
+    cached = EXPLANATION_CACHE.get(cache_key, KNOWLEDGE_BASE_VERSION)
+    if cached is not CACHE_MISS:
+        yield cached
+        return
+    try:
+        # The budget lives in the session store, which may be SQLite: keep it off the event loop.
+        await run_in_threadpool(check_llm_budget)
+    except LLMBudgetExceeded:
+        yield offline_explanation(language, diag_2009, diag_2025, comp_diag)
+        return
+
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
+    stop = threading.Event()
+
+    def produce():
+        stream = stream_chat_completion(
+            build_explanation_messages(language, diag_2009, diag_2025, comp_diag),
+            model=MODEL_EXPLAIN,
+            temperature=0.2,
+        )
+        try:
+            for delta in stream:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(tokens.put_nowait, delta)
+        except Exception as exc:
+            loop.call_soon_threadsafe(tokens.put_nowait, exc)
+        finally:
+            stream.close()
+            loop.call_soon_threadsafe(tokens.put_nowait, None)
+
+    producer = asyncio.ensure_future(run_in_threadpool(produce))
+    parts = []
+    try:
+        while True:
+            item = await tokens.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                if not parts and (isinstance(item, UpstreamUnavailable) or is_retryable_error(item)):
+                    yield offline_explanation(language, diag_2009, diag_2025, comp_diag)
+                    return
+                raise item
+            parts.append(item)
+            yield item
+    finally:
+        # Stop the upstream stream if the consumer went away mid-explanation.
+        stop.set()
+        await producer
+
+    explanation_text = "".join(parts).strip()
+    if explanation_text:
+        EXPLANATION_CACHE.set(cache_key, explanation_text, KNOWLEDGE_BASE_VERSION)
+
+
+@app.get("/explicacao/stream/{session_id}")
+async def explicacao_stream(request: Request, session_id: str):
+    """Server-sent events with the explanation of the session's stored diagnosis."""
+    await run_in_threadpool(enforce_rate_limit, request, session_id)
+    session = await run_in_threadpool(find_session, session_id)
+    diagnosis = stored_diagnosis(session) if session else ("", "", "")
+    if not any(diagnosis):
+        return JSONResponse(
+            status_code=400,
+            content={"mensagem": "No diagnosis is available yet. Run /diagnostico/ first."},
+        )
+    language = session["language"] or "English"
+
+    async def events():
+        try:
+            async with aclosing(iter_explanation(language, *diagnosis)) as tokens:
+                async for token in tokens:
+                    yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            message = json.dumps({"mensagem": f"Error generating explanation: {str(e)}"}, ensure_ascii=False)
+            yield f"event: error\ndata: {message}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def build_explanation_messages(language: str, diag_2009: str, diag_2025: str, comp_diag: str):
     prompt = f"""
 Explain clearly to a dentist the following endodontic diagnostic result.
 Write the entire answer in {language}. Do not switch languages.
@@ -1238,38 +4393,167 @@ Diagnostic result:
 - Diagnosis according to AAE/ESE nomenclature 2025: {diag_2025}
 - Complementary diagnosis: {comp_diag}
 """.strip()
+    return [
+        {"role": "system", "content": "You are an endodontics professor."},
+        {"role": "user", "content": prompt},
+    ]
+
+# =========================
+# WEBSOCKET
+# =========================
+@app.websocket("/ws/{session_id}")
+async def conversa_ws(websocket: WebSocket, session_id: str):
+    """
+    One connection per session. Every message loads the session from the
+    store and saves it under the session lock (see locked_session), so turns
+    made over HTTP in the meantime are never overwritten. Client messages are
+    JSON objects with a "type":
+
+        {"type": "ask"}                     current question (as /perguntar/)
+        {"type": "answer", "text": "...", "include": ...}
+                                            one turn (as /responder/ with incluir;
+                                            "stream" pushes the explanation right after)
+        {"type": "diagnosis", ...}          as /diagnostico/ (idioma, nomenclatura)
+        {"type": "correct", "campo": ..., "text"/"codigo": ...}
+                                            as /corrigir/
+        {"type": "explain"}                 streamed explanation of the stored diagnosis
+        {"type": "reset"} / {"type": "ping"}
+
+    Server messages: ready, message (same payload as the HTTP endpoint under
+    "data"), explanation_token, explanation_done, error, pong. An explanation
+    ends with exactly one of explanation_done or error.
+    """
+    await websocket.accept()
+    CURRENT_TENANT.set(tenant_for_api_key(websocket.headers.get(API_KEY_HEADER)))
+    stage = await run_in_threadpool(update_session, session_id, lambda session: session["stage"])
+    await websocket.send_json({"type": "ready", "session_id": session_id, "stage": stage})
 
     try:
-        response = safe_chat_completion(
-            messages=[
-                {"role": "system", "content": "You are an endodontics professor."},
-                {"role": "user", "content": prompt},
-            ],
-            model=MODEL_EXPLAIN,
-            temperature=0.2,
-        )
-        explanation_text = (response.choices[0].message.content or "").strip()
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"mensagem": f"Error generating explanation: {str(e)}"})
+        while True:
+            message = safe_json_loads(await websocket.receive_text())
+            kind = message.get("type") if isinstance(message, dict) else None
+
+            with trace_span(f"ws.{kind or 'invalid'}", **{"session.id": session_id}):
+                try:
+                    if kind == "ping":
+                        await websocket.send_json({"type": "pong"})
+                    elif kind == "ask":
+                        data = await run_in_threadpool(update_session, session_id, current_prompt)
+                        await websocket.send_json({"type": "message", "data": data})
+                    elif kind == "answer":
+                        include = parse_include(message.get("include"))
+                        text, started = str(message.get("text") or ""), time.perf_counter()
+                        await run_in_threadpool(enforce_rate_limit, websocket, session_id)
+
+                        def answer_turn(session):
+                            data = process_answer(session_id, session, text, started)
+                            if include and include != "stream":
+                                return include_final_extras(session_id, session, data, include)
+                            if "diagnosis" in data:
+                                return {**data, "resultado": format_diagnosis_response(session, data["diagnosis"])}
+                            return data
+
+                        data = await run_in_threadpool(update_session, session_id, answer_turn)
+                        await websocket.send_json({"type": "message", "data": data})
+                        if include == "stream" and "diagnosis" in data:
+                            # Server-initiated: the explanation follows without another client request.
+                            await stream_explanation(websocket, session_id)
+                    elif kind == "diagnosis":
+                        diagnosis_language, nomenclature = parse_projection(message.get("idioma"), message.get("nomenclatura"))
+                        data = await run_in_threadpool(
+                            update_session, session_id,
+                            lambda session: diagnosis_response(session, diagnosis_language, nomenclature),
+                        )
+                        await websocket.send_json({"type": "message", "data": data})
+                    elif kind == "explain":
+                        await run_in_threadpool(enforce_rate_limit, websocket, session_id)
+                        await stream_explanation(websocket, session_id)
+                    elif kind == "correct":
+                        await run_in_threadpool(enforce_rate_limit, websocket, session_id)
+                        field, text, code = str(message.get("campo") or ""), message.get("text"), message.get("codigo")
+                        data = await run_in_threadpool(
+                            update_session, session_id,
+                            lambda session: process_correction(session_id, session, field, text, code),
+                        )
+                        await websocket.send_json({"type": "message", "data": data})
+                    elif kind == "reset":
+                        await run_in_threadpool(replace_session, session_id)
+                        await websocket.send_json({"type": "message", "data": {"mensagem": "Session reset successfully."}})
+                    else:
+                        await websocket.send_json({"type": "error", "mensagem": "Unknown message type."})
+                except HTTPException as exc:
+                    await websocket.send_json({"type": "error", "status": exc.status_code, "mensagem": exc.detail})
+    except WebSocketDisconnect:
+        pass
+
+
+def update_session(session_id: str, turn):
+    """Run turn(session) on a freshly loaded session under its lock and save it; returns turn's result."""
+    with locked_session(session_id) as session:
+        return turn(session)
+
+
+async def stream_explanation(websocket: WebSocket, session_id: str):
+    """
+    Forward explanation tokens to the socket as they arrive, then send exactly
+    one terminal frame: explanation_done, or error if the explanation failed.
+    """
+    session = await run_in_threadpool(find_session, session_id)
+    diagnosis = stored_diagnosis(session) if session else ("", "", "")
+    if not any(diagnosis):
+        await websocket.send_json({"type": "error", "status": 400, "mensagem": "No diagnosis is available yet."})
+        return
 
-    return JSONResponse(content={"explicacao": explanation_text})
+    parts = []
+    try:
+        async with aclosing(iter_explanation(session["language"] or "English", *diagnosis)) as tokens:
+            async for token in tokens:
+                parts.append(token)
+                await websocket.send_json({"type": "explanation_token", "token": token})
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        await websocket.send_json({"type": "error", "status": 500, "mensagem": f"Error generating explanation: {str(e)}"})
+        return
+    await websocket.send_json({"type": "explanation_done", "explicacao": "".join(parts).strip()})
 
 # =========================
 # RESET
 # =========================
 @app.post("/reset/")
-async def reset_session(session_id: str = Form(...)):
-    sessions[session_id] = empty_session()
+def reset_session(session_id: str = Form(...)):
+    replace_session(session_id)
     return {"mensagem": "Session reset successfully."}
 
+
+def replace_session(session_id: str) -> dict:
+    with session_lock(session_id):
+        previous = sessions.get(session_id)
+        if previous is not None and previous["stage"] == "triage":
+            record_screening(session_id, previous, "abandoned")
+        session = empty_session()
+        sessions[session_id] = session
+        log_event("reset", session_id)
+    return session
+
 # =========================
 # PDF
 # =========================
 @app.get("/pdf/{session_id}")
-async def gerar_pdf(session_id: str):
-    create_session_if_needed(session_id)
-    session = sessions[session_id]
-    answers = session.get("answers", {})
+def gerar_pdf(session_id: str):
+    # An unknown id gets an empty report; it is not stored.
+    session = find_session(session_id) or empty_session()
+    return StreamingResponse(
+        BytesIO(render_pdf(session_id, session)),
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": "inline; filename=endodontic_screening_report.pdf"
+        },
+    )
+
+
+def render_pdf(session_id: str, session: dict) -> bytes:
+    answer_key = session.get("answer_key", 0)
     diagnosis_result = session.get("diagnosis_result", {})
     language = session.get("language") or "English"
 
@@ -1299,7 +4583,7 @@ async def gerar_pdf(session_id: str):
 
     for q in QUESTION_DEFS:
         field = q["field"]
-        value = label_for_code(answers.get(field), language) if answers.get(field) else "Not answered"
+        value = label_for_answer(answer_key, field, language) if is_answered(answer_key, field) else "Not answered"
         for line in wrap_pdf_lines(f"- {field}: {value}", width=95):
             write_lines([line])
 
@@ -1319,12 +4603,361 @@ async def gerar_pdf(session_id: str):
         write_lines(["No diagnosis has been generated yet."])
 
     p.save()
-    buffer.seek(0)
+    return buffer.getvalue()
 
-    return StreamingResponse(
-    buffer,
-    media_type="application/pdf",
-    headers={
-        "Content-Disposition": "inline; filename=endodontic_screening_report.pdf"
-    },
-)
+# =========================
+# JOBS
+# =========================
+JOB_PRIORITIES = {"interativa": 0, "lote": 10}
+JOB_LOG = logging.getLogger("triagem.jobs")
+
+
+class JobQueue:
+    """
+    Persistent queue of background jobs in a local SQLite file.
+
+    Workers claim the oldest job of the best priority with a lease. A job
+    whose process died mid-run is claimed again once its lease expires, so
+    queued and interrupted jobs survive restarts (handlers are idempotent).
+    With more than one worker thread, the first one only takes interactive
+    jobs, so bulk work can never occupy every worker. A database error never
+    kills a worker: it backs off and retries, and a job whose result could not
+    be recorded is put back in the queue (or reclaimed when its lease expires).
+    """
+
+    def __init__(self, path: str, workers: int, lease: float):
+        self.path = str(path)
+        self.workers = max(0, workers)
+        self.lease = lease
+        self.completed = 0
+        self.failed = 0
+        self.errors = 0
+        self._pid = None
+        self._threads_pid = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_purge = 0.0
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, priority INTEGER NOT NULL, status TEXT NOT NULL, "
+                "params TEXT NOT NULL, tenant TEXT, result TEXT, error TEXT, artifact BLOB, "
+                "attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+                "started_at REAL, finished_at REAL, lease_until REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, created_at)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def ensure_running(self):
+        if self.workers == 0 or self._threads_pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads_pid != os.getpid():
+                self._threads_pid = os.getpid()
+                for number in range(self.workers):
+                    interactive_only = number == 0 and self.workers > 1
+                    threading.Thread(
+                        target=self._run, args=(interactive_only,), name=f"job-worker-{number}", daemon=True
+                    ).start()
+
+    def submit(self, kind: str, params: dict, priority: int, tenant: str = None) -> str:
+        job_id = os.urandom(8).hex()
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO jobs (id, kind, priority, status, params, tenant, created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, priority, json.dumps(params, ensure_ascii=False), tenant, time.time()),
+            )
+        self.ensure_running()
+        self._wake.set()
+        return job_id
+
+    def claim(self, max_priority: int):
+        now = time.time()
+        with self._lock:
+            row = self._connection().execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE id = (SELECT id FROM jobs WHERE (status = 'queued' OR (status = 'running' AND lease_until < ?)) "
+                "AND priority <= ? ORDER BY priority, created_at LIMIT 1) "
+                "RETURNING id, kind, params, tenant, attempts",
+                (now, now + self.lease, now, max_priority),
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, params, tenant, attempts = row
+        return {"id": job_id, "kind": kind, "params": json.loads(params), "tenant": tenant, "attempts": attempts}
+
+    def finish(self, job_id: str, result=None, error: str = None, artifact: bytes = None):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, artifact = ?, finished_at = ?, lease_until = NULL "
+                "WHERE id = ?",
+                (
+                    "failed" if error is not None else "done",
+                    None if result is None else json.dumps(result, ensure_ascii=False),
+                    error,
+                    artifact,
+                    time.time(),
+                    job_id,
+                ),
+            )
+        if error is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT id, kind, priority, status, result, error, artifact IS NOT NULL, attempts, "
+                "created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "kind", "priority", "status", "result", "error", "has_artifact", "attempts",
+                "created_at", "started_at", "finished_at")
+        job = dict(zip(keys, row))
+        job["result"] = safe_json_loads(job["result"]) if job["result"] else None
+        job["has_artifact"] = bool(job["has_artifact"])
+        return job
+
+    def artifact(self, job_id: str):
+        with self._lock:
+            row = self._connection().execute("SELECT artifact FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def requeue(self, job_id: str):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE jobs SET status = 'queued', lease_until = NULL WHERE id = ? AND status = 'running'", (job_id,)
+            )
+
+    def purge(self, before: float) -> int:
+        with self._lock:
+            return self._connection().execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (before,)
+            ).rowcount
+
+    def _run(self, interactive_only: bool):
+        max_priority = JOB_PRIORITIES["interativa"] if interactive_only else max(JOB_PRIORITIES.values())
+        backoff = 0.0
+        while True:
+            job = None
+            try:
+                job = self.claim(max_priority)
+                if job is None:
+                    # Submissions in this process wake the workers; other processes' are polled.
+                    self._wake.wait(timeout=1.0)
+                    self._wake.clear()
+                    if time.time() - self._last_purge > 60:
+                        self._last_purge = time.time()
+                        self.purge(time.time() - JOB_RETENTION_SECONDS)
+                else:
+                    self.execute(job)
+                backoff = 0.0
+            except Exception:
+                # e.g. a locked database; keep the worker alive and retry after a pause
+                self.errors += 1
+                JOB_LOG.exception("job worker error%s", f" on job {job['id']}" if job else "")
+                if job is not None:
+                    try:
+                        self.requeue(job["id"])
+                    except Exception:
+                        pass  # still running with a lease, so it is reclaimed once the lease expires
+                backoff = min(30.0, backoff * 2 or 0.5)
+                time.sleep(backoff)
+
+    def execute(self, job: dict):
+        if job["attempts"] > JOB_MAX_ATTEMPTS:
+            self.finish(job["id"], error=f"Gave up after {JOB_MAX_ATTEMPTS} interrupted attempts.")
+            return
+        handler = JOB_HANDLERS.get(job["kind"])
+        if handler is None:
+            self.finish(job["id"], error=f"Unknown job type '{job['kind']}'.")
+            return
+        # LLM tokens spent by the job count against the tenant that submitted it.
+        tenant = CURRENT_TENANT.set(job["tenant"])
+        try:
+            with trace_span("job.run", **{"job.id": job["id"], "job.kind": job["kind"]}):
+                outcome = handler(job["params"])
+        except Exception as exc:
+            self.finish(job["id"], error=str(exc))
+            return
+        finally:
+            CURRENT_TENANT.reset(tenant)
+        result, artifact = outcome if isinstance(outcome, tuple) else (outcome, None)
+        self.finish(job["id"], result=result, artifact=artifact)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"workers": self.workers, "completed": self.completed, "failed": self.failed, "errors": self.errors, **counts}
+
+
+JOB_QUEUE = JobQueue(JOBS_DB_PATH, JOB_WORKERS, JOB_LEASE_SECONDS)
+
+
+def run_explanation_job(params: dict):
+    return {"explicacao": generate_explanation(params["language"], *params["diagnosis"])}
+
+
+def run_pdf_job(params: dict):
+    session = {**empty_session(), **params["session"]}
+    pdf = render_pdf(params["session_id"], session)
+    return {"media_type": "application/pdf", "bytes": len(pdf)}, pdf
+
+
+def run_bulk_diagnosis_job(params: dict):
+    texts = DIAGNOSIS_TEXTS[params["idioma"]]
+    keys = params["keys"]
+    complete = [all(answer_ids(key)) for key in keys]
+    # Complete answer sets are resolved in one vectorized lookup; partial ones
+    # go through run_diagnosis_from_session for the adaptive-questioning rules.
+    outcomes = lookup_outcomes([key if done else 0 for key, done in zip(keys, complete)])
+    results = []
+    for key, done, outcome in zip(keys, complete, outcomes.tolist()):
+        if not done:
+            results.append(run_diagnosis_from_session({"answer_key": key}, params["idioma"]))
+        elif outcome < 0:
+            results.append({"ok": False, "type": "not_found"})
+        else:
+            results.append({"ok": True, **dict(zip(DIAGNOSIS_FIELDS, texts[outcome]))})
+    return {"total": len(results), "diagnosed": sum(1 for item in results if item["ok"]), "results": results}
+
+
+# tipo -> handler(params), returning the result or (result, file bytes).
+JOB_HANDLERS = {
+    "explicacao": run_explanation_job,
+    "pdf": run_pdf_job,
+    "diagnostico_lote": run_bulk_diagnosis_job,
+}
+JOB_DEFAULT_PRIORITY = {"explicacao": "interativa", "pdf": "interativa", "diagnostico_lote": "lote"}
+
+
+def job_params(kind: str, session_id: str, raw_answers: str, idioma: str) -> dict:
+    """
+    Validate a submission and snapshot everything the job needs, so it does
+    not depend on the session still existing when it runs.
+    """
+    if kind in ("explicacao", "pdf"):
+        session = find_session(session_id) if session_id else None
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found.")
+        if kind == "pdf":
+            snapshot = {key: session[key] for key in ("answer_key", "diagnosis_result", "language")}
+            return {"session_id": session_id, "session": snapshot}
+        diagnosis = stored_diagnosis(session)
+        if not any(diagnosis):
+            raise HTTPException(status_code=400, detail="No diagnosis is available yet. Run /diagnostico/ first.")
+        return {"language": session["language"] or "English", "diagnosis": list(diagnosis)}
+
+    answers = safe_json_loads(raw_answers) if raw_answers else None
+    if not isinstance(answers, list) or not answers:
+        raise HTTPException(status_code=400, detail="answers must be a non-empty JSON array of answer objects.")
+    if len(answers) > BULK_DIAGNOSIS_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_DIAGNOSIS_MAX} answer sets per job.")
+    diagnosis_language, _ = parse_projection(idioma, None)
+    return {"keys": [pack_answers(parse_client_answers(item)) for item in answers], "idioma": diagnosis_language}
+
+
+def job_response(job: dict) -> dict:
+    payload = {
+        "tarefa_id": job["id"],
+        "tipo": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+    if job["status"] == "done":
+        payload["resultado"] = job["result"]
+        if job["has_artifact"]:
+            payload["arquivo"] = f"/tarefas/{job['id']}/arquivo"
+    elif job["status"] == "failed":
+        payload["erro"] = job["error"]
+    return payload
+
+
+@app.post("/tarefas/")
+def criar_tarefa(
+    request: Request,
+    tipo: str = Form(...),
+    session_id: str = Form(None),
+    answers: str = Form(None),
+    idioma: str = Form(None),
+    prioridade: str = Form(None),
+):
+    """
+    Queue a background job and return its id right away (202). `tipo` is
+    "explicacao" or "pdf" (of the session's current state) or
+    "diagnostico_lote" (`answers`: JSON array of canonical answer objects).
+    `prioridade` is "interativa" or "lote"; bulk diagnosis defaults to "lote".
+    Poll /tarefas/{id} or subscribe to /tarefas/{id}/eventos.
+    """
+    if tipo not in JOB_HANDLERS:
+        raise HTTPException(status_code=400, detail=f"tipo must be one of {sorted(JOB_HANDLERS)}.")
+    priority_name = prioridade or JOB_DEFAULT_PRIORITY[tipo]
+    if priority_name not in JOB_PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"prioridade must be one of {sorted(JOB_PRIORITIES)}.")
+    enforce_rate_limit(request, session_id)
+    params = job_params(tipo, session_id, answers, idioma)
+    job_id = JOB_QUEUE.submit(tipo, params, JOB_PRIORITIES[priority_name], CURRENT_TENANT.get())
+    return JSONResponse(
+        status_code=202,
+        content={"tarefa_id": job_id, "status": "queued", "url": f"/tarefas/{job_id}"},
+    )
+
+
+@app.get("/tarefas/{job_id}")
+def consultar_tarefa(job_id: str):
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job_response(job)
+
+
+@app.get("/tarefas/{job_id}/arquivo")
+def arquivo_tarefa(job_id: str):
+    job = JOB_QUEUE.get(job_id)
+    if job is None or not job["has_artifact"]:
+        raise HTTPException(status_code=404, detail="Job has no file.")
+    headers = {"Content-Disposition": "inline; filename=endodontic_screening_report.pdf"} if job["kind"] == "pdf" else None
+    return Response(
+        content=JOB_QUEUE.artifact(job_id),
+        media_type=(job["result"] or {}).get("media_type", "application/octet-stream"),
+        headers=headers,
+    )
+
+
+@app.get("/tarefas/{job_id}/eventos")
+async def eventos_tarefa(job_id: str):
+    """Server-sent events: one "status" event per state change, ending with "done"."""
+    job = await run_in_threadpool(JOB_QUEUE.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def events():
+        current = job
+        status = None
+        while True:
+            if current is None:
+                break
+            if current["status"] != status:
+                status = current["status"]
+                yield f"event: status\ndata: {json.dumps(job_response(current), ensure_ascii=False)}\n\n"
+            if status in ("done", "failed"):
+                break
+            await asyncio.sleep(0.5)
+            current = await run_in_threadpool(JOB_QUEUE.get, job_id)
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
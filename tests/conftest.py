@@ -0,0 +1,84 @@
+"""
+Shared fixtures. main.py reads its configuration at import time, so the
+environment is fixed here before it is imported: a fake API key (the OpenAI
+client is replaced by StubOpenAI), the in-memory session store and no
+background writers.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ.update({
+    "OPENAI_API_KEY": "test-key",
+    "OFFLINE_MODE": "0",
+    "SESSION_STORE": "memory",
+    "SESSION_SWEEP_INTERVAL": "0",
+    "EVENT_LOG_DIR": "",
+    "ANALYTICS_DIR": "",
+    "STATE_TOKEN_SECRET": "",
+    "JOBS_DB_PATH": os.path.join(tempfile.mkdtemp(prefix="endo10-tests-"), "jobs.sqlite3"),
+    "JOB_WORKERS": "0",
+})
+
+import fake_openai  # noqa: E402
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+class StubOpenAI:
+    """
+    Stands in for main.client. Answers like fake_openai (first allowed code
+    for extractions, a fixed explanation otherwise), streams word by word when
+    asked to, and records every call.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls.append(kwargs)
+        if self.delay:
+            time.sleep(self.delay)
+        content = fake_openai.fake_content(kwargs)
+        if kwargs.get("stream"):
+            return iter([
+                types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=word))])
+                for word in content.split(" ")
+            ])
+        usage = fake_openai.fake_usage(kwargs, content)
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))],
+            usage=types.SimpleNamespace(**usage),
+        )
+
+
+@pytest.fixture
+def stub_openai(monkeypatch):
+    stub = StubOpenAI()
+    monkeypatch.setattr(main, "client", stub)
+    for breaker in main.LLM_BREAKERS.values():
+        breaker.record_success()
+    return stub
+
+
+@pytest.fixture
+def client(stub_openai):
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def session_id(request):
+    return f"test-{request.node.name}-{os.urandom(4).hex()}"
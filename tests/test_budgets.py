@@ -0,0 +1,105 @@
+import threading
+
+import main
+
+
+def call_as(tenant, prompt, results):
+    main.CURRENT_TENANT.set(tenant)
+    results.append(main.safe_chat_completion([{"role": "user", "content": prompt}], main.MODEL_TRANSLATE))
+
+
+def test_concurrent_identical_calls_are_charged_once(stub_openai, monkeypatch):
+    monkeypatch.setattr(main, "LLM_TOKEN_BUDGET", 100_000)
+    stub_openai.delay = 0.2
+    tenant = "test-concurrent"
+    prompt = "Detect the language of the following text: concurrency"
+    results = []
+    threads = [threading.Thread(target=call_as, args=(tenant, prompt, results)) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 10
+    assert len(stub_openai.calls) == 1
+    assert main.sessions.get_counter(main.budget_counter_key(tenant)) == results[0].usage.total_tokens > 0
+
+
+def test_exhausted_budget_blocks_upstream_calls(stub_openai, monkeypatch):
+    monkeypatch.setattr(main, "LLM_TOKEN_BUDGET", 10)
+    tenant = "test-exhausted"
+    main.CURRENT_TENANT.set(tenant)
+    main.charge_llm_budget(10)
+    try:
+        main.safe_chat_completion([{"role": "user", "content": "x"}], main.MODEL_TRANSLATE)
+    except main.LLMBudgetExceeded:
+        pass
+    else:
+        raise AssertionError("expected LLMBudgetExceeded")
+    assert stub_openai.calls == []
+    main.CURRENT_TENANT.set(None)
+
+
+def test_explanation_degrades_to_offline_template_without_budget(client, stub_openai, monkeypatch, session_id):
+    monkeypatch.setattr(main, "LLM_TOKEN_BUDGET", 10)
+    main.sessions.update_counter(main.budget_counter_key("anonymous"), lambda spent: 10)
+    response = client.post("/explicacao/", data={
+        "session_id": session_id,
+        "diagnosis_aae_2009_2013": "Budget Pulp",
+    })
+    assert response.status_code == 200
+    assert "Budget Pulp" in response.json()["explicacao"]
+    assert stub_openai.calls == []
+
+
+def test_coalesced_followers_from_other_tenants_pay_their_share(stub_openai, monkeypatch):
+    monkeypatch.setattr(main, "LLM_TOKEN_BUDGET", 100_000)
+    stub_openai.delay = 0.2
+    tenants = ["test-share-a", "test-share-b"]
+    prompt = "Detect the language of the following text: shared"
+    results = []
+    threads = [threading.Thread(target=call_as, args=(tenants[n % 2], prompt, results)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(stub_openai.calls) == 1
+    tokens = results[0].usage.total_tokens
+    spent = [main.sessions.get_counter(main.budget_counter_key(tenant)) for tenant in tenants]
+    # The leader's tenant pays once; the other tenant pays once per follower.
+    assert sorted(spent) == [tokens, 3 * tokens]
+
+
+def test_rejected_request_does_not_spend_other_buckets(monkeypatch):
+    monkeypatch.setattr(main, "RATE_LIMIT_PER_MINUTE", 0.001)
+    monkeypatch.setattr(main, "RATE_LIMIT_BURST", 2)
+    suffix = main.os.urandom(4).hex()
+    busy_session, principal = f"s-{suffix}", f"ip:{suffix}"
+    assert main.rate_limit_wait(f"other-{suffix}", busy_session) == 0
+    assert main.rate_limit_wait(f"other-{suffix}", busy_session) == 0
+    # The session bucket is empty: rejected, and the principal keeps both tokens.
+    assert main.rate_limit_wait(principal, busy_session) > 0
+    assert main.rate_limit_wait(principal, f"a-{suffix}") == 0
+    assert main.rate_limit_wait(principal, f"b-{suffix}") == 0
+    assert main.rate_limit_wait(principal, f"c-{suffix}") > 0
+
+
+def test_streamed_explanation_checks_the_budget_off_the_event_loop(stub_openai, monkeypatch):
+    threads = []
+    check_llm_budget = main.check_llm_budget
+
+    def recording_check():
+        threads.append(threading.current_thread().name)
+        check_llm_budget()
+
+    monkeypatch.setattr(main, "check_llm_budget", recording_check)
+    tokens = []
+
+    async def collect():
+        async for token in main.iter_explanation("English", "Threadpool Pulp", "", ""):
+            tokens.append(token)
+
+    main.asyncio.run(collect())
+    assert tokens
+    assert threads and threading.main_thread().name not in threads
@@ -0,0 +1,30 @@
+import httpx
+from openai import APIConnectionError
+
+import build_explanations
+import main
+
+
+def test_upstream_failures_are_not_written_to_the_corpus(tmp_path, stub_openai, monkeypatch):
+    calls = []
+
+    def flaky(**kwargs):
+        calls.append(kwargs)
+        if len(calls) % 2:
+            raise APIConnectionError(request=httpx.Request("POST", "http://upstream.invalid/v1/chat/completions"))
+        return stub_openai.create(**kwargs)
+
+    monkeypatch.setattr(main, "EXPLANATION_CORPUS", None)
+    monkeypatch.setattr(main, "LLM_MAX_RETRIES", 0)
+    monkeypatch.setattr(main.CircuitBreaker, "allow", lambda self: True)
+    monkeypatch.setattr(stub_openai.chat.completions, "create", flaky)
+    output = tmp_path / "explanations.bin"
+
+    assert build_explanations.main_cli(["--languages", "English", "--output", str(output), "--workers", "1"]) == 1
+
+    corpus = main.load_explanation_corpus(str(output))
+    triples = sorted(set(main.DIAGNOSIS_TEXTS["en"]))
+    written = [triple for triple in triples if corpus.get("English", *triple) is not None]
+    assert len(written) == len(triples) // 2
+    for triple in written:
+        assert corpus.get("English", *triple) != main.offline_explanation("English", *triple)
@@ -0,0 +1,59 @@
+"""
+Parity between the compiled decision matrices and a plain pandas lookup over
+the canonicalized sheets, written independently of DecisionMatrix.
+"""
+import pytest
+
+import main
+
+WILDCARD_PERCUSSION = {"percussion_normal", "percussion_sensitive"}
+
+
+def pandas_lookup(frame, codes):
+    """Row label for a complete answer dict: exact rows, else the percussion wildcard; conflicts give None."""
+    candidates = [codes]
+    if codes["PERCUSSION"] in WILDCARD_PERCUSSION:
+        candidates.append({**codes, "PERCUSSION": "percussion_na"})
+    for candidate in candidates:
+        mask = True
+        for field, code in candidate.items():
+            mask = mask & (frame[f"__code_{field}"] == code)
+        labels = list(frame.index[mask])
+        diagnoses = {main.diagnosis_triple(label, frame) for label in labels}
+        if len(diagnoses) == 1:
+            return labels[0]
+    return None
+
+
+def reachable_answers():
+    for key in main.iter_all_combinations():
+        if main.is_reachable_combination(key):
+            yield key, {field: main.answer_code(key, field) for field in main.FIELD_ORDER}
+
+
+@pytest.mark.parametrize("language", list(main.DIAGNOSIS_FRAMES))
+def test_decision_matrix_matches_pandas_lookup(language):
+    frame = main.DIAGNOSIS_FRAMES[language]
+    matrix = main.DECISION_MATRICES[language]
+    keys, expected = [], []
+    for key, codes in reachable_answers():
+        keys.append(key)
+        expected.append(pandas_lookup(frame, codes))
+    positions = matrix.match([main.answer_ids(key) for key in keys])
+    assert [matrix.labels[p] if p >= 0 else None for p in positions] == expected
+
+
+def test_find_outcome_matches_pandas_lookup():
+    frame = main.DIAGNOSIS_FRAMES["en"]
+    texts = main.DIAGNOSIS_TEXTS["en"]
+    diagnosed = 0
+    for key, codes in reachable_answers():
+        label = pandas_lookup(frame, codes)
+        outcome = main.find_outcome(key)
+        if label is None:
+            assert outcome is None
+        else:
+            diagnosed += 1
+            assert texts[outcome] == main.diagnosis_triple(label, frame)
+        assert main.lookup_outcomes([key])[0] == (-1 if outcome is None else outcome)
+    assert diagnosed > 0
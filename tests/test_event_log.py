@@ -0,0 +1,43 @@
+import time
+
+import main
+
+
+def turn(session_id, field, code):
+    return {"k": "turn", "s": session_id, "t": time.time(), "f": field, "c": code}
+
+
+def write(log, *events):
+    for event in events:
+        log.queue.put(event)
+    log.flush()
+
+
+def test_snapshot_after_event_count_and_replay_from_the_tail(tmp_path):
+    log = main.EventLog(tmp_path, segment_bytes=1 << 30, snapshot_events=3)
+    write(log, turn("a", "PAIN", "pain_present"), turn("a", "ONSET", "onset_spontaneous"))
+    assert log.segment == 0
+    write(log, turn("b", "PAIN", "pain_absent"))
+    assert log.segment == 1 and log.events_since_snapshot == 0
+    write(log, turn("a", "PULP VITALITY", "pulp_normal"), {"k": "reset", "s": "b", "t": time.time()})
+
+    restarted = main.EventLog(tmp_path, segment_bytes=1 << 30)
+    state = restarted.replay()
+    assert state == {"a": {"l": None, "st": True, "h": [], "a": {
+        "PAIN": "pain_present", "ONSET": "onset_spontaneous", "PULP VITALITY": "pulp_normal",
+    }}}
+    assert restarted.segment == 1
+    # Only the snapshot and the tail after it are read back.
+    assert [path.name for path in sorted(tmp_path.glob("snapshot-*.json"))] == ["snapshot-00000001.json"]
+
+
+def test_snapshot_after_interval_even_without_new_events(tmp_path):
+    log = main.EventLog(tmp_path, segment_bytes=1 << 30, snapshot_interval=0.05)
+    write(log, turn("a", "PAIN", "pain_present"))
+    assert log.segment == 0
+    time.sleep(0.1)
+    log.flush()
+    assert log.segment == 1
+    assert not hasattr(log, "state")
+    log.flush()
+    assert log.segment == 1
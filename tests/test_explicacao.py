@@ -0,0 +1,70 @@
+import types
+
+import httpx
+import pytest
+
+import main
+from openai import APIConnectionError
+
+
+@pytest.fixture
+def upstream_down(stub_openai, monkeypatch):
+    def refuse(**kwargs):
+        stub_openai.calls.append(kwargs)
+        raise APIConnectionError(request=httpx.Request("POST", "http://upstream.invalid/v1/chat/completions"))
+
+    monkeypatch.setattr(stub_openai.chat.completions, "create", refuse)
+    monkeypatch.setattr(main, "LLM_MAX_RETRIES", 0)
+    return stub_openai
+
+
+def test_explanation_falls_back_when_retries_are_exhausted(client, upstream_down, session_id):
+    response = client.post("/explicacao/", data={"session_id": session_id, "diagnosis_aae_2009_2013": "Exhausted Pulp"})
+    assert response.status_code == 200
+    assert "Exhausted Pulp" in response.json()["explicacao"]
+    assert len(upstream_down.calls) == 1
+
+
+def test_explanation_falls_back_while_breaker_is_open(client, stub_openai, session_id):
+    breaker = main.breaker_for(main.MODEL_EXPLAIN)
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    response = client.post("/explicacao/", data={"session_id": session_id, "diagnosis_aae_2009_2013": "Breaker Pulp"})
+    assert response.status_code == 200
+    assert "Breaker Pulp" in response.json()["explicacao"]
+    assert stub_openai.calls == []
+
+
+def test_stream_falls_back_before_the_first_token(client, upstream_down, session_id):
+    main.sessions[session_id] = {
+        **main.empty_session(),
+        "language": "English",
+        "diagnosis_result": {"DIAGNOSIS (AAE NOMENCLATURE 2009/2013)": "Streamed Pulp"},
+    }
+    response = client.get(f"/explicacao/stream/{session_id}")
+    assert response.status_code == 200
+    assert "event: error" not in response.text
+    assert "Streamed Pulp" in response.text
+    assert response.text.endswith("event: done\ndata: {}\n\n")
+
+
+def test_stream_closed_midway_settles_a_half_open_breaker(stub_openai, monkeypatch):
+    def stream(**kwargs):
+        assert kwargs["stream"]
+        for word in ["one ", "two ", "three"]:
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=word))])
+
+    monkeypatch.setattr(stub_openai.chat.completions, "create", stream)
+    breaker = main.breaker_for(main.MODEL_EXPLAIN)
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    monkeypatch.setattr(breaker, "cooldown", 0)
+    assert breaker.state == "half_open"
+
+    tokens = main.stream_chat_completion([{"role": "user", "content": "explain"}], main.MODEL_EXPLAIN)
+    assert next(tokens) == "one "
+    assert breaker.trial_in_flight
+    tokens.close()
+
+    assert breaker.state == "closed"
+    assert not breaker.trial_in_flight
@@ -0,0 +1,30 @@
+import main
+
+
+def test_tiktoken_cache_lookup(tmp_path, monkeypatch):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    assert not main.tiktoken_cached("o200k_base")
+    url = "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken"
+    (tmp_path / main.hashlib.sha1(url.encode()).hexdigest()).write_bytes(b"")
+    assert main.tiktoken_cached("o200k_base")
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", "")
+    assert not main.tiktoken_cached("o200k_base")
+
+
+def test_offline_mode_estimates_tokens(monkeypatch):
+    monkeypatch.setattr(main, "OFFLINE_MODE", True)
+    main.token_encoder.cache_clear()
+    try:
+        assert main.token_encoder() is None
+        assert main.count_tokens("x" * 10) == 3
+        assert main.trim_to_tokens("x" * 10, 2) == "x" * 8
+    finally:
+        main.token_encoder.cache_clear()
+
+
+def test_long_answers_are_trimmed_to_the_prompt_cap(monkeypatch):
+    monkeypatch.setattr(main, "EXTRACTION_MAX_PROMPT_TOKENS", main.extraction_prefix_tokens("PAIN") + 100)
+    messages, prompt_tokens, trimmed = main.build_extraction_messages("PAIN", "dor " * 1000)
+    assert trimmed
+    assert prompt_tokens == main.EXTRACTION_MAX_PROMPT_TOKENS
+    assert messages[1]["content"].startswith(main.EXTRACTION_PREFIXES["PAIN"])
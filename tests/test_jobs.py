@@ -0,0 +1,55 @@
+import sqlite3
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def job_queue(tmp_path, monkeypatch):
+    monkeypatch.setitem(main.JOB_HANDLERS, "eco", lambda params: {"eco": params["valor"]})
+    return main.JobQueue(tmp_path / "jobs.sqlite3", workers=1, lease=60)
+
+
+def wait_for(job_queue, job_id, status, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = job_queue.get(job_id)
+        if job["status"] == status:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} is {job_queue.get(job_id)['status']}, expected {status}")
+
+
+def test_worker_survives_a_failed_finish(job_queue, monkeypatch):
+    finish = job_queue.finish
+    failures = []
+
+    def flaky_finish(job_id, **kwargs):
+        if not failures:
+            failures.append(job_id)
+            raise sqlite3.OperationalError("database is locked")
+        return finish(job_id, **kwargs)
+
+    monkeypatch.setattr(job_queue, "finish", flaky_finish)
+    job_id = job_queue.submit("eco", {"valor": 1}, priority=0)
+    job = wait_for(job_queue, job_id, "done")
+
+    assert failures == [job_id]
+    assert job["result"] == {"eco": 1}
+    assert job["attempts"] == 2
+    # The same worker thread keeps serving the queue afterwards.
+    assert wait_for(job_queue, job_queue.submit("eco", {"valor": 2}, priority=0), "done")["result"] == {"eco": 2}
+    assert job_queue.stats()["errors"] == 1
+
+
+def test_worker_survives_a_failed_purge(job_queue, monkeypatch):
+    def broken_purge(before):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(job_queue, "purge", broken_purge)
+    job_queue.ensure_running()
+    time.sleep(1.5)
+    assert job_queue.stats()["errors"] >= 1
+    assert wait_for(job_queue, job_queue.submit("eco", {"valor": 3}, priority=0), "done")["result"] == {"eco": 3}
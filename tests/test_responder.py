@@ -0,0 +1,51 @@
+import main
+
+SCREENING = ["hello", "absent", "normal", "normal", "normal", "normal"]
+
+
+def answer(client, session_id, text):
+    response = client.post("/responder/", data={"indice": 0, "resposta_usuario": text, "session_id": session_id})
+    assert response.status_code == 200
+    return response.json()
+
+
+def screen(client, session_id):
+    for text in SCREENING:
+        payload = answer(client, session_id, text)
+    return payload
+
+
+def test_full_screening_reaches_a_diagnosis(client, session_id):
+    payload = screen(client, session_id)
+    assert payload["campo"] == "RADIOGRAPHY"
+    assert payload["diagnosis"]["ok"]
+    assert payload["diagnosis"]["diagnosis_aae_2009_2013"] == "Normal Pulp (AAE 2009/2013)"
+    session = main.find_session(session_id)
+    assert main.unpack_answers(session["answer_key"])["ONSET"] == "onset_na"
+
+
+def test_absent_pain_skips_the_onset_question(client, session_id):
+    answer(client, session_id, "hello")
+    payload = answer(client, session_id, "absent")
+    assert payload["campo"] == "PAIN"
+    assert payload["pergunta"].startswith("What was the response to the pulp vitality test?")
+
+
+def test_correction_reopens_a_field_and_rediagnoses(client, session_id):
+    screen(client, session_id)
+    reopened = client.post("/corrigir/", data={"session_id": session_id, "campo": "PAIN", "codigo": "pain_present"})
+    assert reopened.status_code == 200
+    assert reopened.json()["pergunta"].startswith("How did the pain start?")
+
+    fixed = client.post("/corrigir/", data={"session_id": session_id, "campo": "ONSET", "resposta_usuario": "spontaneous"})
+    assert fixed.status_code == 200
+    assert fixed.json()["diagnosis"]["ok"]
+    answers = main.unpack_answers(main.find_session(session_id)["answer_key"])
+    assert (answers["PAIN"], answers["ONSET"]) == ("pain_present", "onset_spontaneous")
+
+
+def test_correction_validation(client, session_id):
+    assert client.post("/corrigir/", data={"session_id": session_id, "campo": "PAIN", "codigo": "pain_present"}).status_code == 404
+    screen(client, session_id)
+    assert client.post("/corrigir/", data={"session_id": session_id, "campo": "TOOTH", "codigo": "x"}).status_code == 400
+    assert client.post("/corrigir/", data={"session_id": session_id, "campo": "PAIN", "codigo": "onset_na"}).status_code == 400
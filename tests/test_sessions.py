@@ -0,0 +1,70 @@
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_candidatos_does_not_create_unknown_sessions(client, session_id):
+    response = client.post("/candidatos/", data={"session_id": session_id})
+    assert response.status_code == 200
+    assert main.find_session(session_id) is None
+
+
+def test_candidatos_reads_the_stored_answers(client, session_id):
+    key = main.set_answer(0, "PAIN", "pain_absent")
+    main.sessions[session_id] = {**main.empty_session(), "stage": "triage", "answer_key": key}
+    answers = client.post("/candidatos/", data={"session_id": session_id}).json()["answers"]
+    assert answers["PAIN"] == "pain_absent"
+    assert answers["ONSET"] == "onset_na"
+
+
+def test_reset_replaces_the_session(client, session_id):
+    main.sessions[session_id] = {**main.empty_session(), "stage": "triage", "language": "English"}
+    assert client.post("/reset/", data={"session_id": session_id}).status_code == 200
+    assert main.find_session(session_id)["stage"] == "greeting"
+    assert client.get("/stats").json()["sessions"] >= 1
+
+
+def test_concurrent_turns_on_one_session_are_serialized(session_id, stub_openai, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "sessions", main.SQLiteSessionStore(tmp_path / "sessions.sqlite3"))
+    TestClient(main.app).post("/responder/", data={"indice": 0, "resposta_usuario": "hello", "session_id": session_id})
+    process_answer = main.process_answer
+
+    def slow_process_answer(*args):
+        time.sleep(0.3)
+        return process_answer(*args)
+
+    monkeypatch.setattr(main, "process_answer", slow_process_answer)
+    statuses = []
+
+    def answer(text):
+        response = TestClient(main.app).post(
+            "/responder/", data={"indice": 0, "resposta_usuario": text, "session_id": session_id}
+        )
+        statuses.append(response.status_code)
+
+    first = threading.Thread(target=answer, args=("absent",))
+    first.start()
+    time.sleep(0.1)
+    second = threading.Thread(target=answer, args=("normal",))
+    second.start()
+    first.join()
+    second.join()
+
+    assert statuses == [200, 200]
+    answers = main.unpack_answers(main.find_session(session_id)["answer_key"])
+    assert (answers["PAIN"], answers["PULP VITALITY"]) == ("pain_absent", "pulp_normal")
+
+
+def test_sqlite_session_lock_is_shared_between_workers(tmp_path):
+    path = tmp_path / "sessions.sqlite3"
+    worker_a, worker_b = main.SQLiteSessionStore(path), main.SQLiteSessionStore(path, lock_lease=0.2)
+    assert worker_a.acquire("s1", timeout=1)
+    assert not worker_b.acquire("s1", timeout=0.1)
+    assert worker_b.acquire("s2", timeout=0.1)
+    worker_a.release("s1")
+    assert worker_b.acquire("s1", timeout=0.1)
+    # A lease left behind by a dead worker is taken over once it expires.
+    assert worker_a.acquire("s1", timeout=1)
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def signed(monkeypatch):
+    monkeypatch.setattr(main, "STATE_TOKEN_SECRET", "test-secret")
+
+
+def triagem(client, **data):
+    return client.post("/triagem/", data={"language": "English", **data})
+
+
+def test_unsigned_answers_work_without_secret(client):
+    response = triagem(client, answers=json.dumps({"PAIN": "pain_present"}), resposta_usuario="spontaneous")
+    assert response.status_code == 200
+    assert response.json()["answers"] == {"PAIN": "pain_present", "ONSET": "onset_spontaneous"}
+
+
+def test_signed_state_round_trip(client, signed):
+    first = triagem(client, resposta_usuario="absent").json()
+    assert first["answers"] == {"PAIN": "pain_absent", "ONSET": "onset_na"}
+    second = triagem(client, state_token=first["state_token"], resposta_usuario="normal")
+    assert second.status_code == 200
+    assert second.json()["answers"]["PULP VITALITY"] == "pulp_normal"
+
+
+def test_unsigned_answers_rejected_with_secret(client, signed):
+    response = triagem(client, answers=json.dumps({"PAIN": "pain_present"}), resposta_usuario="spontaneous")
+    assert response.status_code == 401
+
+
+def test_tampered_state_token_rejected(client, signed):
+    token = triagem(client, resposta_usuario="absent").json()["state_token"]
+    forged = main.sign_state({"answers": {"PAIN": "pain_present"}, "language": "English"})
+    tampered = forged.split(".")[0] + "." + token.split(".")[1]
+    assert triagem(client, state_token=tampered, resposta_usuario="spontaneous").status_code == 401
@@ -0,0 +1,49 @@
+import types
+
+import main
+
+
+def receive_until(ws, *types_):
+    frames = []
+    while True:
+        frame = ws.receive_json()
+        frames.append(frame)
+        if frame["type"] in types_:
+            return frames
+
+
+def test_websocket_turns_keep_answers_given_over_http(client, session_id):
+    with client.websocket_connect(f"/ws/{session_id}") as ws:
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_json({"type": "answer", "text": "hello"})
+        assert ws.receive_json()["type"] == "message"
+
+        response = client.post("/responder/", data={"indice": 0, "resposta_usuario": "absent", "session_id": session_id})
+        assert response.status_code == 200
+
+        ws.send_json({"type": "answer", "text": "normal"})
+        assert ws.receive_json()["data"]["campo"] == "PULP VITALITY"
+
+    answers = main.unpack_answers(main.find_session(session_id)["answer_key"])
+    assert (answers["PAIN"], answers["PULP VITALITY"]) == ("pain_absent", "pulp_normal")
+
+
+def test_failed_explanation_ends_with_a_single_error_frame(client, stub_openai, session_id, monkeypatch):
+    def broken_stream(**kwargs):
+        yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content="Partial "))])
+        raise ValueError("malformed chunk")
+
+    monkeypatch.setattr(stub_openai.chat.completions, "create", broken_stream)
+    main.sessions[session_id] = {
+        **main.empty_session(),
+        "language": "English",
+        "stage": "completed",
+        "diagnosis_result": {"DIAGNOSIS (AAE NOMENCLATURE 2009/2013)": "Broken Stream Pulp"},
+    }
+    with client.websocket_connect(f"/ws/{session_id}") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "explain"})
+        frames = receive_until(ws, "error", "explanation_done")
+        assert [frame["type"] for frame in frames] == ["explanation_token", "error"]
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json()["type"] == "pong"